@@ -0,0 +1,88 @@
+"""
+Fixtures of the benchmark suite: a synthetic recording (size set on the command line), written in
+every input format, and the base config of a batch.
+"""
+import copy
+import os
+import sys
+import tracemalloc
+
+import mne
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'src', 'eeg_preprocessing_umcu'))
+
+from eeg_processing_settings import settings
+from eeg_processing_synthetic import synthetic_raw, write_recording
+
+input_formats = {'txt': '.txt', 'edf': '.edf', 'bdf': '.bdf', 'vhdr': '.vhdr', 'fif': '_raw.fif'}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('eeg', 'synthetic recording of the benchmarks')
+    group.addoption('--eeg-montage', default='biosemi64', help='standard MNE montage (default biosemi64)')
+    group.addoption('--eeg-sfreq', type=float, default=512.0, help='sample frequency in Hz (default 512)')
+    group.addoption('--eeg-duration', type=float, default=120.0, help='duration in s (default 120)')
+    group.addoption('--eeg-rounds', type=int, default=3, help='timed rounds per stage (default 3)')
+
+
+def pytest_configure(config):
+    mne.set_log_level('ERROR')
+
+
+@pytest.fixture(scope='session')
+def options(request):
+    return {name: request.config.getoption('--eeg-' + name) for name in ('montage', 'sfreq', 'duration', 'rounds')}
+
+
+@pytest.fixture(scope='session')
+def recording(options):
+    """Synthetic recording with all artefact types."""
+    return synthetic_raw(options['montage'], sfreq=options['sfreq'], duration=options['duration'])
+
+
+@pytest.fixture(scope='session')
+def input_files(recording, tmp_path_factory):
+    """The recording written in every input format."""
+    directory = tmp_path_factory.mktemp('input')
+    return {name: write_recording(recording, str(directory / ('rec' + extension)))
+            for name, extension in input_formats.items()}
+
+
+@pytest.fixture
+def config(recording, options, tmp_path):
+    """Config of a batch (no interaction) with the recording as current file."""
+    config = copy.deepcopy(settings)
+    config.update({'input_file_pattern': '.bdf_64', 'montage': options['montage'], 'file_name': 'rec.bdf',
+                   'sample_frequency': recording.info['sfreq'], 'epoch_length': 8.0, 'nr_ica_components': 20,
+                   'rerun': 0, 'reuse_ica': 0, 'batch_output_subdirectory': str(tmp_path),
+                   'max_channels': len(recording.ch_names) - len(recording.info['bads']),
+                   ('rec.bdf', 'bad'): list(recording.info['bads'])})
+    config['montage', config['input_file_pattern']] = options['montage']
+    return config
+
+
+@pytest.fixture
+def hooks():
+    """Callbacks without output."""
+    return {'log': lambda msg, panel='run': None, 'progress': lambda bar, value, maximum=None: None,
+            'warn': lambda msg: None, 'select_channels_to_be_dropped': None}
+
+
+@pytest.fixture
+def run_stage(benchmark, options):
+    """
+    Function that times stage(*setup()) in rounds (fresh arguments from setup for every round) and
+    adds the peak of the memory allocated during one extra (first) run to the benchmark results.
+    """
+    def run(stage, setup):
+        args = setup()
+        tracemalloc.start()
+        stage(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del args
+        benchmark.extra_info['peak_memory_mb'] = round(peak / 1024**2, 1)
+        return benchmark.pedantic(stage, setup=lambda: (setup(), {}), rounds=options['rounds'], iterations=1)
+    return run
@@ -0,0 +1,115 @@
+"""
+Benchmarks of the stages of the pipeline on a synthetic recording: time (pytest-benchmark) and peak
+memory (extra_info 'peak_memory_mb') per stage.
+"""
+import copy
+import os
+
+import eeg_processing_beamformer
+import mne
+import pytest
+from conftest import input_formats
+from eeg_processing_beamformer import apply_spatial_filter, create_spatial_filter
+from eeg_processing_engine import apply_epoch_selection, perform_ica
+from eeg_processing_export import save_epoch_data, save_whole_EEG
+from eeg_processing_filters import broadband_filter, filter_raw
+from eeg_processing_io import create_raw
+
+no_montage_files = ['*.vhdr', '*.fif']
+
+
+@pytest.fixture(scope='module')
+def filtered(recording):
+    """The recording filtered to 0.5-47 Hz, with the bad channels interpolated and average reference."""
+    raw = filter_raw(recording.copy(), **broadband_filter)
+    raw.interpolate_bads(reset_bads=True)
+    raw.set_eeg_reference('average', projection=True)
+    return raw.apply_proj()
+
+
+@pytest.fixture
+def fsaverage():
+    """Skip the beamformer benchmarks if the fsaverage head model has not been downloaded."""
+    data_dir = mne.get_config('MNE_DATA', os.path.join(os.path.expanduser('~'), 'mne_data'))
+    if not os.path.isdir(os.path.join(data_dir, 'MNE-fsaverage-data', 'fsaverage', 'bem')):
+        pytest.skip('fsaverage not downloaded, run eeg_processing_beamformer.get_fsaverage_dir() once')
+
+
+@pytest.mark.parametrize('input_format', list(input_formats) + ['txt_cached'])
+def test_create_raw(run_stage, config, hooks, input_files, input_format, tmp_path):
+    """Loading the recording with create_raw (txt_cached: from the binary copy of the .txt file)."""
+    extension = input_formats[input_format.replace('_cached', '')]
+    config.update(file_path=input_files[input_format.replace('_cached', '')],
+                  file_pattern='*.' + extension.rsplit('.', 1)[1], channel_names=[],
+                  txt_binary_cache=int(input_format == 'txt_cached'), txt_cache_directory=str(tmp_path))
+    montage = mne.channels.make_standard_montage(config['montage'])
+    if input_format == 'txt_cached': # binary copy written before timing
+        create_raw(copy.deepcopy(config), montage, no_montage_files, hooks)
+    run_stage(lambda c: create_raw(c, montage, no_montage_files, hooks), lambda: (copy.deepcopy(config),))
+
+
+def test_broadband_filter(run_stage, recording):
+    """0.5-47 Hz band-pass filter of the recording (as before bad channel selection, ICA and beamforming)."""
+    run_stage(lambda raw: filter_raw(raw, **broadband_filter), lambda: (recording.copy(),))
+
+
+def test_ica_fit(run_stage, config, hooks, filtered):
+    """Fitting ICA (1-47 Hz filtered copy, FastICA) and saving it."""
+    raw = filtered.copy()
+    raw.info['bads'] = config[config['file_name'], 'bad']
+    run_stage(lambda r, c: perform_ica(r, r, c, hooks, interactive=False), lambda: (raw, copy.deepcopy(config)))
+
+
+def test_ica_apply(run_stage, config, hooks, filtered):
+    """Removing two ICA components from the output signal."""
+    raw = filtered.copy()
+    raw.info['bads'] = config[config['file_name'], 'bad']
+    _, ica, _ = perform_ica(raw, raw, config, hooks, interactive=False)
+    ica.exclude = [0, 1]
+    run_stage(ica.apply, lambda: (raw.copy(),))
+
+
+@pytest.mark.parametrize('forward_cache', ['cold', 'warm'])
+def test_create_spatial_filter(run_stage, fsaverage, config, hooks, filtered, forward_cache, tmp_path):
+    """LCMV spatial filter, with the forward solution computed (cold) or from the memory cache (warm)."""
+    raw_b = filtered.copy().drop_channels(config[config['file_name'], 'bad'])
+    config['forward_cache_directory'] = str(tmp_path)
+    def setup():
+        if forward_cache == 'cold':
+            eeg_processing_beamformer.forward_solutions.clear()
+            for fn in os.listdir(tmp_path):
+                os.remove(tmp_path / fn)
+        return raw_b, config
+    run_stage(lambda r, c: create_spatial_filter(r, c, hooks), setup)
+
+
+def test_apply_spatial_filter(run_stage, fsaverage, config, hooks, filtered):
+    """Projection of the output signal to the atlas sources."""
+    raw_b = filtered.copy().drop_channels(config[config['file_name'], 'bad'])
+    spatial_filter = create_spatial_filter(raw_b, config, hooks)
+    run_stage(lambda raw: apply_spatial_filter(raw, config, spatial_filter, hooks), lambda: (filtered,))
+
+
+def test_epoching(run_stage, config, filtered):
+    """Cutting the output signal into the selected epochs."""
+    n_epochs = int(filtered.times[-1] // config['epoch_length'])
+    config[config['file_name'], 'epochs'] = list(range(0, n_epochs, 2))
+    run_stage(lambda raw: apply_epoch_selection(raw, config, raw.info['sfreq']), lambda: (filtered,))
+
+
+@pytest.mark.parametrize('output_format', ['txt', 'npy', 'fif'])
+def test_export_epochs(run_stage, config, hooks, filtered, output_format, tmp_path):
+    """Export of the selected epochs."""
+    n_epochs = int(filtered.times[-1] // config['epoch_length'])
+    config[config['file_name'], 'epochs'] = list(range(n_epochs))
+    config['output_formats'] = [output_format]
+    epochs = apply_epoch_selection(filtered, config, filtered.info['sfreq'])
+    epochs.load_data()
+    run_stage(lambda e: save_epoch_data(e, config, str(tmp_path / 'rec_Sensor_level'), hooks), lambda: (epochs,))
+
+
+@pytest.mark.parametrize('output_format', ['txt', 'npy', 'fif'])
+def test_export_continuous(run_stage, config, filtered, output_format, tmp_path):
+    """Export of the continuous output signal."""
+    config['output_formats'] = [output_format]
+    run_stage(lambda raw: save_whole_EEG(raw, config, str(tmp_path / 'rec_Sensor_level')), lambda: (filtered,))
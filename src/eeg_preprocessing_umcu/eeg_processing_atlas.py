@@ -0,0 +1,59 @@
+"""
+Desikan-Killiany atlas used as source space for beamforming: voxel positions, normals and labels.
+
+The atlas is shipped as DesikanVox.npz and loaded once per process. DesikanVox.xlsx and
+DesikanVoxLabels.csv are the editable originals; after changing them, regenerate the .npz with:
+
+    python eeg_processing_atlas.py
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import os
+
+import numpy as np
+
+# Directory containing the atlas files
+script_dir = os.path.dirname(os.path.abspath(__file__))
+atlas_file = os.path.join(script_dir, 'DesikanVox.npz')
+
+atlas = None # loaded atlas, per process
+
+def load_atlas(fn=atlas_file):
+    '''
+    Function that returns the atlas as dict with 'pos' (voxel positions in m), 'nn' (unit normals)
+    and 'labels' (region names, one per voxel). Loaded from file once, the arrays are read-only.
+    '''
+    global atlas
+    if atlas is None or atlas['file'] != fn:
+        with np.load(fn, allow_pickle=False) as f:
+            pos = f['pos']
+            nn = f['nn']
+            labels = f['labels'].tolist()
+        pos.flags.writeable = False
+        nn.flags.writeable = False
+        atlas = {'file': fn, 'pos': pos, 'nn': nn, 'labels': labels}
+    return atlas
+
+def convert_atlas(xlsx_fn, csv_fn, npz_fn):
+    '''
+    Function that converts the atlas voxel positions (.xlsx, no header) and labels (.csv, no header)
+    to the binary .npz file used by load_atlas. Normals point inwards (to the origin).
+    '''
+    # only needed for the conversion (openpyxl for .xlsx)
+    import pandas as pd
+    Voxels_pos = pd.read_excel(xlsx_fn, header=None).values.astype(float)
+    Voxels_nn = -Voxels_pos
+    # Normalize the normals to unit length
+    Voxels_nn /= np.linalg.norm(Voxels_nn, axis=1)[:, np.newaxis]
+    labels = pd.read_csv(csv_fn, header=None)[0].astype(str).to_numpy()
+    if len(labels) != len(Voxels_pos):
+        raise ValueError(f"{len(Voxels_pos)} voxel positions but {len(labels)} labels")
+    np.savez(npz_fn, pos=Voxels_pos, nn=Voxels_nn, labels=labels.astype(np.str_))
+    return npz_fn
+
+
+if __name__ == '__main__':
+    fn = convert_atlas(os.path.join(script_dir, 'DesikanVox.xlsx'),
+                       os.path.join(script_dir, 'DesikanVoxLabels.csv'), atlas_file)
+    print('Atlas written to ' + fn)
@@ -0,0 +1,211 @@
+"""
+LCMV beamforming of the EEG preprocessing pipeline (fsaverage head model, Desikan-Killiany atlas).
+
+The forward solution only depends on the channel set and their positions, the head model and the
+source positions, which are usually identical for all files of a batch. Forward solutions are
+therefore kept in a cache (in memory and on disk, both least recently used eviction), so only the
+data covariance and make_lcmv are computed per file.
+
+The spatial filter is applied to the output signal after downsampling, as one (n_sources, n_channels)
+matrix (average reference, bad channels and LCMV weights combined) in time chunks, so the source
+signal at the original sample frequency is never created. Resampling and the spatial filter are both
+linear, so the order does not change the result.
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import contextlib
+import hashlib
+import os
+from collections import OrderedDict
+
+import mne
+import numpy as np
+from eeg_processing_atlas import load_atlas
+from eeg_processing_filters import copy_filter_record
+
+subject = "fsaverage"
+trans = "fsaverage"
+
+source_chunk_samples = 10000 # samples projected to source space at once
+
+# in-memory caches, per process
+fsaverage_dir = None
+source_spaces = {} # source space per (bem, source positions)
+forward_solutions = OrderedDict() # forward solution per cache key, most recently used last
+
+def get_fsaverage_dir():
+    '''     Function that returns the fsaverage directory (downloaded on first use), once per process.     '''
+    global fsaverage_dir
+    if fsaverage_dir is None:
+        # only imported when beamforming is applied
+        from mne.datasets import fetch_fsaverage
+        fsaverage_dir = fetch_fsaverage(verbose=True)
+    return fsaverage_dir
+
+def get_source_space(bem, Voxels_pos, Voxels_nn):
+    '''     Function that sets up (once per process) the volume source space of the atlas voxels.     '''
+    key = (bem, hashlib.sha1(Voxels_pos.tobytes()).hexdigest())
+    if key not in source_spaces:
+        # Setting up source space according to Desikan-Killiany atlas
+        Voxels_pos_dict = {'rr':Voxels_pos, 'nn':Voxels_nn}
+        source_spaces[key] = mne.setup_volume_source_space(
+            subject=subject,
+            pos=Voxels_pos_dict,
+            mri=None,
+            bem=bem,
+        )
+    return source_spaces[key]
+
+def forward_cache_key(info, config, bem, Voxels_pos):
+    '''
+    Function that returns the cache key of a forward solution: a hash of the montage, the names and
+    positions of the channels (after dropping bad channels), the head model and the source positions.
+    '''
+    h = hashlib.sha1()
+    h.update(repr(config.get(('montage', config['input_file_pattern']), '')).encode())
+    h.update(repr(info['ch_names']).encode())
+    h.update(np.array([ch['loc'][:3] for ch in info['chs']]).tobytes())
+    h.update(repr(info['dev_head_t']['trans'].tolist() if info['dev_head_t'] is not None else None).encode())
+    h.update(os.path.basename(bem).encode())
+    h.update(trans.encode())
+    h.update(Voxels_pos.tobytes())
+    return h.hexdigest()
+
+def get_forward_cache_directory(config):
+    '''     Function that returns (and creates) the directory of the on-disk forward solution cache.     '''
+    cache_dir = config.get('forward_cache_directory', '').strip()
+    if not cache_dir:
+        data_dir = mne.get_config('MNE_DATA', os.path.join(os.path.expanduser('~'), 'mne_data'))
+        cache_dir = os.path.join(data_dir, 'eeg_preprocessing_umcu_forward_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def evict_forward_cache_files(cache_dir, max_bytes):
+    '''     Function that removes the least recently used forward solutions until the cache fits in max_bytes.     '''
+    files = [os.path.join(cache_dir, fn) for fn in os.listdir(cache_dir) if fn.endswith('-fwd.fif')]
+    files = sorted(files, key=os.path.getmtime) # least recently used first
+    total = sum(os.path.getsize(fn) for fn in files)
+    for fn in files:
+        if total <= max_bytes:
+            break
+        total -= os.path.getsize(fn)
+        with contextlib.suppress(OSError): # removed by another process
+            os.remove(fn)
+
+def get_forward_solution(info, config, hooks):
+    '''
+    Function that returns the forward solution for the channels in info: from the in-memory cache,
+    the on-disk cache, or computed with mne.make_forward_solution and stored in both caches.
+    '''
+    log = hooks['log']
+    bem = os.path.join(get_fsaverage_dir(), "bem", "fsaverage-5120-5120-5120-bem-sol.fif")
+    atlas = load_atlas()
+    Voxels_pos = atlas['pos']
+    key = forward_cache_key(info, config, bem, Voxels_pos)
+
+    if key in forward_solutions:
+        forward_solutions.move_to_end(key)
+        log("Forward solution reused from memory cache", 'run')
+        return forward_solutions[key].copy() # make_lcmv must not modify the cached solution
+
+    cache_dir = get_forward_cache_directory(config)
+    fn = os.path.join(cache_dir, key + '-fwd.fif')
+    if os.path.exists(fn):
+        fwd = mne.read_forward_solution(fn)
+        os.utime(fn) # mark as recently used
+        log("Forward solution loaded from cache " + fn, 'run')
+    else:
+        src = get_source_space(bem, Voxels_pos, atlas['nn'])
+        # Forward Solution
+        fwd = mne.make_forward_solution(
+            info,
+            trans=trans,
+            src=src,
+            bem=bem,
+            eeg=True,
+            mindist=0,
+            n_jobs=None
+        )
+        # write under a temporary name first, parallel workers may compute the same solution
+        tmp_fn = os.path.join(cache_dir, key + '.' + str(os.getpid()) + '.tmp-fwd.fif')
+        mne.write_forward_solution(tmp_fn, fwd, overwrite=True)
+        os.replace(tmp_fn, fn)
+        evict_forward_cache_files(cache_dir, config.get('forward_cache_max_bytes', 1024**3))
+
+    forward_solutions[key] = fwd
+    while len(forward_solutions) > config.get('forward_cache_size', 4):
+        forward_solutions.popitem(last=False) # least recently used
+    return fwd.copy()
+
+def create_spatial_filter(raw_b, config, hooks):
+    '''
+    Function used to create a spatial filter for the LCMV beamforming method.
+    The MNE function make_lcmv is used, the forward solution comes from the cache if possible.
+    '''
+    fwd = get_forward_solution(raw_b.info, config, hooks)
+
+    # Inverse Problem
+    data_cov = mne.compute_raw_covariance(raw_b)
+
+    # Create a new matrix noise_matrix (noise cov. matrix) with the same size as data_cov
+    noise_matrix = np.zeros_like(data_cov['data'])
+    diagonal_values = np.diag(data_cov['data'])
+    # Set the diagonal values of noise_matrix to the diagonal values of data_cov
+    np.fill_diagonal(noise_matrix, diagonal_values)
+    noise_cov = mne.Covariance(data=noise_matrix,
+                               names=data_cov['names'],
+                               bads=data_cov['bads'],
+                               projs=data_cov['projs'],
+                               nfree=data_cov['nfree']
+                               )
+    # LCMV beamformer
+    # only imported when beamforming is applied (slow import)
+    from mne.beamformer import make_lcmv
+    spatial_filter = make_lcmv(raw_b.info,
+                               fwd,
+                               data_cov,
+                               reg=0.05,
+                               noise_cov=noise_cov,
+                               pick_ori='max-power',
+                               weight_norm='unit-noise-gain',
+                               rank=None,
+                               )
+    return spatial_filter
+
+def spatial_filter_operator(raw, config, spatial_filter):
+    '''
+    Function that returns the matrix (n_sources, n_channels of raw) that maps the output signal to
+    the source signal: average reference, dropping the bad channels and the LCMV weights (with
+    whitening) in one. It is obtained by passing an identity signal through these steps.
+    '''
+    # only imported when beamforming is applied (slow import)
+    from mne.beamformer import apply_lcmv_raw
+    identity = mne.io.RawArray(np.eye(len(raw.ch_names)), raw.info.copy(), verbose=False)
+    identity.set_eeg_reference('average', projection=True, ch_type='eeg')
+    identity.apply_proj()
+    identity.drop_channels(config[config['file_name'], 'bad'])
+    return apply_lcmv_raw(identity, spatial_filter).data # column i: source signal of a unit signal on channel i
+
+def apply_spatial_filter(raw, config, spatial_filter, hooks):
+    '''
+    Function that applies the spatial filter created earlier to the final (downsampled)
+    raw EEG object used to export the final output. The source signal is computed in time
+    chunks of source_chunk_samples, in config['beamformer_dtype'] (float32 is faster, float64
+    the most accurate). The raw source object stores it as float64 (RawArray converts it).
+    '''
+    desikan_channel_names = load_atlas()['labels']
+    dtype = np.dtype(config.get('beamformer_dtype', 'float64'))
+    operator = spatial_filter_operator(raw, config, spatial_filter).astype(dtype)
+    data = np.empty((len(operator), raw.n_times), dtype=operator.dtype)
+    for start in range(0, raw.n_times, source_chunk_samples):
+        stop = min(start + source_chunk_samples, raw.n_times)
+        data[:, start:stop] = operator @ raw.get_data(start=start, stop=stop).astype(dtype, copy=False)
+    info = mne.create_info(
+        ch_names = desikan_channel_names, sfreq = raw.info['sfreq'], ch_types='eeg')
+    raw_source = mne.io.RawArray(data, info)
+    raw_source = copy_filter_record(raw, raw_source) # source signal has the filters of the sensor signal
+    msg = "Spatial filter applied to output signal at " + str(raw.info['sfreq']) + " Hz (" + \
+          str(len(raw_source.ch_names)) + " sources)"
+    hooks['log'](msg, 'run')
+    return raw_source
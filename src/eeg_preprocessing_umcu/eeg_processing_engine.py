@@ -0,0 +1,1038 @@
+"""
+Processing engine of the EEG preprocessing pipeline, independent of the PySimpleGUI front end.
+
+The GUI (eeg_processing_script.py) and headless runs both call run_batch / process_file. All
+communication with the outside world goes through a dict of callbacks (hooks), see headless_hooks.
+A previous batch can be rerun without GUI from the command line:
+
+    python eeg_processing_engine.py <previous_batch>.pkl [--output-directory <dir>] [--workers <n>]
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import argparse
+import hashlib
+import os
+import pickle
+import posixpath
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+
+import mne
+import numpy as np
+from eeg_processing_beamformer import apply_spatial_filter, create_spatial_filter
+from eeg_processing_export import save_epoch_data, save_whole_EEG
+from eeg_processing_filters import (
+    broadband_filter,
+    data_checksum,
+    filter_bank,
+    filter_output_raw,
+    filter_raw,
+    ica_filter,
+)
+from eeg_processing_io import create_raw, probe_channel_names
+from eeg_processing_logger import (
+    close_batch_log,
+    end_file_section,
+    log_file_section,
+    log_message,
+    open_batch_log,
+    start_file_section,
+)
+from eeg_processing_manifest import (
+    export_config,
+    file_complete,
+    load_manifest,
+    manifest_path,
+    open_manifest,
+    record_file,
+    write_settings,
+)
+from eeg_processing_memory import (
+    create_memory_tracker,
+    fits,
+    megabytes,
+    raw_nbytes,
+    release,
+    remove_spill_files,
+    require,
+    spill_raw,
+    track,
+)
+from eeg_processing_metrics import (
+    create_metrics,
+    finish_metrics,
+    operator_wait,
+    stage,
+    staged_bands,
+    write_batch_metrics,
+)
+from eeg_processing_prefetch import (
+    close_prefetcher,
+    create_prefetcher,
+    schedule_prefetch,
+    take_prefetched,
+    use_prefetched,
+)
+from eeg_processing_resampling import describe_plan, resample_raw, resampling_plan
+from eeg_processing_scheduler import (
+    close_scheduler,
+    completed_outputs,
+    create_scheduler,
+    output_pending,
+    schedule_forward,
+    schedule_output,
+    wait_for_forward,
+)
+
+no_montage_patterns = ["*.vhdr", "*.fif"]
+source_scalings = dict(eeg=10, mag=1e15, grad=1e13) # scalings used to export beamformed (source) signals
+
+
+def print_message(msg, panel='run'):
+    '''     Default log callback: print message to the console. Panel is 'run' or 'file'.     '''
+    print(msg)
+
+def print_warning(msg):
+    '''     Default warning callback: print warning to the console.     '''
+    print('Warning: ' + msg)
+
+def ignore_progress(bar, value, maximum=None):
+    '''     Default progress callback: progress ('files' or 'epochs' bar) is not shown.     '''
+    pass
+
+def run_interaction(func, *args, **kwargs):
+    '''     Default interaction callback: the plot or dialog func is called directly.     '''
+    return func(*args, **kwargs)
+
+def headless_hooks():
+    '''
+    Function to create the default callbacks used when running without GUI. The GUI passes its own
+    versions that update the window instead:
+        log(msg, panel)                  panel 'run' or 'file' (the -RUN_INFO- and -FILE_INFO- widgets)
+        progress(bar, value, maximum)    bar 'files' or 'epochs', maximum None keeps the current maximum
+        warn(msg)                        warnings that need attention of the user
+        select_channels_to_be_dropped(channel_names) -> list, None means no channels are dropped
+        interact(func, *args, **kwargs)  interactive plots (func(*args, **kwargs)), run by the GUI on its own thread
+    '''
+    return {
+        'log': print_message,
+        'progress': ignore_progress,
+        'warn': print_warning,
+        'select_channels_to_be_dropped': None,
+        'interact': run_interaction,
+    }
+
+def print_dict(dict):# pprint and json.print do not work well with composite keys!
+    '''     Function to print dictionary.     '''
+    for key in dict:
+        print(key, ":", dict[key])
+
+def write_config_file(config):
+    '''     Function to write config file in .pkl format.     '''
+    fn = config['config_file']
+    config.pop('raw', None) # remove from dict if exists
+    config.pop('raw_temp', None) # remove from dict if exists
+    config.pop('raw_temp_filtered', None) # remove from dict if exists
+    config.pop('raw_interpolated', None) # remove from dict if exists
+    config.pop('raw_ica', None) # remove from dict if exists
+    config.pop('ica', None)  # remove from dict if exists
+    config.pop('file_path', None)  # remove from dict, this is the current file_path in loop
+    config.pop('metrics', None)  # remove from dict, metrics of a file that was not finished
+    with open(fn, 'wb') as f:
+        pickle.dump(config, f)
+    return fn
+
+def load_config(fn):
+    '''     Function to read config file in .pkl format (or from the .manifest.sqlite of a batch).     '''
+    if fn.endswith('.sqlite'):
+        manifest = open_manifest(fn)
+        config = export_config(manifest)
+        manifest.close()
+        return config
+    with open(fn, 'rb') as f:
+        config = pickle.load(f)
+    return config
+
+def set_batch_names(config):
+    '''
+    Function that defines all file/folder/path names associated with the current EEG batch,
+    based on config['batch_prefix'] and config['output_directory']. These names are fixed for the
+    entire batch.
+    '''
+    today = datetime.today()
+    dt = today.strftime('%Y%m%d_%H%M%S')  # suffix
+    config['batch_name'] = config['batch_prefix'] + '_' + dt
+    config['batch_output_subdirectory'] = os.path.join(config['output_directory'], config['batch_name'])
+    # create if not existing
+    if not os.path.exists(config['batch_output_subdirectory']):
+       os.makedirs(config['batch_output_subdirectory'])
+
+    fn = config['batch_name'] + '.log'
+    config['logfile'] = os.path.join(config['batch_output_subdirectory'], fn)
+    fn = config['batch_name'] + '.pkl'
+    config['config_file'] = os.path.join(config['batch_output_subdirectory'], fn)
+    return config
+
+def set_file_output_related_names(config):
+    # Scope:in file loop
+    '''
+    Function that performs the actions necessary to define all file/folder/path names
+    associated with the current EEG FILE that is being processed. These names change
+    for each file in the batch.
+    '''
+    # strip file_name for use as sub dir
+    fn = config['file_name'].replace(" ", "")
+    fn = fn.replace(".", "")
+    # Split the file path and extension to use when constructing the output file names
+    root, ext = os.path.splitext(config['file_path'])
+    config['file_output_subdirectory'] = posixpath.join(config['batch_output_subdirectory'], fn ) # this is the sub-dir for output (epoch) files, remove spaces
+    if not os.path.exists(config['file_output_subdirectory']):
+       os.makedirs(config['file_output_subdirectory'])
+    file_name_sensor = os.path.basename(root) + "_Sensor_level"
+    config['file_path_sensor'] = os.path.join(config['file_output_subdirectory'], file_name_sensor)
+    file_name_source = os.path.basename(root) + "_Source_level"
+    config['file_path_source'] = os.path.join(config['file_output_subdirectory'], file_name_source)
+    return config
+
+def prepare_rerun(config_file, output_directory=None):
+    '''
+    Function that loads a previously created .pkl file and prepares it for a rerun of the batch
+    (same files, channel, bad channel and epoch selection), without asking anything.
+    '''
+    config = load_config(config_file)
+    config['previous_run_config_file'] = config_file
+    config['rerun'] = 1
+    for key in [key for key in config if isinstance(key, tuple) and key[1] in ('timing', 'metrics')]:
+        del config[key] # these describe the previous run
+    if output_directory is not None:
+        config['output_directory'] = output_directory
+    config = set_batch_names(config)
+    return config
+
+def resume_batch(config_file):
+    '''
+    Function that loads the .manifest.sqlite (or the .pkl file) of an interrupted batch to resume it
+    in the same batch output directory: files completed according to the manifest of the batch are
+    skipped. The settings and file entries come from the manifest, the checkpoint of the batch while
+    it runs (the .pkl is written when the batch ends, a killed batch has only its manifest).
+    '''
+    if config_file.endswith('.pkl') and not os.path.exists(config_file): # killed before the end of the batch
+        config_file = config_file[:-len('.pkl')] + '.manifest.sqlite'
+    config = load_config(config_file)
+    config['batch_output_subdirectory'] = os.path.dirname(os.path.abspath(config_file))
+    if os.path.exists(manifest_path(config)):
+        manifest_config = load_config(manifest_path(config))
+        if 'batch_name' in manifest_config: # settings written (processing started)
+            config = manifest_config
+            config['batch_output_subdirectory'] = os.path.dirname(os.path.abspath(config_file))
+    config['logfile'] = os.path.join(config['batch_output_subdirectory'], config['batch_name'] + '.log')
+    config['config_file'] = os.path.join(config['batch_output_subdirectory'], config['batch_name'] + '.pkl')
+    return config
+
+def unreviewed_files(config):
+    '''
+    Function that returns the files of a resumed new batch (config['rerun'] 0) that were not reviewed
+    yet: not completed, and without bad channels (epoch selection, ICA, when applied) in the config.
+    Processed without interaction these would be output as if reviewed, so they are resumed in the
+    GUI (Resume interrupted batch), which reviews them.
+    '''
+    if config.get('rerun', 0):
+        return []
+    manifest = load_manifest(config)
+    try:
+        remaining = [file_path for file_path in config['input_file_paths']
+                     if not file_complete(config, manifest, file_path)]
+    finally:
+        manifest.close()
+    review = ['bad'] + ['epochs'] * bool(config['apply_epoch_selection']) + ['ica'] * bool(config['apply_ica'])
+    return [file_path for file_path in remaining
+            if any((os.path.basename(file_path), key) not in config for key in review)]
+
+def make_montage(config):
+    '''     Function that returns the standard montage for the input file pattern ("NA" if not applicable).     '''
+    config['file_pattern'] = config['input_file_pattern', config['input_file_pattern']]
+    if config['file_pattern'] not in no_montage_patterns:
+        montage = mne.channels.make_standard_montage(config['montage', config['input_file_pattern']])
+    else:
+        montage = "NA"
+    return montage
+
+def update_channels_to_be_dropped(ch_names, config, hooks):
+    '''     Function to ask channels_to_be_dropped (once per batch), no channels are dropped without GUI.     '''
+    if hooks['select_channels_to_be_dropped'] is not None:
+        with operator_wait(config):
+            channels_to_be_dropped = hooks['select_channels_to_be_dropped'](ch_names)  # ask user to select
+    else:
+        channels_to_be_dropped = []
+    config['channels_to_be_dropped'] = channels_to_be_dropped # store for rerun function
+    config['channels_to_be_dropped_selected'] = 1
+    return config
+
+def ica_fingerprint(raw, config):
+    '''
+    Function that returns the fingerprint of an ICA fit: a checksum of the data ICA is fitted on,
+    the bad channels and the ICA settings.
+    '''
+    picks = mne.pick_types(raw.info, eeg=True, exclude=[])
+    fit = (data_checksum(raw, picks), sorted(config[config['file_name'], 'bad']), config['nr_ica_components'],
+           'fastica', sorted(ica_filter.items()))
+    return hashlib.sha1(repr(fit).encode()).hexdigest()
+
+def load_previous_ica(config, fingerprint):
+    '''
+    Function that returns the ICA fitted for the current file in the previous run of the batch
+    and its file, if it was fitted on the same data with the same settings (fingerprint), otherwise None.
+    The ICA file is looked for next to the previous .pkl file first.
+    '''
+    previous = config.get((config['file_name'], 'ica'))
+    if not config['rerun'] or not config.get('reuse_ica', 1) or previous is None:
+        return None, None
+    if previous['fingerprint'] != fingerprint:
+        return None, None
+    # only imported when ICA is applied (slow import)
+    from mne.preprocessing import read_ica
+    next_to_pkl = os.path.join(os.path.dirname(config['previous_run_config_file']), os.path.basename(previous['file']))
+    for fn in [next_to_pkl, previous['file']]:
+        if os.path.exists(fn):
+            return read_ica(fn, verbose=False), fn
+    return None, None
+
+def perform_ica(raw, raw_temp, config, hooks, interactive=True, memory=None):
+    '''
+    Function to perform ICA on data with bad channels marked but not dropped.
+    Components can only be excluded interactively. The filtered copy ICA is fitted on
+    is counted in the memory tracker (if given) and released after fitting. On a rerun, the
+    ICA of the previous run (with its excluded components) is used if the fingerprint matches.
+    The ICA is saved next to the .pkl of the batch.
+    '''
+    file_name = config['file_name']
+    msg = 'Max # components = ' + str(config['max_channels'])
+    hooks['log'](msg, 'run')
+
+    fingerprint = ica_fingerprint(raw, config)
+    ica, previous_fn = load_previous_ica(config, fingerprint)
+    if ica is not None:
+        msg = "ICA of previous run used: " + previous_fn + ", excluded components: " + str(ica.exclude)
+        hooks['log'](msg, 'run')
+    else:
+        # Preparation of clean raw object to calculate ICA on
+        if memory is not None:
+            require(memory, 'raw_ica', raw_nbytes(raw))
+            track(memory, 'raw_ica', raw_nbytes(raw))
+        raw_ica = filter_raw(raw.copy(), **ica_filter, hooks=hooks)
+
+        # Mark bad channels but don't drop them yet
+        raw_ica.info['bads'] = config[file_name, 'bad']
+
+        # Fit ICA excluding bad channels but without dropping them
+        # only imported when ICA is applied (slow import)
+        from mne.preprocessing import ICA
+        ica = ICA(n_components=config['nr_ica_components'],
+                  method='fastica')
+        # Ignores bad channels during fitting
+        ica.fit(raw_ica, picks='eeg')
+
+        if interactive:
+            with operator_wait(config):
+                hooks['interact'](ica.plot_components)  # head plot heat map
+                hooks['interact'](ica.plot_sources, raw_ica, block=True)
+        else:
+            hooks['log']("No interactive ICA review, no components excluded", 'run')
+        del raw_ica
+        if memory is not None:
+            release(memory, 'raw_ica')
+
+    # Store the ICA (unmixing, excluded components) for a rerun of this batch
+    fn = os.path.join(config['batch_output_subdirectory'], file_name.replace(" ", "") + '-ica.fif')
+    ica.save(fn, overwrite=True, verbose=False)
+    config[file_name, 'ica'] = {'file': fn, 'fingerprint': fingerprint, 'exclude': list(ica.exclude)}
+
+    # Calculate and display explained variance
+    pca_explained_variances = ica.pca_explained_variance_ / ica.pca_explained_variance_.sum()
+    ica_explained_variances = pca_explained_variances[:ica.n_components_]
+    cumul_pct = 0.0
+
+    for idx, var in enumerate(ica_explained_variances):
+        pct = round(100 * var, 2)
+        cumul_pct += pct
+        msg = f'Explained variance for ICA component {idx}: {pct}% ({round(cumul_pct, 1)}%)'
+        hooks['log'](msg, 'run')
+
+    # Apply ICA to the temporary raw object
+    raw_temp.info['bads'] = config[file_name, 'bad']
+    ica.apply(raw_temp)
+
+    return raw_temp, ica, config
+
+def perform_bad_channels_selection(raw, config, hooks, interactive=True):
+    '''
+    Function that applies MNE plotting to interactively select bad channels and save these to the config.
+    These channels can later be interpolated or dropped depending on the needs. Without interaction
+    the bad channels already marked (e.g. from a previous run) are used.
+    '''
+    file_name = config['file_name']
+    if interactive:
+        msg = "Select bad channels by left-clicking channels"
+        hooks['log'](msg, 'run')
+        with operator_wait(config):
+            hooks['interact'](raw.plot, n_channels=len(
+                raw.ch_names), block=True, title="Bandpass filtered data")
+    elif (file_name, 'bad') not in config:
+        msg = "No previous bad channel selection for " + file_name + ", no channels marked as bad"
+        hooks['log'](msg, 'run')
+
+    config[file_name, 'bad'] = raw.info['bads']  # *1 ### Aparte bad_channels variable is nu weg
+    return raw,config
+
+def plot_power_spectrum(raw, filtered=False):
+    '''
+    Function that plots the power spectrum of the separate EEG channels
+    of either the unfiltered or filtered EEG (from 0-60 Hz).
+    '''
+    fig = raw.compute_psd(fmax=60).plot(
+        picks='eeg', exclude=[])
+    axes = fig.get_axes()
+    if filtered:
+        axes[0].set_title("Band 0.5-47 Hz filtered power spectrum.")
+    else:
+        axes[0].set_title("Unfiltered power spectrum")
+    fig.tight_layout(rect=[0, 0, 1, 0.95])
+    fig.canvas.draw()
+
+def perform_temp_down_sampling(raw, step, hooks):
+    '''
+    Function that down samples the temporary raw EEG to 500 or 512 Hz depending on the sample frequency
+    (power of 2 or not), the 'temp' step of the resampling plan. This should speed up preprocessing.
+    '''
+    temporary_sample_f = step['new_sfreq']
+    raw = resample_raw(raw, step)
+    msg = "Temporary signal down sampled to " + str(temporary_sample_f) + " Hz"
+    hooks['log'](msg, 'run')
+    return raw, temporary_sample_f
+
+def perform_average_reference(raw):
+    '''
+    Function that applies a global average reference on the 'eeg' type channels
+    of the raw EEG.
+    '''
+    raw.set_eeg_reference('average', projection=True, ch_type='eeg')
+    raw.apply_proj()
+    return raw
+
+def perform_beamform(raw, config, hooks):
+    '''
+    Function that drops bad channels and creates the spatial filter
+    used for LCMV beamforming.
+    '''
+    raw.drop_channels(config[config['file_name'], 'bad'])
+    msg = "channels left in raw_beamform:" + str(len(raw.ch_names))
+    hooks['log'](msg, 'run')
+    raw = perform_average_reference(raw)
+    spatial_filter = create_spatial_filter(raw, config, hooks)
+    return spatial_filter
+
+def perform_epoch_selection(raw, config, sfreq, hooks, interactive=True):
+    '''
+    Function that performs epoch selection on the raw file.
+    This function is for use on the temporary raw object. Without interaction all epochs are selected.
+    '''
+    events = mne.make_fixed_length_events(raw, duration=(config['epoch_length']))
+    epochs = mne.Epochs(raw, events=events, tmin=0, tmax=(
+        config['epoch_length']-(1/sfreq)),
+            baseline=(0, config['epoch_length']-(1/sfreq)), preload=True)
+
+    if interactive:
+        # Generate events at each second as seconds markers for the epochs plot
+        time_event_ids = np.arange(config['epoch_length']*len(events))
+        time_event_samples = (sfreq * time_event_ids).astype(int)
+        time_events = np.column_stack(
+            (time_event_samples, np.zeros_like(time_event_samples), time_event_ids))
+
+        # Plot the epochs for visual inspection
+        msg = "Select bad epochs by left-clicking data"
+        hooks['log'](msg, 'run')
+        with operator_wait(config):
+            hooks['interact'](epochs.plot, n_epochs=1, n_channels=len(
+                raw.ch_names), events=time_events, event_color= 'm',block=True, picks=['eeg', 'eog', 'ecg'])
+    else:
+        msg = "No previous epoch selection for " + config['file_name'] + ", all epochs selected"
+        hooks['log'](msg, 'run')
+
+    config[config['file_name'], 'epochs'] = epochs.selection
+    return config
+
+def apply_epoch_selection(raw_output,config,sfreq,filtering=False,l_freq=None,h_freq=None):
+    '''
+    Function that applies the epoch selection made earlier (either in a previous run
+    or during current pre processing) to the raw EEG used for saving output to file.
+    Filtering is optionally applied before applying the epoch selection.
+    '''
+
+    if filtering:
+        raw_output = filter_output_raw(raw_output,config,l_freq,h_freq)
+
+    events_out = mne.make_fixed_length_events(raw_output, duration=config['epoch_length'])
+    epochs_out = mne.Epochs(raw_output, events=events_out, tmin=0, tmax=(config['epoch_length'] - \
+        (1 / sfreq)), baseline=(0, config['epoch_length']))
+    selected_epochs_out = epochs_out[config[config['file_name'], 'epochs']]
+    selected_epochs_out.drop_bad()
+    return selected_epochs_out
+
+def apply_bad_channels(raw, config, hooks):
+    '''
+    Function that applies bad channels (either from previous run or current pre processing)
+    to raw EEG object used to export the final output.
+    '''
+    file_name = config['file_name']
+    raw.info['bads'] = config[file_name, 'bad']
+    raw.interpolate_bads(reset_bads=True)
+    msg = "Interpolated " + str(len(config[file_name, 'bad'])) + \
+        " channels on (non-beamformed) output signal"
+    hooks['log'](msg, 'run')
+    return raw
+
+def output_bands(raw, config, bands, memory, hooks):
+    '''
+    Generator that yields (l_freq, h_freq, raw_band) for all output frequency bands: from the filter
+    bank if its spectrum and one band output fit in the memory budget, otherwise band by band.
+    '''
+    if fits(memory, 2 * raw_nbytes(raw)):
+        yield from filter_bank(raw, config, bands, hooks=hooks)
+    else:
+        require(memory, 'output band', raw_nbytes(raw))
+        for l_freq, h_freq in bands:
+            yield l_freq, h_freq, filter_output_raw(raw, config, l_freq, h_freq, hooks)
+
+def process_file(file_path, config, hooks=None, interactive=False, montage=None, prefetcher=None, scheduler=None):
+    '''
+    Function that runs the complete pipeline (loading, bad channels, ICA, beamforming, epoching
+    and export) for one EEG file. Without interaction, bad channels and epochs stored in config
+    (rerun) are used. Every stage is timed (see eeg_processing_metrics). With a prefetcher the file
+    may already be loaded and filtered in the background, and the next files are prefetched. With a
+    scheduler the forward solution and the output of the file (export_file) are computed in the
+    background (see eeg_processing_scheduler): the output is not finished when this function returns.
+    '''
+    if hooks is None:
+        hooks = headless_hooks()
+    log = hooks['log']
+    if montage is None:
+        montage = make_montage(config)
+
+    start = datetime.now()
+    start_time = time.perf_counter()
+    config['file_path'] = file_path # to be used by functions, this is the current file_path
+    f = Path(file_path)
+    file_name = f.name
+    input_dir = str(f.parents[0]) # to prevent error print config json
+    config['input_directory'] = input_dir # save, scope=batch
+    config['file_name'] = file_name
+    config=set_file_output_related_names(config) # set output directory for epochs etc.
+    config = create_metrics(config)
+    # add file name to list in config file, to be used in rerun
+    if file_name not in config['input_file_names']: # not again when a batch is resumed
+        config['input_file_names'].append(file_name) # add file name to config file, to be used in rerun
+    msg = '\n*** Processing file ' + file_path + ' ***'
+    log(msg, 'run')
+    log(msg, 'file')
+
+    # Channels to be dropped are selected from the file header, so these are not loaded at all
+    # (.txt files have no separate header, they are selected after loading)
+    if config['rerun'] == 0 and config['channels_to_be_dropped_selected'] == 0 and \
+            config['file_pattern'] != "*.txt":
+        with stage(config, 'select channels'):
+            config = update_channels_to_be_dropped(probe_channel_names(config), config, hooks)
+
+    raw_temp = None # set if prefetched: loaded, channels dropped and filtered in the background
+    with stage(config, 'load'):
+        prefetched = take_prefetched(prefetcher, file_path, hooks)
+        if prefetched is not None:
+            raw, raw_temp, filter_cache = use_prefetched(prefetched, config, hooks)
+            del prefetched
+        else:
+            raw, config = create_raw(config, montage, no_montage_patterns, hooks,
+                                     exclude=config.get('channels_to_be_dropped', []))
+
+    if raw_temp is None:
+        with stage(config, 'drop channels'):
+            if config['rerun'] == 0 and config['channels_to_be_dropped_selected'] == 0:
+                config = update_channels_to_be_dropped(raw.ch_names, config, hooks)
+
+            # Only drop non-EEG channels, not bad channels
+            raw.drop_channels(config['channels_to_be_dropped'], on_missing='ignore')
+    # the channels to be dropped are known: load the next file(s) while this one is processed
+    schedule_prefetch(prefetcher, config)
+
+    memory = create_memory_tracker(config, hooks)
+    track(memory, 'raw', raw_nbytes(raw))
+    plan = resampling_plan(config)
+    log(describe_plan(plan), 'run')
+
+    # Temporary raw file to work with during preprocessing. The original is not used until the
+    # output stage, its data goes to disk if there is no room for both in the memory budget.
+    if raw_temp is not None: # prefetched (no memory budget)
+        track(memory, 'raw_temp', raw_nbytes(raw_temp))
+        if filter_cache is not None:
+            track(memory, 'filter_cache', raw_nbytes(raw_temp))
+        if interactive:
+            hooks['interact'](plot_power_spectrum, raw, filtered=False) # raw_temp before filtering
+    else:
+        with stage(config, 'copy temporary signal'):
+            if not fits(memory, raw_nbytes(raw)):
+                raw = spill_raw(memory, 'raw', raw)
+            require(memory, 'raw_temp', raw_nbytes(raw))
+            raw_temp = raw.copy()
+            track(memory, 'raw_temp', raw_nbytes(raw_temp))
+
+        if interactive:
+            hooks['interact'](plot_power_spectrum, raw_temp, filtered=False)
+
+        # With ICA and/or beamforming the output signal gets the same broadband filter: keep the result
+        # (if it fits in the memory budget)
+        filter_cache = None
+        if (config['apply_ica'] or config['apply_beamformer']) and fits(memory, raw_nbytes(raw_temp)):
+            filter_cache = {}
+            track(memory, 'filter_cache', raw_nbytes(raw_temp))
+        with stage(config, 'filter temporary signal'):
+            raw_temp = filter_raw(raw_temp, **broadband_filter, filter_cache=filter_cache, hooks=hooks)
+
+    # Mark bad channels (but don't interpolate yet)
+    if config['rerun'] == 1:
+        raw_temp.info['bads'] = config.get((file_name, 'bad'), [])
+
+    with stage(config, 'bad channel review'):
+        raw_temp, config = perform_bad_channels_selection(raw_temp, config, hooks, interactive)
+    if config['apply_beamformer']:
+        schedule_forward(scheduler, raw_temp.info, config) # depends on the remaining channels only
+
+    # Calculate max channels before any interpolation
+    config['max_channels'] = len(raw.ch_names) - len(config[file_name, 'bad'])
+
+    # Apply ICA before interpolation if requested
+    ica = None
+    if config['apply_ica']:
+        with stage(config, 'ica fit'):
+            raw_temp, ica, config = perform_ica(raw, raw_temp, config, hooks, interactive, memory)
+
+    # Interpolate bad channels after ICA
+    with stage(config, 'interpolate temporary signal'):
+        raw_temp.interpolate_bads(reset_bads=True)
+
+    spatial_filter = None
+    if config['apply_beamformer']:
+        with stage(config, 'beamformer build'):
+            wait_for_forward(scheduler, hooks)
+            spatial_filter = perform_beamform(raw_temp, config, hooks)
+
+    if plan['temp'] is not None:
+        with stage(config, 'resample temporary signal'):
+            raw_temp,temporary_sample_f = perform_temp_down_sampling(raw_temp, plan['temp'], hooks)
+        track(memory, 'raw_temp', raw_nbytes(raw_temp))
+    else:
+        temporary_sample_f = config['sample_frequency']
+
+    with stage(config, 'reference temporary signal'):
+        raw_temp = perform_average_reference(raw_temp)
+
+    if config['apply_epoch_selection'] and interactive:
+        hooks['interact'](plot_power_spectrum, raw_temp, filtered=True)
+
+    # Epochs are selected on a new batch, or on a rerun of a batch without previous epoch selection
+    if config['apply_epoch_selection'] and (config['rerun'] == 0 or (file_name, 'epochs') not in config):
+        with stage(config, 'epoch selection'):
+            config = perform_epoch_selection(raw_temp, config, temporary_sample_f, hooks, interactive)
+
+    # bad channels, ICA, spatial filter and epoch selection are known: release the temporary signal
+    del raw_temp
+    release(memory, 'raw_temp')
+
+    output = (raw, ica, spatial_filter, memory, plan, filter_cache, start, start_time)
+    if scheduler is not None: # the operator can continue with the next file
+        schedule_output(scheduler, file_path, export_file, config, hooks, *output)
+        return config
+    return export_file(*output, config, hooks)
+
+def export_file(raw, ica, spatial_filter, memory, plan, filter_cache, start, start_time, config, hooks):
+    '''
+    Function that produces the output of a file once its bad channels, ICA, spatial filter and epoch
+    selection are known (second part of process_file): the output signal is filtered, resampled,
+    cleaned with ICA, interpolated, referenced and beamformed, epoched and exported.
+    '''
+    file_name = config['file_name']
+    log = hooks['log']
+
+    # ********** Preparation of the final raw file and epochs for export **********
+    if config['apply_ica'] or config['apply_beamformer']:
+        with stage(config, 'filter output signal'):
+            raw = filter_raw(raw, **broadband_filter, filter_cache=filter_cache, hooks=hooks)
+        release(memory, 'filter_cache')
+        msg = "Output signal filtered to 0.5-47 Hz (transition bands 0.4 Hz and 1.5 Hz resp. \
+            Necessary for ICA and/or Beamforming"
+        log(msg, 'run')
+
+    # Downsample before ICA, interpolation, average reference and spatial filter (see resampling plan)
+    config['downsampled_sample_frequency'] = config['sample_frequency']//config['downsample_factor']
+
+    if plan['output'] is not None:
+        with stage(config, 'resample output signal'):
+            raw = resample_raw(raw, plan['output'])
+        track(memory, 'raw', raw_nbytes(raw)) # resampled data is in memory, also when spilled before
+        msg = "Output signal downsampled to " + \
+            str(config['downsampled_sample_frequency']) + " Hz"
+    else:
+        msg = "No downsampling applied to output signal"
+    log(msg, 'run')
+
+    # Mark bad channels but don't interpolate yet
+    raw.info['bads'] = config[file_name, 'bad']
+
+    # Apply ICA before interpolation if requested
+    if config['apply_ica']:
+        with stage(config, 'ica apply'):
+            ica.apply(raw)  # ICA will automatically exclude bad channels
+        msg = "ICA applied to output signal"
+        log(msg, 'run')
+
+    # Now interpolate bad channels after ICA
+    with stage(config, 'interpolate output signal'):
+        raw.interpolate_bads(reset_bads=True)
+    msg = f"Interpolated {len(config[file_name, 'bad'])} channels on output signal"
+    log(msg, 'run')
+
+    if config['apply_average_ref']:
+        with stage(config, 'reference output signal'):
+            raw = perform_average_reference(raw)
+        msg = "Average reference set on output signal"
+    else:
+        msg = "No rereferencing applied"
+    log(msg, 'run')
+
+    if config['apply_beamformer']:
+        # average reference, bad channels and spatial filter in one, on the downsampled output signal
+        msg = "Average reference applied for beamforming"
+        log(msg, 'run')
+        msg = "Dropped " + str(len(config[file_name, 'bad'])) + \
+            " bad channels on beamformed output signal"
+        log(msg, 'run')
+        msg = "The EEG file used for beamforming now contains " + \
+            str(len(raw.ch_names) - len(config[file_name, 'bad'])) + " channels"
+        log(msg, 'run')
+
+        # float64 source signal, and the signal in beamformer_dtype while it is converted
+        dtype = np.dtype(config.get('beamformer_dtype', 'float64'))
+        nbytes_source = len(spatial_filter['weights']) * raw.n_times * \
+            (np.dtype(np.float64).itemsize + (dtype.itemsize if dtype != np.float64 else 0))
+        require(memory, 'raw_source', nbytes_source)
+        with stage(config, 'beamformer apply'):
+            raw_source = apply_spatial_filter(raw, config, spatial_filter, hooks)
+        track(memory, 'raw_source', raw_nbytes(raw_source))
+
+    frequency_band_pairs = list(zip(config['frequency_bands'][::2], config['frequency_bands'][1::2], strict=True))
+    bands = [(config['cut_off_frequency', low_band], config['cut_off_frequency', high_band])
+             for low_band, high_band in frequency_band_pairs]
+
+    # Create output epochs and export (.txt and/or binary formats)
+    if config['apply_epoch_selection']:
+        with stage(config, 'epoching sensor'):
+            selected_epochs_sensor = apply_epoch_selection(raw, config, config['downsampled_sample_frequency'])
+
+        len2 = len(selected_epochs_sensor)
+        hooks['progress']('epochs', 0, len2)
+
+        with stage(config, 'export epochs sensor'):
+            save_epoch_data(selected_epochs_sensor, config, config['file_path_sensor'], hooks)
+
+        if config['apply_output_filtering']:
+            # all bands from one filter bank pass, one filtered copy at a time
+            for l_freq, h_freq, raw_filt in staged_bands(config, 'filter sensor',
+                                                         output_bands(raw, config, bands, memory, hooks)):
+                band = f' {l_freq}-{h_freq} Hz'
+                with stage(config, 'epoching sensor' + band):
+                    selected_epochs_sensor_filt = apply_epoch_selection(
+                        raw_filt,config,sfreq=config['downsampled_sample_frequency'])
+
+                with stage(config, 'export epochs sensor' + band):
+                    save_epoch_data(
+                        selected_epochs_sensor_filt, config, config['file_path_sensor'], hooks,
+                        filtering=True,
+                        l_freq=l_freq,
+                        h_freq=h_freq
+                    )
+                del raw_filt, selected_epochs_sensor_filt
+
+        if config['apply_beamformer']:
+            # Export beamformed epochs
+            with stage(config, 'epoching source'):
+                selected_epochs_source = apply_epoch_selection(raw_source, config, config['downsampled_sample_frequency'])
+            with stage(config, 'export epochs source'):
+                save_epoch_data(selected_epochs_source, config, config['file_path_source'], hooks,
+                                       scalings=source_scalings)
+
+            if config['apply_output_filtering']:
+                for l_freq, h_freq, raw_source_filt in staged_bands(config, 'filter source',
+                                                                    output_bands(raw_source, config, bands, memory, hooks)):
+                    band = f' {l_freq}-{h_freq} Hz'
+                    with stage(config, 'epoching source' + band):
+                        selected_epochs_source_filt = apply_epoch_selection(
+                            raw_source_filt,config,sfreq=config['downsampled_sample_frequency'])
+
+                    with stage(config, 'export epochs source' + band):
+                        save_epoch_data(
+                            selected_epochs_source_filt, config, config['file_path_source'], hooks,
+                            scalings=source_scalings,
+                            filtering=True,
+                            l_freq=l_freq,
+                            h_freq=h_freq
+                        )
+                    del raw_source_filt, selected_epochs_source_filt
+
+    else: # equals no epoch_output
+        msg = "No epoch selection performed"
+        log(msg, 'run')
+
+        with stage(config, 'export continuous sensor'):
+            save_whole_EEG(raw,config,config['file_path_sensor'])
+        hooks['progress']('epochs', 1, 1)
+
+        if config['apply_output_filtering']:
+            for l_freq, h_freq, raw_filt in staged_bands(config, 'filter sensor',
+                                                         output_bands(raw, config, bands, memory, hooks)):
+                with stage(config, f'export continuous sensor {l_freq}-{h_freq} Hz'):
+                    save_whole_EEG(
+                        raw_filt,config,config['file_path_sensor'],
+                        filtering=True,
+                        l_freq=l_freq,
+                        h_freq=h_freq
+                    )
+                del raw_filt
+
+        if config['apply_beamformer']:
+            with stage(config, 'export continuous source'):
+                save_whole_EEG(raw_source,config,config['file_path_source'],
+                    scalings=source_scalings
+                )
+
+            if config['apply_output_filtering']:
+                for l_freq, h_freq, raw_source_filt in staged_bands(config, 'filter source',
+                                                                    output_bands(raw_source, config, bands, memory, hooks)):
+                    with stage(config, f'export continuous source {l_freq}-{h_freq} Hz'):
+                        save_whole_EEG(
+                            raw_source_filt,config,config['file_path_source'],
+                            scalings=source_scalings,
+                            filtering=True,
+                            l_freq=l_freq,
+                            h_freq=h_freq
+                        )
+                    del raw_source_filt
+    msg = "Peak memory of tracked signals: " + megabytes(memory['peak'])
+    if memory['budget'] > 0:
+        msg += " (budget " + megabytes(memory['budget']) + ")"
+    log(msg, 'run')
+    remove_spill_files(memory)
+    config[file_name, 'timing'] = {'start': start.isoformat(timespec='seconds'),
+                                   'seconds': round(time.perf_counter() - start_time, 3)}
+    finish_metrics(config)
+    return config
+
+def write_log_file(config, run_info, file_info):
+    '''
+    Function to write a complete log file at once: run info followed by file info (e.g. when shards
+    are merged, a batch log is streamed by run_batch, see eeg_processing_logger).
+    '''
+    fn = config['logfile']
+    with open(fn, "w", encoding='UTF-8') as f:
+        f.write('\n'.join(run_info) + '\n')
+        f.write('\n'.join(file_info) + '\n')
+    return fn
+
+def resume_log(config, logger, log):
+    '''     Function that marks the continuation of the log of an interrupted batch (if any) when it is resumed.     '''
+    if logger['resumed']:
+        log('\n*** Batch ' + config['batch_name'] + ' resumed ***', 'run')
+
+def log_batch_metrics(config, log):
+    '''     Function that writes the metrics of all files of the batch and logs the time per stage.     '''
+    fn, summary = write_batch_metrics(config)
+    log(summary, 'run')
+    log('Metrics of all stages written: ' + fn, 'file')
+
+def merge_file_config(config, file_config, file_name):
+    '''
+    Function that merges the config returned by a worker into the batch config: entries of this
+    file (e.g. config[file_name, 'bad'], config[file_name, 'epochs']) and the batch entries that
+    are updated while processing a file (e.g. sample frequency), as if processed sequentially.
+    '''
+    for key, value in file_config.items():
+        if key == 'input_file_names':
+            continue
+        if isinstance(key, tuple) and key[0] != file_name and key in config:
+            continue # entries of other files are kept from the batch config
+        config[key] = value
+    if file_name not in config['input_file_names']:
+        config['input_file_names'].append(file_name)
+    return config
+
+def record_background_output(file_path, file_config):
+    '''
+    Completion callback of the scheduler (see eeg_processing_scheduler): adds a file whose output was
+    produced in the background to the manifest as soon as it is done, through a connection of its own
+    (it runs on the background thread).
+    '''
+    manifest = load_manifest(file_config)
+    try:
+        record_file(file_config, manifest, file_path)
+    finally:
+        manifest.close()
+
+def finish_background_outputs(config, scheduler, logger, gui_log, wait_all=False):
+    '''
+    Function that adds the outputs produced in the background (see eeg_processing_scheduler) that
+    are done to the batch, in file order: config and a log section per file (they are recorded in
+    the manifest by record_background_output). Raises a RuntimeError (with the traceback of the
+    background thread) if an output failed.
+    '''
+    for file_path, updates, messages, error in completed_outputs(scheduler, wait_all):
+        file_name = os.path.basename(file_path)
+        config = merge_file_config(config, updates, file_name)
+        if error is not None:
+            messages = messages + [(None, 'run', error)]
+        log_file_section(logger, file_name, messages, 'failed' if error else 'done',
+                         config.get((file_name, 'timing'), {}).get('seconds'))
+        for _, panel, msg in messages:
+            gui_log(msg, panel)
+        if error is not None:
+            raise RuntimeError('Output of ' + file_path + ' in the background failed:\n' + error)
+    return config
+
+def run_batch(config, hooks=None, interactive=False, stop=None):
+    '''
+    Function that processes all files in config['input_file_paths'] one after another, and writes
+    the config (.pkl, to be used for rerun) and log file of the batch. If processing fails, the
+    config and log (including traceback) are written before the exception is raised again.
+    The settings of the batch are written to its manifest first (again when the channels to be
+    dropped are selected with the first file); after each file, its entries are added to the
+    manifest, so an interrupted batch can be resumed (see resume_batch): completed files are skipped. All messages are streamed to the log file, one section per file.
+    With background stages (config['background_stages']) the output of a file is produced while the
+    next file is reviewed; it is added to the batch (and its log section written) when done.
+    When stop (a threading.Event) is set, no further files are started: the batch ends after the
+    current file, as if these were its last, and can be resumed.
+    '''
+    if hooks is None:
+        hooks = headless_hooks()
+    # all messages also go to the log file
+    logger = open_batch_log(config)
+    gui_log = hooks['log']
+    def log(msg, panel='run'):
+        log_message(logger, msg, panel)
+        gui_log(msg, panel)
+    hooks = dict(hooks, log=log)
+    manifest = prefetcher = scheduler = None
+
+    try: # the log (and manifest) are closed in any case, also when interrupted
+        resume_log(config, logger, log)
+        montage = make_montage(config)
+        manifest = load_manifest(config)
+        write_settings(config, manifest) # the manifest is the checkpoint, the .pkl is written at the end
+        completed = [file_path for file_path in config['input_file_paths'] if file_complete(config, manifest, file_path)]
+        # next files are loaded in the background (see eeg_processing_prefetch)
+        prefetcher = create_prefetcher(config, [file_path for file_path in config['input_file_paths']
+                                                if file_path not in completed], montage, no_montage_patterns)
+        # forward solution and output of a file in the background (see eeg_processing_scheduler)
+        scheduler = create_scheduler(config, on_output=record_background_output)
+
+        # progess bar vars
+        lfl = len(config['input_file_paths'])
+        filenum = 0
+
+        for file_path in config['input_file_paths']:
+            if stop is not None and stop.is_set():
+                msg = ('Processing stopped, ' + str(lfl - filenum) + ' files not processed (process them with Resume '
+                       'interrupted batch in the GUI, or --resume if they were reviewed or the batch is a rerun)')
+                log(msg, 'run')
+                break
+            if file_path in completed:
+                log('File ' + file_path + ' already completed in this batch, skipped', 'run')
+            else:
+                start_file_section(logger, os.path.basename(file_path))
+                selected = config['channels_to_be_dropped_selected']
+                config = process_file(file_path, config, hooks, interactive, montage, prefetcher, scheduler)
+                if config['channels_to_be_dropped_selected'] != selected: # selected with this file
+                    write_settings(config, manifest)
+                if output_pending(scheduler, file_path):
+                    end_file_section(logger, 'reviewed, output in the background')
+                else:
+                    # checkpoint, to resume the batch if it is interrupted (only the rows of this file)
+                    record_file(config, manifest, file_path)
+                    end_file_section(logger, 'done')
+            config = finish_background_outputs(config, scheduler, logger, gui_log)
+            filenum = filenum+1
+            hooks['progress']('files', filenum, lfl) # files
+        config = finish_background_outputs(config, scheduler, logger, gui_log, wait_all=True)
+    except Exception:
+        log(traceback.format_exc(), 'run')
+        end_file_section(logger, 'failed')
+        try: # outputs that are still produced in the background are completed and logged
+            config = finish_background_outputs(config, scheduler, logger, gui_log, wait_all=True)
+        except Exception:
+            log(traceback.format_exc(), 'run')
+        print_dict(config)
+        log_batch_metrics(config, log)
+        # write config to pkl file
+        write_config_file(config)
+        raise
+    else:
+        log_batch_metrics(config, log)
+        # write config to pkl file
+        fn=write_config_file(config)
+        msg = 'Config created for this batch (to be used for rerun) : '+fn
+        log(msg, 'file')
+        msg = 'Log file created: ' + config['logfile']
+        log(msg, 'file')
+    finally:
+        close_prefetcher(prefetcher)
+        close_scheduler(scheduler)
+        if manifest is not None:
+            manifest.close()
+        close_batch_log(logger) # flushed
+    return config
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rerun a previously processed EEG batch without GUI.')
+    parser.add_argument('config_file', help='.pkl file created by a previous run of the batch (with --resume '
+                                            'its .manifest.sqlite)')
+    parser.add_argument('--output-directory', default=None,
+                        help='base output directory (default: output directory of the previous run)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of files processed in parallel (default: nr_workers of the config, 1)')
+    parser.add_argument('--blas-threads', type=int, default=None,
+                        help='BLAS/OpenMP threads per worker process (default: 1)')
+    parser.add_argument('--resume', action='store_true',
+                        help='resume the interrupted batch of config_file in its own output directory, '
+                             'files that were completed are skipped. The batch is resumed from its '
+                             '.manifest.sqlite (a killed batch has no .pkl yet, its .pkl path may be given '
+                             'as well). A new batch with files that were not reviewed yet is refused: '
+                             'resume it in the GUI (Resume interrupted batch)')
+    parser.add_argument('--output-formats', nargs='+', default=None, choices=['txt', 'npy', 'fif'],
+                        help='output file formats (default: output_formats of the config, txt)')
+    args = parser.parse_args()
+    if args.resume:
+        config = resume_batch(args.config_file)
+        unreviewed = unreviewed_files(config)
+        if unreviewed:
+            parser.error(str(len(unreviewed)) + ' file(s) of this batch were not reviewed yet (' +
+                         ', '.join(os.path.basename(file_path) for file_path in unreviewed) +
+                         '), resume it in the GUI (Resume interrupted batch) to review them')
+    else:
+        config = prepare_rerun(args.config_file, args.output_directory)
+    if args.output_formats is not None:
+        config['output_formats'] = args.output_formats
+    nr_workers = args.workers if args.workers is not None else config.get('nr_workers', 1)
+    if nr_workers > 1:
+        from eeg_processing_parallel import run_batch_parallel
+        config = run_batch_parallel(config, nr_workers, args.blas_threads)
+    else:
+        config = run_batch(config)
+    print('Processing complete')
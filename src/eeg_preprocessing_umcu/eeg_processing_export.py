@@ -0,0 +1,230 @@
+"""
+Export of the output signals of the EEG preprocessing pipeline.
+
+Every epoch set / continuous output signal is written in each of the formats in config['output_formats']:
+    'txt': tab separated text, one file per epoch (the original format)
+    'npy': one binary array per epoch set (n_epochs, n_channels, n_times) or continuous signal
+           (n_channels, n_times), in the same units as the text export, with a .json file holding
+           channel names, sample frequency, frequency band and epoch indices. The arrays can be
+           memory-mapped, e.g. np.load(fn, mmap_mode='r') in Python or memmapfile in MATLAB.
+    'fif': MNE -epo.fif / _raw.fif files (in V), e.g. mne.read_epochs(fn, preload=False)
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import json
+
+import mne
+import numpy as np
+
+default_scalings = dict(eeg=1e6) # V to µV, as used by MNE's to_data_frame
+epoch_progress_interval = 25 # epochs written between progress and log updates
+export_chunk_samples = 10000 # samples of a continuous signal scaled and written at once
+
+def output_formats(config):
+    '''     Function that returns the output formats of the batch (rerun of old batches: text only).     '''
+    formats = config.get('output_formats', ['txt'])
+    if isinstance(formats, str):
+        formats = [formats]
+    unknown = [f for f in formats if f not in epoch_writers]
+    if unknown:
+        raise ValueError(f"Unknown output format(s) {unknown}, choose from {list(epoch_writers)}")
+    return formats
+
+def output_band(config, filtering, l_freq, h_freq):
+    '''
+    Function that returns the frequency band (l_freq, h_freq) used in the output file names, None for
+    unfiltered output. Beamformer and ICA already bandpass filter from 0.5 to 47 Hz.
+    '''
+    l_freq=float(l_freq)
+    h_freq=float(h_freq)
+    if (config['apply_beamformer'] or config['apply_ica']) and l_freq <= 0.5:
+        l_freq = 0.5 # Since both beamformer and ICA already bandpass filter from 0.5 to 47 Hz
+
+    if (config['apply_beamformer'] or config['apply_ica']) and h_freq >= 47.0:
+        h_freq = 47 # Since both beamformer and ICA already bandpass filter from 0.5 to 47 Hz
+
+    if filtering or config['apply_beamformer'] or config['apply_ica']:
+        return l_freq, h_freq
+    return None
+
+def output_metadata(inst, config, scalings, band, epoch_index=None):
+    '''     Function that returns the metadata stored with a binary output array.     '''
+    metadata = {
+        'ch_names': inst.ch_names,
+        'sfreq': inst.info['sfreq'],
+        'l_freq': band[0] if band is not None else None,
+        'h_freq': band[1] if band is not None else None,
+        'scaling': (scalings or default_scalings)['eeg'], # exported values are in V times scaling
+        'source_file': config['file_name'],
+        }
+    if epoch_index is not None:
+        metadata['epoch_index'] = [int(i) for i in epoch_index] # index of the epoch in the recording
+        metadata['epoch_length'] = config['epoch_length']
+    return metadata
+
+def save_metadata(file_name_out, metadata, shape, dtype):
+    '''     Function that writes the metadata of a .npy output file in a .json file next to it.     '''
+    metadata = dict(metadata, shape=[int(n) for n in shape], dtype=np.dtype(dtype).name)
+    with open(file_name_out[:-len('.npy')] + '.json', 'w', encoding='UTF-8') as f:
+        json.dump(metadata, f, indent=1)
+
+def save_array(file_name_out, data, metadata):
+    '''     Function that writes data as .npy file with the metadata in a .json file next to it.     '''
+    np.save(file_name_out, data)
+    save_metadata(file_name_out, metadata, data.shape, data.dtype)
+
+def scaled_chunks(raw_output, scalings=None, decimals=None, chunk_samples=None):
+    '''
+    Generator that yields (start, chunk) over the 'eeg' channels of raw_output in time chunks of
+    chunk_samples, scaled (and rounded to decimals) into one reused (n_channels, chunk_samples) buffer.
+    The chunk is only valid until the next one is requested.
+    '''
+    chunk_samples = chunk_samples or export_chunk_samples
+    picks = mne.pick_types(raw_output.info, eeg=True, exclude=[])
+    scaling = (scalings or default_scalings)['eeg']
+    buffer = np.empty((len(picks), min(chunk_samples, raw_output.n_times)))
+    for start in range(0, raw_output.n_times, chunk_samples):
+        stop = min(start + chunk_samples, raw_output.n_times)
+        chunk = buffer[:, :stop - start]
+        np.multiply(raw_output.get_data(picks=picks, start=start, stop=stop), scaling, out=chunk)
+        if decimals is not None:
+            np.round(chunk, decimals=decimals, out=chunk)
+        yield start, chunk
+
+def format_txt_value(value):
+    '''     Function that formats a value as pandas to_csv does: an empty field for a missing value (NaN).     '''
+    return '' if value != value else repr(value)
+
+def format_txt_rows(data):
+    '''
+    Function that formats a (n_times, n_channels) array as tab separated text lines, exactly as
+    pandas to_csv does (shortest round-trip representation, missing values as empty fields).
+    '''
+    fmt = format_txt_value if np.isnan(data).any() else float.__repr__
+    return ['\t'.join(map(fmt, row)) + '\n' for row in data.tolist()]
+
+def save_epoch_data_to_txt(epoch_data, config, base, hooks, scalings=None,filtering=False,l_freq=0.0,h_freq=1000.0):
+    '''
+    Function to save an MNE epoch object to txt files, one per epoch. The data of all epochs is
+    taken, scaled and rounded at once; progress and log are updated per block of epochs.
+    '''
+    band = output_band(config, filtering, l_freq, h_freq)
+    ch_names = [epoch_data.ch_names[i] for i in mne.pick_types(epoch_data.info, eeg=True, exclude=[])]
+    header = '\t'.join(ch_names) + '\n'
+    data = epoch_data.get_data(picks='eeg') # (n_epochs, n_channels, n_times)
+    data *= (scalings or default_scalings)['eeg']
+    np.round(data, decimals=config['output_txt_decimals'], out=data)
+
+    messages = []
+    for i in range(len(data)):
+        if band is not None:
+            file_name_out = base + "_" + str(band[0]) + "-" + str(band[1]) + " Hz_Epoch_"  + str(i + 1) + ".txt"
+        else:
+            file_name_out = base + "_Epoch_" + str(i + 1) + ".txt"
+
+        with open(file_name_out, 'w', encoding='UTF-8') as f:
+            f.write(header)
+            f.writelines(format_txt_rows(data[i].T))
+        messages.append('Output file ' + file_name_out + ' created')
+        if len(messages) == epoch_progress_interval or i == len(data) - 1:
+            hooks['log']('\n'.join(messages), 'file')
+            hooks['progress']('epochs', i+1)
+            messages = []
+
+def save_epoch_data_to_npy(epoch_data, config, base, hooks, scalings=None,filtering=False,l_freq=0.0,h_freq=1000.0):
+    '''     Function to save an MNE epoch object to one .npy file (n_epochs, n_channels, n_times) and .json.     '''
+    band = output_band(config, filtering, l_freq, h_freq)
+    if band is not None:
+        file_name_out = base + "_" + str(band[0]) + "-" + str(band[1]) + " Hz_Epochs.npy"
+    else:
+        file_name_out = base + "_Epochs.npy"
+
+    data = epoch_data.get_data(picks='eeg')
+    data *= (scalings or default_scalings)['eeg']
+    data = data.astype(config.get('output_binary_dtype', 'float32'), copy=False)
+    save_array(file_name_out, data, output_metadata(epoch_data, config, scalings, band, epoch_data.selection))
+    msg = 'Output file ' + file_name_out + ' created'
+    hooks['log'](msg, 'file')
+    hooks['progress']('epochs', len(epoch_data))
+
+def save_epoch_data_to_fif(epoch_data, config, base, hooks, scalings=None,filtering=False,l_freq=0.0,h_freq=1000.0):
+    '''     Function to save an MNE epoch object to a -epo.fif file (data in V, scalings not applied).     '''
+    band = output_band(config, filtering, l_freq, h_freq)
+    if band is not None:
+        file_name_out = base + "_" + str(band[0]) + "-" + str(band[1]) + " Hz-epo.fif"
+    else:
+        file_name_out = base + "-epo.fif"
+
+    epoch_data.save(file_name_out, overwrite=True, verbose=False)
+    msg = 'Output file ' + file_name_out + ' created'
+    hooks['log'](msg, 'file')
+    hooks['progress']('epochs', len(epoch_data))
+
+def save_whole_EEG_to_txt(raw_output,config,base,scalings=None,filtering=False,l_freq=0.0,h_freq=1000.0):
+    '''
+    Function to slightly process the raw EEG object and export it to one continuous .txt file.
+    The data is scaled, rounded and written in time chunks, so memory use does not grow with the
+    length of the recording.
+    '''
+    band = output_band(config, filtering, l_freq, h_freq)
+    if band is not None:
+        file_name_out = base + "_" + str(band[0]) + "-" + str(band[1]) + "_" + "Hz.txt"
+    else:
+        file_name_out = base + ".txt"
+
+    ch_names = [raw_output.ch_names[i] for i in mne.pick_types(raw_output.info, eeg=True, exclude=[])]
+    with open(file_name_out, 'w', encoding='UTF-8') as f:
+        f.write('\t'.join(ch_names) + '\n')
+        for _, chunk in scaled_chunks(raw_output, scalings, config['output_txt_decimals']):
+            f.writelines(format_txt_rows(chunk.T))
+    return file_name_out
+
+def save_whole_EEG_to_npy(raw_output,config,base,scalings=None,filtering=False,l_freq=0.0,h_freq=1000.0):
+    '''
+    Function to export the raw EEG object to one .npy file (n_channels, n_times) and .json. The
+    .npy file is written in time chunks through a memory map.
+    '''
+    band = output_band(config, filtering, l_freq, h_freq)
+    if band is not None:
+        file_name_out = base + "_" + str(band[0]) + "-" + str(band[1]) + "_" + "Hz.npy"
+    else:
+        file_name_out = base + ".npy"
+
+    n_channels = len(mne.pick_types(raw_output.info, eeg=True, exclude=[]))
+    dtype = np.dtype(config.get('output_binary_dtype', 'float32'))
+    data = np.lib.format.open_memmap(file_name_out, mode='w+', dtype=dtype,
+                                     shape=(n_channels, int(raw_output.n_times)))
+    for start, chunk in scaled_chunks(raw_output, scalings):
+        data[:, start:start + chunk.shape[1]] = chunk
+    data.flush()
+    del data
+    save_metadata(file_name_out, output_metadata(raw_output, config, scalings, band),
+                  (n_channels, raw_output.n_times), dtype)
+    return file_name_out
+
+def save_whole_EEG_to_fif(raw_output,config,base,scalings=None,filtering=False,l_freq=0.0,h_freq=1000.0):
+    ''' Function to export the raw EEG object to a _raw.fif file (data in V, scalings not applied). '''
+    band = output_band(config, filtering, l_freq, h_freq)
+    if band is not None:
+        file_name_out = base + "_" + str(band[0]) + "-" + str(band[1]) + "_" + "Hz_raw.fif"
+    else:
+        file_name_out = base + "_raw.fif"
+
+    raw_output.save(file_name_out, picks='eeg', overwrite=True, verbose=False)
+    return file_name_out
+
+epoch_writers = {'txt': save_epoch_data_to_txt, 'npy': save_epoch_data_to_npy, 'fif': save_epoch_data_to_fif}
+whole_EEG_writers = {'txt': save_whole_EEG_to_txt, 'npy': save_whole_EEG_to_npy, 'fif': save_whole_EEG_to_fif}
+
+def save_epoch_data(epoch_data, config, base, hooks, scalings=None,filtering=False,l_freq=0.0,h_freq=1000.0):
+    '''     Function to save an MNE epoch object in all output formats of the batch.     '''
+    for output_format in output_formats(config):
+        epoch_writers[output_format](epoch_data, config, base, hooks, scalings=scalings,
+                                     filtering=filtering, l_freq=l_freq, h_freq=h_freq)
+
+def save_whole_EEG(raw_output,config,base,scalings=None,filtering=False,l_freq=0.0,h_freq=1000.0):
+    '''     Function to export the raw EEG object in all output formats of the batch.     '''
+    for output_format in output_formats(config):
+        whole_EEG_writers[output_format](raw_output, config, base, scalings=scalings,
+                                         filtering=filtering, l_freq=l_freq, h_freq=h_freq)
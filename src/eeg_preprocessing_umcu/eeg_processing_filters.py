@@ -0,0 +1,201 @@
+"""
+Filtering of the EEG preprocessing pipeline: the broadband and ICA band-pass filters, FIR band-pass
+filtering of the output signal per frequency band, and a filter bank that produces all bands from a
+single FFT of each channel.
+
+The band-pass filters applied to a signal are recorded in raw.info['temp'] (copied along with the
+signal), so the output filtering only adds the part of a band that was not filtered out already.
+Within a file, a filter applied to the same data a second time is taken from a per-file cache.
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import hashlib
+
+import mne
+import numpy as np
+from scipy.fft import irfft, next_fast_len, rfft
+
+# filter for bad channel/epoch selection, and of the output signal for ICA and/or beamforming
+broadband_filter = dict(l_freq=0.5, h_freq=47, l_trans_bandwidth=0.4, h_trans_bandwidth=1.5)
+# filter of the copy used to fit ICA
+ica_filter = dict(l_freq=1, h_freq=47, l_trans_bandwidth=0.5, h_trans_bandwidth=1.5)
+
+def calc_filt_transition(cutoff_freq):
+    '''
+    Function that returns the FIR filter transition bandwidth based on the cutoff
+    frequency. Below 5 Hz, this is 0.4 (minimum), while above 15 Hz this is 1.5 Hz
+    (maximum). Below 0.4 Hz, the cutoff frequency is used as transition bandwidth.
+    '''
+    base_transition = min(max(cutoff_freq * 0.1, 0.4), 1.5)
+    return float(min(base_transition, cutoff_freq))
+
+def applied_filters(raw):
+    '''     Function that returns the list of band-pass filters (dicts) recorded as applied to raw.     '''
+    temp = raw.info.get('temp')
+    return temp.get('applied_filters', []) if isinstance(temp, dict) else []
+
+def record_filter(raw, l_freq, h_freq, l_trans_bandwidth, h_trans_bandwidth):
+    '''     Function that records a band-pass filter applied to the 'eeg' channels of raw.     '''
+    if not isinstance(raw.info.get('temp'), dict):
+        raw.info['temp'] = {}
+    raw.info['temp']['applied_filters'] = applied_filters(raw) + [dict(
+        l_freq=l_freq, h_freq=h_freq, l_trans_bandwidth=l_trans_bandwidth, h_trans_bandwidth=h_trans_bandwidth)]
+
+def copy_filter_record(raw_from, raw_to):
+    '''     Function that copies the record of applied filters to a signal derived from raw_from.     '''
+    for f in applied_filters(raw_from):
+        record_filter(raw_to, **f)
+    return raw_to
+
+def applied_band(raw):
+    '''
+    Function that returns the band (highest high pass, lowest low pass frequency) raw has already been
+    filtered to, None where no such filter was applied.
+    '''
+    l_freqs = [f['l_freq'] for f in applied_filters(raw) if f['l_freq'] is not None]
+    h_freqs = [f['h_freq'] for f in applied_filters(raw) if f['h_freq'] is not None]
+    return max(l_freqs, default=None), min(h_freqs, default=None)
+
+def data_checksum(raw, picks):
+    '''     Function that returns a checksum of the channels (picks) of raw, their data and sample frequency.     '''
+    h = hashlib.blake2b(digest_size=20)
+    h.update(repr(([raw.ch_names[i] for i in picks], raw.info['sfreq'], raw.first_samp)).encode())
+    for i in picks: # one channel at a time, no copy of all data
+        h.update(np.ascontiguousarray(raw.get_data(picks=[i])).data)
+    return h.hexdigest()
+
+def filter_raw(raw, l_freq, h_freq, l_trans_bandwidth, h_trans_bandwidth, filter_cache=None, hooks=None):
+    '''
+    Function that band-pass filters the 'eeg' channels of raw in place (as raw.filter) and records the
+    filter. With a filter_cache (dict, per file) the result is stored; when the same filter is requested
+    for the same data (same channels, same checksum) later, the stored result is used (once) instead.
+    Messages go to hooks['log'] (none without hooks).
+    '''
+    picks = mne.pick_types(raw.info, eeg=True, exclude=[])
+    params = (l_freq, h_freq, l_trans_bandwidth, h_trans_bandwidth)
+    key = (data_checksum(raw, picks), params) if filter_cache is not None else None
+    if key is not None and key in filter_cache:
+        filtered = filter_cache.pop(key)
+        raw.apply_function(lambda data: filtered, picks=picks, channel_wise=False)
+        if hooks is not None:
+            hooks['log'](f"Filtered data ({l_freq}-{h_freq} Hz) reused", 'run')
+    else:
+        raw.filter(l_freq=l_freq, h_freq=h_freq, l_trans_bandwidth=l_trans_bandwidth,
+                   h_trans_bandwidth=h_trans_bandwidth, picks=picks)
+        if key is not None:
+            filter_cache[key] = raw.get_data(picks=picks)
+    record_filter(raw, *params)
+    return raw
+
+def output_filter_parameters(raw,l_freq,h_freq,hooks=None):
+    '''
+    Function that returns l_freq, h_freq and the transition bandwidths for filtering the output
+    in a frequency band. High and low pass filters that raw has already been filtered with (the
+    0.5-47 Hz broadband filter before ICA and/or beamforming) are not applied a second time
+    (l_freq/h_freq None), which is logged with hooks['log'] (none without hooks).
+    '''
+    l_freq = float(l_freq)
+    h_freq = float(h_freq)
+    l_trans = calc_filt_transition(l_freq)
+    h_trans = calc_filt_transition(h_freq)
+    l_applied, h_applied = applied_band(raw)
+    if l_applied is not None and l_freq <= l_applied:
+        l_freq = None
+        msg = f"No additional (<) {l_applied} Hz high pass filter applied, already broadband filtered before beamformer and/or ICA"
+        if hooks is not None:
+            hooks['log'](msg, 'run')
+
+    if h_applied is not None and h_freq >= h_applied:
+        h_freq = None
+        msg = f"No additional (>) {h_applied} Hz low pass filter applied, already broadband filtered before beamformer and/or ICA"
+        if hooks is not None:
+            hooks['log'](msg, 'run')
+    return l_freq, h_freq, l_trans, h_trans
+
+def filter_output_raw(raw_output,config,l_freq,h_freq,hooks=None):
+    '''
+    Applys a FIR bandpass filter to the raw EEG object. If the raw EEG object has already been bandpass
+    filtered at 0.5-47 Hz (ICA and/or Beamforming), filtering at these (or broader) frequencies is not
+    performed a second time. The transition band is calculated in a separate function.
+    '''
+    l_freq, h_freq, l_trans, h_trans = output_filter_parameters(raw_output, l_freq, h_freq, hooks)
+    if l_freq or h_freq:
+        raw_output = filter_raw(raw_output.copy(), l_freq, h_freq, l_trans, h_trans, hooks=hooks)
+    return raw_output
+
+def reflect_limited_pad(x, n_pad):
+    '''
+    Function that pads the last axis of x on both sides with n_pad samples of odd reflection
+    (zeros where the reflection is longer than the signal), as MNE does before FIR filtering.
+    '''
+    n_times = x.shape[-1]
+    z_pad = np.zeros(x.shape[:-1] + (max(n_pad - n_times + 1, 0),), dtype=x.dtype)
+    return np.concatenate([z_pad,
+                           2 * x[..., :1] - x[..., n_pad:0:-1],
+                           x,
+                           2 * x[..., -1:] - x[..., -2:-n_pad - 2:-1],
+                           z_pad], axis=-1)
+
+def design_band_filters(raw, config, bands, hooks=None):
+    '''
+    Function that designs the FIR kernels of all frequency bands once, with the same parameters
+    as filter_output_raw / raw.filter. Returns per band (kernel, filter parameters), or None for
+    bands that need no additional filtering.
+    '''
+    kernels = []
+    for l_freq, h_freq in bands:
+        l_freq, h_freq, l_trans, h_trans = output_filter_parameters(raw, l_freq, h_freq, hooks)
+        if l_freq or h_freq:
+            kernels.append((mne.filter.create_filter(
+                None, raw.info['sfreq'], l_freq, h_freq,
+                l_trans_bandwidth=l_trans, h_trans_bandwidth=h_trans, verbose=False),
+                (l_freq, h_freq, l_trans, h_trans)))
+        else:
+            kernels.append(None)
+    return kernels
+
+def filter_bank(raw, config, bands, block_size=8, hooks=None):
+    '''
+    Generator that filters the 'eeg' channels of raw in all frequency bands (list of (l_freq, h_freq))
+    and yields (l_freq, h_freq, raw_band) one band at a time. All kernels are designed once, every
+    channel is padded and FFT'ed once and each band is obtained from that shared spectrum, which gives
+    the same result as filter_output_raw per band. Only one band output exists at a time (the caller
+    should release it before asking for the next one); inverse FFTs are done in blocks of channels.
+    '''
+    kernels = design_band_filters(raw, config, bands, hooks)
+    lengths = [len(k[0]) for k in kernels if k is not None]
+    if not lengths:
+        for l_freq, h_freq in bands:
+            yield l_freq, h_freq, raw
+        return
+
+    picks = mne.pick_types(raw.info, eeg=True, exclude=[])
+    n_times = raw.n_times
+    n_edge = max(min(n_h, n_times) - 1 for n_h in lengths) # padding long enough for every kernel
+    n_fft = next_fast_len(n_times + 2 * n_edge + max(lengths) - 1, real=True)
+
+    # padded spectrum of every 'eeg' channel, computed once
+    spectrum = np.empty((len(picks), n_fft // 2 + 1), dtype=np.complex128)
+    for start in range(0, len(picks), block_size):
+        block = picks[start:start + block_size]
+        spectrum[start:start + len(block)] = rfft(
+            reflect_limited_pad(raw.get_data(picks=block), n_edge), n_fft, axis=-1)
+
+    for (l_freq, h_freq), kernel in zip(bands, kernels, strict=True):
+        if kernel is None:
+            yield l_freq, h_freq, raw
+            continue
+        h, params = kernel
+        kernel_spectrum = rfft(h, n_fft)
+        shift = n_edge + (len(h) - 1) // 2 # zero phase: compensate padding and filter delay
+        data = raw.get_data()
+        for start in range(0, len(picks), block_size):
+            stop = min(start + block_size, len(picks))
+            filtered = irfft(spectrum[start:stop] * kernel_spectrum, n_fft, axis=-1)
+            data[picks[start:stop]] = filtered[:, shift:shift + n_times]
+        raw_band = mne.io.RawArray(data, raw.info, first_samp=raw.first_samp, verbose=False)
+        raw_band.set_annotations(raw.annotations)
+        record_filter(raw_band, *params)
+        yield l_freq, h_freq, raw_band
+        del raw_band, data
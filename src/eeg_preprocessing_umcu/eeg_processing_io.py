@@ -0,0 +1,282 @@
+"""
+Loading of raw EEG files for the EEG preprocessing pipeline.
+
+Tab separated .txt recordings (one row per sample, one column per channel, in µV) are parsed in
+chunks straight into a preallocated channel-major array in V, optionally by several threads over
+byte ranges of the file. The parsed array (float64, as MNE keeps it) is kept in a binary sidecar
+file (<file>.eegcache.npz) in the eegcache directory of the output directory, so a rerun of the batch
+does not parse the text again.
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import mne
+import numpy as np
+
+biosemi64_channel_names = [
+    'Fp1', 'AF7', 'AF3', 'F1', 'F3', 'F5', 'F7', 'FT7',
+    'FC5', 'FC3', 'FC1', 'C1', 'C3', 'C5', 'T7', 'TP7',
+    'CP5', 'CP3', 'CP1', 'P1', 'P3', 'P5', 'P7', 'P9',
+    'PO7', 'PO3', 'O1', 'Iz', 'Oz', 'POz', 'Pz', 'CPz',
+    'Fpz', 'Fp2', 'AF8', 'AF4', 'AFz', 'Fz', 'F2', 'F4',
+    'F6', 'F8', 'FT8', 'FC6', 'FC4', 'FC2', 'FCz', 'Cz',
+    'C2', 'C4', 'C6', 'T8', 'TP8', 'CP6', 'CP4', 'CP2',
+    'P2', 'P4', 'P6', 'P8', 'P10', 'PO8', 'PO4', 'O2'
+    ]
+
+txt_chunk_bytes = 64 * 1024**2 # bytes of text parsed at once
+txt_sidecar_suffix = '.eegcache.npz'
+txt_sidecar_version = 2
+txt_cache_subdirectory = 'eegcache' # in the output directory, shared by the batches
+
+def sniff_txt_header(file_path):
+    '''
+    Function that checks if the first row of a .txt file contains numeric data. Returns the channel
+    names of the header (None if there is no header) and the byte offset of the first data row.
+    '''
+    with open(file_path, 'rb') as file:
+        first_line = file.readline()
+    fields = first_line.decode('utf-8-sig').strip().split('\t')
+    # Try to convert first line values to float to check if they're numeric
+    try:
+        _ = [float(x) for x in fields]
+        return None, 0
+    except ValueError:
+        return fields, len(first_line)
+
+def split_byte_ranges(file_path, start, n_ranges):
+    '''     Function that splits the file from byte start to the end in n_ranges ranges that start at a row.     '''
+    size = os.path.getsize(file_path)
+    bounds = [start]
+    with open(file_path, 'rb') as file:
+        for k in range(1, n_ranges):
+            pos = max(start + (size - start) * k // n_ranges, bounds[-1])
+            file.seek(pos)
+            file.readline() # move to the start of the next row
+            bounds.append(min(file.tell(), size))
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:], strict=True) if b > a]
+
+def read_byte_blocks(file_path, start, stop, chunk_bytes=txt_chunk_bytes):
+    '''     Generator that yields blocks of whole rows (bytes) of the file between byte start and stop.     '''
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        rest = b''
+        pos = start
+        while pos < stop:
+            block = file.read(min(chunk_bytes, stop - pos))
+            if not block:
+                break
+            pos += len(block)
+            block = rest + block
+            last = block.rfind(b'\n') + 1
+            if pos >= stop:
+                last = len(block)
+            rest = block[last:]
+            if last:
+                yield block[:last]
+        if rest:
+            yield rest
+
+def count_rows(file_path, start, stop):
+    '''     Function that counts the rows (upper bound, blank rows included) between byte start and stop.     '''
+    n_rows = 0
+    last = b''
+    for block in read_byte_blocks(file_path, start, stop):
+        n_rows += block.count(b'\n')
+        last = block
+    if last and not last.endswith(b'\n'):
+        n_rows += 1 # last row without newline
+    return n_rows
+
+def parse_byte_range(file_path, start, stop, data, offset, scaling):
+    '''
+    Function that parses the rows between byte start and stop into data[:, offset:], scaled in place.
+    Returns the number of rows parsed and a mask of the channels containing missing values (NaN).
+    '''
+    # only needed for .txt files (slow import)
+    import pandas as pd
+    n_channels = data.shape[0]
+    nan_channels = np.zeros(n_channels, dtype=bool)
+    row = offset
+    for block in read_byte_blocks(file_path, start, stop):
+        try:
+            chunk = pd.read_csv(io.BytesIO(block), sep='\t', index_col=False, header=None,
+                                dtype=np.float64, engine='c').to_numpy()
+        except pd.errors.EmptyDataError: # only blank rows
+            continue
+        except ValueError as e:
+            raise ValueError(f"Non-numeric values found in the data. Please check your file format. Error: {e}") from e
+        if chunk.shape[1] < n_channels:
+            raise ValueError(f"Row with {chunk.shape[1]} columns found, expected {n_channels}. Please check your file format.")
+        chunk = chunk[:, :n_channels]
+        nan_channels |= np.isnan(chunk).any(axis=0)
+        # transpose to channel-major and scale from µV to V directly into the output array
+        np.multiply(chunk.T, scaling, out=data[:, row:row + len(chunk)], casting='same_kind')
+        row += len(chunk)
+    return row - offset, nan_channels
+
+def read_txt_eeg(file_path, n_threads=1, dtype=np.float64, scaling=1e-6):
+    '''
+    Function that reads a tab separated .txt EEG file (rows are samples, columns channels, optional
+    header) into a C-contiguous (n_channels, n_times) array, scaled from µV to V. The text is parsed in
+    chunks, by n_threads threads over byte ranges of the file. Returns the data, the header channel
+    names (None without header) and a boolean mask of channels with missing values.
+    '''
+    header, start = sniff_txt_header(file_path)
+    first_row = next(read_byte_blocks(file_path, start, os.path.getsize(file_path), chunk_bytes=1024**2), b'')
+    first_row = first_row.split(b'\n', 1)[0]
+    n_channels = len(header) if header is not None else len(first_row.rstrip(b'\r').split(b'\t'))
+
+    ranges = split_byte_ranges(file_path, start, max(1, n_threads))
+    with ThreadPoolExecutor(max_workers=max(1, n_threads)) as executor:
+        counts = list(executor.map(lambda r: count_rows(file_path, *r), ranges))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(int)
+        data = np.empty((n_channels, offsets[-1]), dtype=dtype)
+        results = list(executor.map(lambda k: parse_byte_range(file_path, *ranges[k], data, offsets[k], scaling),
+                                    range(len(ranges))))
+
+    n_parsed = [n for n, _ in results]
+    nan_channels = np.zeros(n_channels, dtype=bool)
+    for _, mask in results:
+        nan_channels |= mask
+    if n_parsed != counts: # blank rows: close the gaps at the end of the ranges
+        row = 0
+        for offset, n in zip(offsets[:-1], n_parsed, strict=True):
+            data[:, row:row + n] = data[:, offset:offset + n]
+            row += n
+        data = np.ascontiguousarray(data[:, :row])
+    return data, header, nan_channels
+
+def txt_sidecar_path(file_path, config):
+    '''
+    Function that returns the path of the binary sidecar of a .txt file: in the cache directory of
+    the settings, by default in the eegcache directory of the output directory (next to the .txt
+    file if there is no output directory).
+    '''
+    cache_dir = config.get('txt_cache_directory', '').strip()
+    if not cache_dir and config.get('output_directory', '').strip():
+        cache_dir = os.path.join(config['output_directory'].strip(), txt_cache_subdirectory)
+    elif not cache_dir:
+        cache_dir = os.path.dirname(os.path.abspath(file_path))
+    return os.path.join(cache_dir, os.path.basename(file_path) + txt_sidecar_suffix)
+
+def load_txt_eeg(file_path, config, hooks):
+    '''
+    Function that returns data, header and missing value mask of a .txt EEG file (see read_txt_eeg),
+    from the binary sidecar if it matches the current file, otherwise parsed and stored in the sidecar.
+    The use or failed storage of the sidecar is logged through hooks['log'].
+    '''
+    use_sidecar = config.get('txt_binary_cache', 1)
+    stat = os.stat(file_path)
+    signature = np.array([txt_sidecar_version, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    sidecar = txt_sidecar_path(file_path, config)
+
+    if use_sidecar and os.path.exists(sidecar):
+        with np.load(sidecar, allow_pickle=False) as f:
+            if np.array_equal(f['signature'], signature):
+                header = f['header'].tolist() if f['has_header'] else None
+                hooks['log']('Binary copy of ' + str(file_path) + ' used: ' + sidecar, 'run')
+                return f['data'], header, f['nan_channels']
+
+    data, header, nan_channels = read_txt_eeg(file_path, n_threads=config.get('txt_reader_threads', 1))
+
+    if use_sidecar:
+        try:
+            os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+            tmp_fn = sidecar + '.' + str(os.getpid()) + '.tmp.npz'
+            np.savez(tmp_fn, data=data, signature=signature, nan_channels=nan_channels,
+                     has_header=header is not None, header=np.array(header if header is not None else [], dtype=np.str_))
+            os.replace(tmp_fn, sidecar)
+        except OSError as e: # e.g. read-only input directory
+            hooks['log']('No binary copy of ' + str(file_path) + ' stored: ' + str(e), 'run')
+    return data, header, nan_channels
+
+def open_raw(config, exclude=()):
+    '''
+    Function that opens a .bdf, .edf, .vhdr or .fif file without loading data (header only), with
+    the channels in exclude left out: by the reader for .bdf/.edf, by picking before loading otherwise.
+    '''
+    file_path = config['file_path']
+    exclude = list(exclude)
+    if config['file_pattern'] == "*.bdf":
+        raw = mne.io.read_raw_bdf(file_path, exclude=exclude, preload=False)
+    elif config['file_pattern'] == "*.edf":
+        raw = mne.io.read_raw_edf(file_path, exclude=exclude, preload=False)
+    elif config['file_pattern'] == "*.vhdr":
+        raw = mne.io.read_raw_brainvision(file_path, preload=False)
+    elif config['file_pattern'] == "*.fif":
+        raw = mne.io.read_raw_fif(file_path, preload=False)
+        raw.pick_types(eeg=True, meg=False, eog=False)
+    raw.drop_channels(exclude, on_missing='ignore')
+    return raw
+
+def probe_channel_names(config):
+    '''     Function that returns the channel names of a .bdf, .edf, .vhdr or .fif file from its header.     '''
+    return open_raw(config).ch_names
+
+def create_raw(config, montage, no_montage_files, hooks, exclude=()):
+    '''
+    Function used to load a raw EEG file using the correct MNE function based on the file type.
+    Now handles .txt files both with and without headers by detecting if the first row contains numeric data.
+    If no header is present, it generates channel names automatically (CH1, CH2, etc.).
+    Channels in exclude are not loaded from .bdf, .edf, .vhdr and .fif files (.txt files are loaded
+    completely, the caller drops them).
+    '''
+    file_path = config['file_path']
+    if config['file_pattern'] == "*.txt":
+        samples, header, nan_channels = load_txt_eeg(file_path, config, hooks) # already scaled from µV to V
+        n_columns = samples.shape[0]
+
+        if header is not None:
+            columns = header
+            if config['channel_names'] == []:
+                ch_names = list(header)
+                config['channel_names'] = ch_names
+            else:
+                ch_names = config['channel_names']
+        else:
+            columns = list(range(n_columns))
+            if config['channel_names'] == [] and config['montage', config['input_file_pattern']] == "biosemi64":
+                ch_names = biosemi64_channel_names
+                # Check if number of channels matches BioSemi64
+                if len(ch_names) != n_columns:
+                    hooks['warn'](f'File has {n_columns} channels but BioSemi64 requires 64 channels.\n'
+                                  'Using generic channel names instead.')
+                    ch_names = [f'CH{i+1}' for i in range(n_columns)]
+                config['channel_names'] = ch_names
+            else:
+                ch_names = [f'CH{i+1}' for i in range(n_columns)]
+                config['channel_names'] = ch_names
+
+        ch_types = ["eeg"] * len(ch_names)
+        info = mne.create_info(
+            ch_names=ch_names,
+            sfreq=config['sample_frequency'],
+            ch_types=ch_types
+        )
+
+        # Ensure we're only taking the data columns (contiguous row slice, no copy)
+        raw = mne.io.RawArray(samples[:len(ch_names)], info)
+
+        # Check for missing values
+        missing_channels = [str(columns[idx]) for idx in np.flatnonzero(nan_channels[:len(ch_names)])]
+
+        if missing_channels:
+            missing_str = ', '.join(missing_channels)
+            hooks['warn'](f'Channels with missing values found:\n{missing_str}\n'
+                          'Please drop these channel(s)!')
+
+    else:
+        # header first, then only the retained channels are loaded
+        raw = open_raw(config, exclude)
+        raw.load_data()
+
+    if config['file_pattern'] not in no_montage_files:
+        raw.set_montage(montage=montage, on_missing='ignore')
+    config['sample_frequency'] = raw.info["sfreq"]
+    return raw, config
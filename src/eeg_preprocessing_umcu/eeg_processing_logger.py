@@ -0,0 +1,147 @@
+"""
+Log file of a batch, written while the batch is processed.
+
+Every message is appended to the .log of the batch as it is logged (buffered, flushed at least
+every config['log_flush_interval'] seconds and at the end of every file), so the log of a long
+batch is not kept in memory, is complete up to the last flush after a crash, and can be followed
+with tail -f. The messages of a file are written as one section, closed with its status and time.
+With config['log_json_lines'] every message is also written as a JSON record to <batch>.log.jsonl:
+
+    {"time": "2024-05-01T09:56:45.123", "batch": "...", "file": "rec1.bdf", "panel": "run",
+     "event": "message", "msg": "..."}
+
+with event 'message', 'file_start' or 'file_end' (with "status" and "seconds").
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+
+max_buffered_lines = 1000 # flushed earlier when this many lines are waiting
+
+def now():
+    '''     Function that returns the current time as used in the log records.     '''
+    return datetime.now().isoformat(timespec='milliseconds')
+
+def json_lines_path(config):
+    '''     Function that returns the path of the JSON lines log of the batch, next to its .log.     '''
+    return config['logfile'] + '.jsonl'
+
+def open_batch_log(config):
+    '''
+    Function that opens the log of the batch for appending and returns the logger (dict). A batch
+    that is resumed (the log exists) continues its log. The files stay open for the batch: the
+    caller closes them with close_batch_log (in a finally clause, so also when processing fails).
+    '''
+    fn = config['logfile']
+    resumed = os.path.exists(fn) and os.path.getsize(fn) > 0
+    file = open(fn, 'a', encoding='UTF-8') # noqa: SIM115 (closed by close_batch_log)
+    events = None
+    if config.get('log_json_lines', 0):
+        try:
+            events = open(json_lines_path(config), 'a', encoding='UTF-8') # noqa: SIM115 (closed by close_batch_log)
+        except OSError:
+            file.close()
+            raise
+    return {
+        'batch_name': config['batch_name'],
+        'file': file,
+        'events': events,
+        'lines': [], # not yet written
+        'last': None, # (panel, message) of the last message
+        'records': [],
+        'flush_interval': config.get('log_flush_interval', 1.0),
+        'flushed': time.monotonic(),
+        'section': None, # file name of the current section
+        'section_start': None,
+        'resumed': resumed,
+        }
+
+def log_record(logger, event, msg=None, panel='run', timestamp=None, **fields):
+    '''     Function that adds a record to the JSON lines log (if any).     '''
+    if logger['events'] is None:
+        return
+    record = {'time': timestamp or now(), 'batch': logger['batch_name'], 'file': logger['section'],
+              'panel': panel, 'event': event}
+    if msg is not None:
+        record['msg'] = msg
+    record.update(fields)
+    logger['records'].append(json.dumps(record, default=str))
+
+def log_message(logger, msg, panel='run', timestamp=None):
+    '''
+    Function that adds a message (panel 'run' or 'file') to the log, flushed when due. A message
+    shown in both panels (e.g. the header of a file) is written to the .log once.
+    '''
+    previous = logger['last']
+    logger['last'] = (panel, str(msg))
+    if previous is None or previous[1] != str(msg) or previous[0] == panel:
+        logger['lines'].append(str(msg))
+    log_record(logger, 'message', str(msg), panel, timestamp)
+    if len(logger['lines']) >= max_buffered_lines or \
+            time.monotonic() - logger['flushed'] >= logger['flush_interval']:
+        flush_log(logger)
+
+def start_file_section(logger, file_name):
+    '''     Function that starts the section of a file: the following messages belong to this file.     '''
+    logger['section'] = file_name
+    logger['section_start'] = time.perf_counter()
+    log_record(logger, 'file_start')
+
+def end_file_section(logger, status, seconds=None):
+    '''
+    Function that closes the section of the current file (if any) with its status ('done',
+    'failed') and processing time in seconds (default: since the start of the section), and flushes
+    the log.
+    '''
+    file_name = logger['section']
+    if file_name is None:
+        return
+    if seconds is None:
+        seconds = time.perf_counter() - logger['section_start']
+    logger['lines'].append('*** File ' + file_name + ' ' + status + ' (' + str(round(seconds, 1)) + ' s) ***')
+    log_record(logger, 'file_end', status=status, seconds=round(seconds, 3))
+    logger['section'] = None
+    logger['section_start'] = None
+    flush_log(logger)
+
+def log_file_section(logger, file_name, messages, status, seconds=None):
+    '''
+    Function that writes the section of a file processed elsewhere (e.g. by a worker process) from
+    its messages: (time, panel, message) tuples.
+    '''
+    start_file_section(logger, file_name)
+    for timestamp, panel, msg in messages:
+        log_message(logger, msg, panel, timestamp)
+    end_file_section(logger, status, seconds)
+
+def flush_log(logger):
+    '''     Function that writes the buffered lines (and records) to the log file(s).     '''
+    if logger['file'].closed:
+        return
+    if logger['lines']:
+        logger['file'].write('\n'.join(logger['lines']) + '\n')
+        logger['lines'] = []
+    logger['file'].flush()
+    if logger['events'] is not None:
+        if logger['records']:
+            logger['events'].write('\n'.join(logger['records']) + '\n')
+            logger['records'] = []
+        logger['events'].flush()
+    logger['flushed'] = time.monotonic()
+
+def close_batch_log(logger):
+    '''
+    Function that flushes and closes the log file(s) of the batch, returns the path of the .log.
+    The files are closed also when flushing fails (e.g. disk full).
+    '''
+    try:
+        flush_log(logger)
+    finally:
+        logger['file'].close()
+        if logger['events'] is not None:
+            logger['events'].close()
+    return logger['file'].name
@@ -0,0 +1,265 @@
+"""
+Manifest of a batch: an indexed SQLite database (<batch_name>.manifest.sqlite in the batch output
+directory) with the settings of the batch and the state of every file, used to resume an interrupted
+batch and as the source of the batch .pkl.
+
+Tables (one row per file, or per channel, epoch or output file of a file):
+    settings      the batch settings (the config without the entries of the files), pickled
+    files         input file signature (size and modification time), hash of the settings the file
+                  was processed with (including its bad channel and epoch selection), processing time
+                  (start, seconds) and whether it was completed
+    bad_channels, epochs, ica (fitted ICA file, fingerprint, excluded components), outputs (output
+                  files relative to the batch directory, with their sizes)
+    file_entries  other entries of a file (config[file_name, key]), e.g. its metrics, pickled
+When a file is completed only its rows are written. The batch settings are written when the batch
+starts, and once more if the channels to be dropped are selected with the first file of a new
+batch (the only setting of the output that is selected while processing). Parallel workers
+write their own files (WAL journal, readers and writers do not block each other); SQLite needs a
+local file system for this, shards on a cluster therefore have their own manifest (see
+eeg_processing_shards.py). When the batch is resumed, files whose entry is still valid (same input,
+same settings, all outputs present with the recorded size) are skipped:
+
+    python eeg_processing_engine.py <interrupted_batch>.pkl --resume
+
+An existing .pkl can be imported into a manifest, and a manifest exported to a .pkl:
+
+    python eeg_processing_manifest.py import <batch>.pkl
+    python eeg_processing_manifest.py export <batch>.manifest.sqlite <batch>.pkl
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import argparse
+import hashlib
+import os
+import pickle
+import sqlite3
+
+import numpy as np
+
+# settings that change the output of a file
+processing_settings = ['input_file_pattern', 'channels_to_be_dropped', 'apply_average_ref', 'apply_epoch_selection',
+                       'epoch_length', 'apply_ica', 'nr_ica_components', 'apply_beamformer', 'downsample_factor',
+                       'apply_output_filtering', 'frequency_bands', 'output_txt_decimals', 'output_formats',
+                       'output_binary_dtype', 'resample_method', 'beamformer_dtype']
+# settings of a file
+file_settings = ['bad', 'epochs']
+# entries of a file with their own table or column, the others go to file_entries
+file_tables = ['bad', 'epochs', 'ica', 'timing']
+
+schema = '''
+CREATE TABLE IF NOT EXISTS settings (key BLOB PRIMARY KEY, value BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS files (file_name TEXT PRIMARY KEY, position INTEGER NOT NULL, input_file TEXT,
+    input_size INTEGER, input_mtime_ns INTEGER, settings_hash TEXT, start TEXT, seconds REAL,
+    completed INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS bad_channels (file_name TEXT NOT NULL, position INTEGER NOT NULL, channel TEXT NOT NULL,
+    PRIMARY KEY (file_name, position));
+CREATE TABLE IF NOT EXISTS epochs (file_name TEXT NOT NULL, position INTEGER NOT NULL, epoch INTEGER NOT NULL,
+    PRIMARY KEY (file_name, position));
+CREATE TABLE IF NOT EXISTS ica (file_name TEXT PRIMARY KEY, file TEXT NOT NULL, fingerprint TEXT NOT NULL,
+    exclude TEXT);
+CREATE TABLE IF NOT EXISTS outputs (file_name TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL,
+    PRIMARY KEY (file_name, path));
+CREATE TABLE IF NOT EXISTS file_entries (file_name TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,
+    PRIMARY KEY (file_name, key));
+'''
+file_row_tables = ['bad_channels', 'epochs', 'ica', 'outputs', 'file_entries'] # rows of a file besides files
+
+def manifest_path(config):
+    '''     Function that returns the path of the manifest of the batch.     '''
+    return os.path.join(config['batch_output_subdirectory'], config['batch_name'] + '.manifest.sqlite')
+
+def open_manifest(fn):
+    '''     Function that opens (creates if needed) a manifest database, shared by the processes of a batch.     '''
+    manifest = sqlite3.connect(fn, timeout=60) # wait for other writers instead of failing
+    manifest.execute('PRAGMA journal_mode=WAL') # readers and the writer do not block each other
+    manifest.executescript(schema)
+    return manifest
+
+def load_manifest(config):
+    '''     Function that returns the manifest of the batch (an empty manifest if there is none yet).     '''
+    return open_manifest(manifest_path(config))
+
+def input_signature(file_path):
+    '''     Function that returns the signature (size and modification time) of an input file.     '''
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def settings_hash(config, file_name):
+    '''     Function that returns a hash of the settings a file is processed with.     '''
+    values = [(key, config.get(key)) for key in processing_settings]
+    values += [(key, config[key]) for key in sorted(k for k in config if isinstance(k, tuple) and k[0] == 'cut_off_frequency')]
+    values += [(key, list(config.get((file_name, key), []))) for key in file_settings]
+    return hashlib.sha1(repr(values).encode()).hexdigest()
+
+def list_outputs(config, file_name):
+    '''     Function that returns the output files of a file (relative to the batch directory) with their sizes.     '''
+    batch_dir = config['batch_output_subdirectory']
+    fns = [os.path.join(config['file_output_subdirectory'], fn) for fn in sorted(os.listdir(config['file_output_subdirectory']))]
+    if (file_name, 'ica') in config:
+        fns.append(os.path.join(batch_dir, os.path.basename(config[file_name, 'ica']['file'])))
+    return {os.path.relpath(fn, batch_dir): os.path.getsize(fn) for fn in fns if os.path.isfile(fn)}
+
+def is_file_key(key, file_names):
+    '''     Function that checks if a config key is an entry of a file (config[file_name, key]), file_names a set.     '''
+    return isinstance(key, tuple) and len(key) == 2 and key[0] in file_names
+
+def write_settings(config, manifest):
+    '''
+    Function that writes the batch settings (all entries except those of the files, which have their
+    own tables) to the manifest, replacing the previous settings.
+    '''
+    file_names = set(config.get('input_file_names', []))
+    rows = [(pickle.dumps(key), pickle.dumps(value)) for key, value in config.items() if not is_file_key(key, file_names)]
+    with manifest:
+        manifest.execute('DELETE FROM settings')
+        manifest.executemany('INSERT INTO settings VALUES (?, ?)', rows)
+
+def write_file(config, manifest, file_name, input_file=None, outputs=None):
+    '''
+    Function that writes all entries of a file to the manifest in one transaction, replacing its
+    previous rows. With input_file and outputs (a processed file) the file is marked completed.
+    '''
+    file_names = config.get('input_file_names', [])
+    position = file_names.index(file_name) if file_name in file_names else len(file_names)
+    signature = input_signature(input_file) if input_file is not None else {'size': None, 'mtime_ns': None}
+    timing = config.get((file_name, 'timing')) or {'start': None, 'seconds': None}
+    ica = config.get((file_name, 'ica'))
+    with manifest:
+        for table in ['files'] + file_row_tables:
+            manifest.execute(f'DELETE FROM {table} WHERE file_name = ?', (file_name,))
+        manifest.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (file_name, position, input_file, signature['size'], signature['mtime_ns'],
+                          settings_hash(config, file_name), timing['start'], timing['seconds'], int(outputs is not None)))
+        manifest.executemany('INSERT INTO bad_channels VALUES (?, ?, ?)',
+                             [(file_name, idx, ch) for idx, ch in enumerate(config.get((file_name, 'bad'), []))])
+        if (file_name, 'epochs') in config:
+            manifest.executemany('INSERT INTO epochs VALUES (?, ?, ?)',
+                                 [(file_name, idx, int(epoch)) for idx, epoch in enumerate(config[file_name, 'epochs'])])
+        if ica is not None:
+            exclude = ica.get('exclude')
+            manifest.execute('INSERT INTO ica VALUES (?, ?, ?, ?)', (file_name, ica['file'], ica['fingerprint'],
+                             None if exclude is None else ','.join(str(idx) for idx in exclude)))
+        manifest.executemany('INSERT INTO outputs VALUES (?, ?, ?)',
+                             [(file_name, fn, size) for fn, size in (outputs or {}).items()])
+        manifest.executemany('INSERT INTO file_entries VALUES (?, ?, ?)',
+                             [(file_name, key[1], pickle.dumps(value)) for key, value in config.items()
+                              if isinstance(key, tuple) and len(key) == 2 and key[0] == file_name and key[1] not in file_tables])
+
+def record_file(config, manifest, file_path):
+    '''
+    Function that adds a completely processed file (config as returned by process_file) to the
+    manifest: its entries, input signature, settings hash and outputs (only the rows of this file).
+    '''
+    file_name = os.path.basename(file_path)
+    write_file(config, manifest, file_name, file_path, list_outputs(config, file_name))
+
+def file_entry(manifest, file_name):
+    '''
+    Function that returns the manifest entry of a file (input file and signature, settings hash,
+    outputs, timing, completed), None if the file is not in the manifest.
+    '''
+    row = manifest.execute('SELECT input_file, input_size, input_mtime_ns, settings_hash, start, seconds, completed '
+                           'FROM files WHERE file_name = ?', (file_name,)).fetchone()
+    if row is None:
+        return None
+    outputs = manifest.execute('SELECT path, size FROM outputs WHERE file_name = ?', (file_name,)).fetchall()
+    return {'input_file': row[0], 'input': {'size': row[1], 'mtime_ns': row[2]}, 'settings_hash': row[3],
+            'timing': {'start': row[4], 'seconds': row[5]} if row[4] is not None else None,
+            'outputs': dict(outputs), 'completed': bool(row[6])}
+
+def file_entries(manifest, file_name):
+    '''     Function that returns the entries of a file as in the config: {(file_name, key): value}.     '''
+    entries = {}
+    entry = file_entry(manifest, file_name)
+    if entry is None:
+        return entries
+    entries[file_name, 'bad'] = [ch for ch, in manifest.execute(
+        'SELECT channel FROM bad_channels WHERE file_name = ? ORDER BY position', (file_name,))]
+    epochs = [epoch for epoch, in manifest.execute(
+        'SELECT epoch FROM epochs WHERE file_name = ? ORDER BY position', (file_name,))]
+    if epochs:
+        entries[file_name, 'epochs'] = np.array(epochs, dtype=np.int64) # as epochs.selection
+    row = manifest.execute('SELECT file, fingerprint, exclude FROM ica WHERE file_name = ?', (file_name,)).fetchone()
+    if row is not None:
+        entries[file_name, 'ica'] = {'file': row[0], 'fingerprint': row[1]}
+        if row[2] is not None:
+            entries[file_name, 'ica']['exclude'] = [int(idx) for idx in row[2].split(',') if idx]
+    if entry['timing'] is not None:
+        entries[file_name, 'timing'] = entry['timing']
+    for key, value in manifest.execute('SELECT key, value FROM file_entries WHERE file_name = ?', (file_name,)):
+        entries[file_name, key] = pickle.loads(value)
+    return entries
+
+def file_complete(config, manifest, file_path):
+    '''
+    Function that checks if a file was processed completely in this batch, with the current input file
+    and settings, and all its outputs are still present with the recorded size.
+    '''
+    file_name = os.path.basename(file_path)
+    entry = file_entry(manifest, file_name)
+    if entry is None or not entry['completed'] or not entry['outputs'] or not os.path.exists(file_path):
+        return False
+    if entry['input'] != input_signature(file_path) or entry['settings_hash'] != settings_hash(config, file_name):
+        return False
+    for fn, size in entry['outputs'].items():
+        fn = os.path.join(config['batch_output_subdirectory'], fn)
+        if not os.path.isfile(fn) or os.path.getsize(fn) != size:
+            return False
+    return True
+
+def export_config(manifest):
+    '''     Function that returns the config of the batch (settings and entries of all files) from the manifest.     '''
+    config = {pickle.loads(key): pickle.loads(value) for key, value in manifest.execute('SELECT key, value FROM settings')}
+    file_names = list(config.get('input_file_names', []))
+    for file_name, in manifest.execute('SELECT file_name FROM files ORDER BY position'):
+        if file_name not in file_names:
+            file_names.append(file_name)
+    config['input_file_names'] = file_names
+    for file_name in file_names:
+        config.update(file_entries(manifest, file_name))
+    return config
+
+def import_config(config, manifest):
+    '''     Function that writes a config (e.g. of a .pkl file) to the manifest: settings and entries of all files.     '''
+    write_settings(config, manifest)
+    for file_name in config.get('input_file_names', []):
+        if file_entry(manifest, file_name) is None: # files already in the manifest keep their completion
+            write_file(config, manifest, file_name)
+
+def merge_manifest(manifest, fn):
+    '''     Function that copies all files of the manifest fn (e.g. of a shard) into manifest, replacing their rows.     '''
+    manifest.execute('ATTACH DATABASE ? AS other', (fn,))
+    try:
+        with manifest:
+            for table in ['files'] + file_row_tables:
+                manifest.execute(f'DELETE FROM main.{table} WHERE file_name IN (SELECT file_name FROM other.files)')
+                manifest.execute(f'INSERT INTO main.{table} SELECT * FROM other.{table}')
+    finally:
+        manifest.execute('DETACH DATABASE other')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import a batch .pkl into its manifest, or export a manifest to a .pkl.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help='write the batch .pkl to <batch_name>.manifest.sqlite next to it')
+    import_parser.add_argument('config_file', help='.pkl file of a batch')
+    export_parser = commands.add_parser('export', help='write the batch of a manifest to a .pkl file')
+    export_parser.add_argument('manifest_file', help='<batch_name>.manifest.sqlite')
+    export_parser.add_argument('config_file', help='.pkl file to write')
+    args = parser.parse_args()
+    if args.command == 'import':
+        with open(args.config_file, 'rb') as f:
+            config = pickle.load(f)
+        fn = os.path.join(os.path.dirname(os.path.abspath(args.config_file)), config['batch_name'] + '.manifest.sqlite')
+        manifest = open_manifest(fn)
+        import_config(config, manifest)
+        manifest.close()
+        print('Manifest written: ' + fn)
+    else:
+        manifest = open_manifest(args.manifest_file)
+        config = export_config(manifest)
+        manifest.close()
+        with open(args.config_file, 'wb') as f:
+            pickle.dump(config, f)
+        print('Config written: ' + args.config_file)
@@ -0,0 +1,90 @@
+"""
+Memory budget of the EEG preprocessing pipeline.
+
+The signals (Raw objects and other large arrays) alive while a file is processed are tracked by
+name with their size. With a budget (config['memory_budget'] in bytes, 0: no budget), a new signal
+that does not fit is refused with a MemoryError before it is created, unless an idle signal can be
+spilled to a memory-mapped file in config['memory_spill_directory'] first.
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import contextlib
+import os
+
+import mne
+import numpy as np
+
+
+def raw_nbytes(raw):
+    '''     Function that returns the size of the data of a (preloaded, float64) raw EEG object.     '''
+    return len(raw.ch_names) * raw.n_times * np.dtype(np.float64).itemsize
+
+def megabytes(nbytes):
+    '''     Function that formats a number of bytes in MB for messages.     '''
+    return str(round(nbytes / 1024**2)) + ' MB'
+
+def create_memory_tracker(config, hooks):
+    '''     Function that returns the memory tracker (dict) of one file.     '''
+    return {
+        'budget': config.get('memory_budget', 0),
+        'spill_directory': config.get('memory_spill_directory', '').strip(),
+        'file_name': config['file_name'],
+        'live': {}, # tracked size per name
+        'peak': 0,
+        'spill_files': [],
+        'log': hooks['log'],
+        }
+
+def tracked_bytes(memory):
+    '''     Function that returns the total size of the tracked signals.     '''
+    return sum(memory['live'].values())
+
+def track(memory, name, nbytes):
+    '''     Function that adds (or updates) a signal of nbytes to the tracker.     '''
+    memory['live'][name] = nbytes
+    memory['peak'] = max(memory['peak'], tracked_bytes(memory))
+
+def release(memory, name):
+    '''     Function that removes a signal from the tracker (the caller deletes its last reference).     '''
+    memory['live'].pop(name, None)
+
+def fits(memory, nbytes):
+    '''     Function that checks if nbytes more fit in the budget (always without budget).     '''
+    return memory['budget'] <= 0 or tracked_bytes(memory) + nbytes <= memory['budget']
+
+def require(memory, name, nbytes):
+    '''     Function that refuses (MemoryError) to create signal name of nbytes if it does not fit in the budget.     '''
+    if not fits(memory, nbytes):
+        in_use = ', '.join(n + ' ' + megabytes(b) for n, b in memory['live'].items())
+        raise MemoryError(f"Memory budget of {megabytes(memory['budget'])} exceeded for {memory['file_name']}: "
+                          f"{name} needs {megabytes(nbytes)}, in use: {in_use}. "
+                          "Increase memory_budget or set memory_spill_directory.")
+
+def spill_raw(memory, name, raw):
+    '''
+    Function that moves the data of raw to a memory-mapped file in the spill directory and returns
+    the raw object on that file, which no longer counts for the budget. Returns raw unchanged
+    without spill directory.
+    '''
+    if not memory['spill_directory']:
+        return raw
+    os.makedirs(memory['spill_directory'], exist_ok=True)
+    fn = os.path.join(memory['spill_directory'],
+                      memory['file_name'] + '.' + name + '.' + str(os.getpid()) + '.spill.npy')
+    data = np.lib.format.open_memmap(fn, mode='w+', dtype=np.float64, shape=(len(raw.ch_names), raw.n_times))
+    for start in range(0, len(raw.ch_names), 8): # a few channels at a time
+        data[start:start + 8] = raw.get_data(picks=range(start, min(start + 8, len(raw.ch_names))))
+    raw_spilled = mne.io.RawArray(data, raw.info, first_samp=raw.first_samp, verbose=False)
+    raw_spilled.set_annotations(raw.annotations)
+    memory['spill_files'].append(fn)
+    release(memory, name)
+    memory['log'](name + " (" + megabytes(raw_nbytes(raw)) + ") spilled to " + fn, 'run')
+    return raw_spilled
+
+def remove_spill_files(memory):
+    '''     Function that removes the spill files of the file (when no longer in use).     '''
+    for fn in memory['spill_files']:
+        with contextlib.suppress(OSError): # still mapped (Windows), left in the spill directory
+            os.remove(fn)
+    memory['spill_files'] = []
@@ -0,0 +1,164 @@
+"""
+Per-stage metrics of the EEG preprocessing pipeline.
+
+Every stage of process_file (loading, filtering, bad channel review, ICA, resampling, epoching,
+exports, ...) is timed: wall time, CPU time of the process (all threads), time spent waiting on the
+operator (blocking plots and dialogs) and the peak resident memory during the stage. The peak is
+reset per stage on Linux; elsewhere it is the peak of the process so far (with psutil on Windows).
+
+The stages of a file are stored in config[file_name, 'metrics'] and written to
+<file>-metrics.json next to the batch .pkl; <batch_name>.metrics.csv holds the stages of all files.
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import csv
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+metrics_fields = ['file_name', 'stage', 'wall_seconds', 'cpu_seconds', 'operator_seconds', 'compute_seconds',
+                  'peak_rss_mb']
+
+def reset_peak_rss():
+    '''     Function that resets the peak resident memory of the process (Linux only).     '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_rss_mb():
+    '''     Function that returns the peak resident memory (MB) of the process, None if unknown.     '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import psutil
+        memory_info = psutil.Process().memory_info()
+        if hasattr(memory_info, 'peak_wset'): # Windows
+            return round(memory_info.peak_wset / 1024**2, 1)
+    except ImportError:
+        pass
+    try:
+        import resource
+    except ImportError: # Windows without psutil
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # kB, bytes on macOS
+    return round(peak / 1024**(2 if sys.platform == 'darwin' else 1), 1)
+
+def create_metrics(config):
+    '''     Function that starts the metrics of the current file, kept in config['metrics'] while processing it.     '''
+    config['metrics'] = {'file_name': config['file_name'], 'stages': [], 'current': None}
+    return config
+
+@contextmanager
+def stage(config, name):
+    '''
+    Context manager that records the metrics of a stage of the current file (nothing without
+    config['metrics']) and yields its record (None without metrics). Operator time is added by
+    operator_wait within the stage.
+    '''
+    metrics = config.get('metrics')
+    if metrics is None:
+        yield None
+        return
+    record = {'stage': name, 'operator_seconds': 0.0}
+    previous = metrics['current']
+    metrics['current'] = record
+    reset_peak_rss()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_seconds'] = round(time.perf_counter() - wall, 4)
+        record['cpu_seconds'] = round(time.process_time() - cpu, 4)
+        record['operator_seconds'] = round(record['operator_seconds'], 4)
+        record['compute_seconds'] = round(record['wall_seconds'] - record['operator_seconds'], 4)
+        record['peak_rss_mb'] = peak_rss_mb()
+        if not record.pop('discard', False):
+            metrics['stages'].append(record)
+        metrics['current'] = previous
+
+def staged_bands(config, name, bands):
+    '''
+    Generator that yields the items (l_freq, h_freq, ...) of bands and records producing each of them
+    as stage '<name> <l_freq>-<h_freq> Hz'. Only the work of the generator is timed, not the work of
+    the caller in between.
+    '''
+    iterator = iter(bands)
+    while True:
+        with stage(config, name) as record:
+            item = next(iterator, None)
+            if record is not None:
+                if item is None:
+                    record['discard'] = True
+                else:
+                    record['stage'] = f'{name} {item[0]}-{item[1]} Hz'
+        if item is None:
+            return
+        yield item
+
+@contextmanager
+def operator_wait(config):
+    '''     Context manager that adds its duration to the operator time of the current stage.     '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = config.get('metrics')
+        if metrics is not None and metrics['current'] is not None:
+            metrics['current']['operator_seconds'] += time.perf_counter() - start
+
+def file_metrics_path(config, file_name):
+    '''     Function that returns the path of the metrics file of a file, next to the batch .pkl.     '''
+    return os.path.join(config['batch_output_subdirectory'], file_name.replace(" ", "") + '-metrics.json')
+
+def finish_metrics(config):
+    '''
+    Function that moves the metrics of the current file to config[file_name, 'metrics'] and writes
+    its metrics file.
+    '''
+    metrics = config.pop('metrics')
+    file_name = metrics['file_name']
+    config[file_name, 'metrics'] = metrics['stages']
+    fn = file_metrics_path(config, file_name)
+    with open(fn, 'w', encoding='UTF-8') as f:
+        json.dump({'file_name': file_name, 'timing': config.get((file_name, 'timing')),
+                   'stages': metrics['stages']}, f, indent=1)
+    return fn
+
+def stage_totals(config):
+    '''     Function that returns the totals per stage (in order of first appearance) over all files of the batch.     '''
+    totals = {}
+    for file_name in config['input_file_names']:
+        for record in config.get((file_name, 'metrics'), []):
+            total = totals.setdefault(record['stage'], dict.fromkeys(metrics_fields[2:-1], 0.0))
+            for field in total:
+                total[field] += record[field]
+    return totals
+
+def write_batch_metrics(config):
+    '''
+    Function that writes the stages of all files to <batch_name>.metrics.csv and returns the file name
+    and a summary (totals per stage) for the log.
+    '''
+    fn = os.path.join(config['batch_output_subdirectory'], config['batch_name'] + '.metrics.csv')
+    with open(fn, 'w', encoding='UTF-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=metrics_fields)
+        writer.writeheader()
+        for file_name in config['input_file_names']:
+            for record in config.get((file_name, 'metrics'), []):
+                writer.writerow(dict(record, file_name=file_name))
+    lines = ['Time per stage, all files (wall / cpu / operator, s):']
+    for name, total in stage_totals(config).items():
+        lines.append(f"  {name}: {total['wall_seconds']:.2f} / {total['cpu_seconds']:.2f} / "
+                     f"{total['operator_seconds']:.2f}")
+    return fn, '\n'.join(lines)
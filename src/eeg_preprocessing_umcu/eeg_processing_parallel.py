@@ -0,0 +1,162 @@
+"""
+Parallel rerun of a batch: the files of a batch are independent once the bad channel and epoch
+selections are stored in the config, so they are dispatched to a pool of worker processes.
+Each worker runs eeg_processing_engine.process_file without interaction; the log messages of a
+file are written to the batch .log as soon as it is completed, the per-file config entries are
+merged into the batch .pkl afterwards, in the original file order. Each worker adds its completed files to the manifest of the batch (SQLite,
+concurrent writers), so an interrupted batch can be resumed.
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from eeg_processing_engine import (
+    headless_hooks,
+    log_batch_metrics,
+    merge_file_config,
+    print_dict,
+    process_file,
+    resume_log,
+    write_config_file,
+)
+from eeg_processing_logger import (
+    close_batch_log,
+    log_file_section,
+    log_message,
+    now,
+    open_batch_log,
+)
+from eeg_processing_manifest import (
+    file_complete,
+    load_manifest,
+    record_file,
+    write_file,
+    write_settings,
+)
+
+blas_thread_variables = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+def init_worker(blas_threads):
+    '''
+    Function that runs once in every worker process and limits the number of BLAS/OpenMP threads,
+    so that n workers do not each start a thread per core.
+    '''
+    for var in blas_thread_variables:
+        os.environ[var] = str(blas_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError: # environment variables only affect libraries loaded later on
+        return
+    threadpool_limits(limits=blas_threads)
+
+def process_file_worker(file_path, config):
+    '''
+    Function executed in a worker process: processes one file without interaction, adds it to the
+    manifest of the batch and returns the updated config, the log messages ((time, panel, message)
+    tuples) and the traceback (None if successful).
+    '''
+    messages = []
+    def log(msg, panel='run'):
+        messages.append((now(), panel, msg))
+    hooks = dict(headless_hooks(), log=log)
+    error = None
+    try:
+        config = process_file(file_path, config, hooks, interactive=False)
+        manifest = load_manifest(config) # every worker writes its own files
+        record_file(config, manifest, file_path)
+        manifest.close()
+    except Exception:
+        error = traceback.format_exc()
+        log(error, 'run')
+    return config, messages, error
+
+def run_batch_parallel(config, nr_workers=None, blas_threads=None, hooks=None):
+    '''
+    Function that processes all files in config['input_file_paths'] in a pool of nr_workers processes
+    (rerun only, no interaction), then writes the merged config (.pkl) of the batch. The log of each
+    file is written to the log file of the batch when the file is completed.
+    Processing continues when a file fails (also when its worker process dies, e.g. out of memory);
+    afterwards a RuntimeError lists the failed files.
+    Files completed earlier in this batch (resumed batch, see the manifest) are skipped.
+    '''
+    if hooks is None:
+        hooks = headless_hooks()
+    logger = open_batch_log(config)
+    def log_run(msg, panel='run'):
+        log_message(logger, msg, panel)
+        hooks['log'](msg, panel)
+    manifest = None
+    try: # the log (and manifest) are closed in any case, also when interrupted
+        resume_log(config, logger, log_run)
+        manifest = load_manifest(config)
+        write_settings(config, manifest) # the manifest is the checkpoint, the .pkl is written at the end
+        if nr_workers is None:
+            nr_workers = config.get('nr_workers', 1)
+        if blas_threads is None:
+            blas_threads = config.get('blas_threads_per_worker', 1)
+        file_paths = []
+        for file_path in config['input_file_paths']:
+            if file_complete(config, manifest, file_path):
+                log_run('File ' + file_path + ' already completed in this batch, skipped')
+            else:
+                file_paths.append(file_path)
+        nr_workers = max(1, min(nr_workers, len(file_paths)))
+
+        msg = 'Processing ' + str(len(file_paths)) + ' files with ' + str(nr_workers) + \
+            ' worker processes (' + str(blas_threads) + ' BLAS thread(s) each)'
+        log_run(msg, 'run')
+
+        results = [None] * len(file_paths)
+        # spawn: no forked copies of GUI/plotting state, same behaviour on all platforms
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=nr_workers, mp_context=context,
+                                 initializer=init_worker, initargs=(blas_threads,)) as executor:
+            futures = {executor.submit(process_file_worker, file_path, config): idx
+                       for idx, file_path in enumerate(file_paths)}
+            filenum = 0
+            for future in as_completed(futures):
+                idx = futures[future]
+                file_name = os.path.basename(file_paths[idx])
+                try:
+                    results[idx] = future.result()
+                except Exception: # the worker process died (BrokenProcessPool), the other files go on
+                    error = traceback.format_exc()
+                    results[idx] = (None, [(now(), 'run', error)], error)
+                    write_file(config, manifest, file_name) # in the manifest, not completed
+                filenum = filenum+1
+                hooks['progress']('files', filenum, len(file_paths)) # files
+                file_config, messages, error = results[idx]
+                status = 'failed' if error else 'done'
+                seconds = file_config.get((file_name, 'timing'), {}).get('seconds') if file_config else None
+                log_file_section(logger, file_name, messages, status, seconds)
+                msg = 'File ' + file_paths[idx] + ' ' + status + ' (' + str(filenum) + '/' + str(len(file_paths)) + ')'
+                hooks['log'](msg, 'file')
+
+        # merge results in the original order of the files
+        failed = []
+        for file_path, (file_config, _, error) in zip(file_paths, results, strict=True):
+            if file_config is not None:
+                config = merge_file_config(config, file_config, file_config['file_name'])
+            if error:
+                failed.append(file_path)
+
+        log_batch_metrics(config, log_run)
+        fn = write_config_file(config)
+        msg = 'Config created for this batch (to be used for rerun) : '+fn
+        log_run(msg, 'file')
+        msg = 'Log file created: ' + config['logfile']
+        log_run(msg, 'file')
+    finally:
+        if manifest is not None:
+            manifest.close()
+        fn = close_batch_log(logger) # flushed
+
+    if failed:
+        print_dict(config)
+        raise RuntimeError('Processing failed for ' + str(len(failed)) + ' file(s): ' + ', '.join(failed) + \
+                           '\nSee ' + fn + ' for the tracebacks.')
+    return config
@@ -0,0 +1,124 @@
+"""
+Prefetching of the next recording(s) of a batch.
+
+While a file is processed (and the operator reviews its bad channels, ICA components and epochs),
+the next config['prefetch_files'] files are loaded, their channels dropped and the temporary
+signal band-pass filtered on a background thread, so the next file starts at its review instead
+of at loading. Prefetching starts once the channels to be dropped are known (after the first file
+of a new batch). The signals of a prefetched file are not counted in a memory budget, so there is
+no prefetching with a budget (config['memory_budget']).
+
+Warnings and messages of the background loading are shown when the file is processed.
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from eeg_processing_filters import broadband_filter, filter_raw
+from eeg_processing_io import create_raw
+
+
+def create_prefetcher(config, file_paths, montage, no_montage_files):
+    '''
+    Function that returns the prefetcher (dict) for the files to be processed (in order), None if
+    prefetching is off (prefetch_files 0, or a memory budget).
+    '''
+    depth = config.get('prefetch_files', 0)
+    if depth <= 0 or config.get('memory_budget', 0):
+        return None
+    return {
+        'executor': ThreadPoolExecutor(max_workers=1, thread_name_prefix='eeg-prefetch'),
+        'depth': depth, # recordings loaded ahead at most
+        'file_paths': deque(file_paths), # not yet prefetched
+        'pending': {}, # file path: future
+        'montage': montage,
+        'no_montage_files': no_montage_files,
+        }
+
+def prefetch_recording(config, montage, no_montage_files):
+    '''
+    Function that runs on the background thread: loads the file of config['file_path'] (a copy of
+    the batch config), drops the channels and filters a copy as the temporary signal. Warnings and
+    messages are kept to be shown later.
+    '''
+    messages = []
+    hooks = {
+        'log': lambda msg, panel='run': messages.append(('log', msg, panel)),
+        'warn': lambda msg: messages.append(('warn', msg)),
+        'select_channels_to_be_dropped': None,
+        }
+    start = time.perf_counter()
+    raw, config = create_raw(config, montage, no_montage_files, hooks, exclude=config.get('channels_to_be_dropped', []))
+    raw.drop_channels(config['channels_to_be_dropped'], on_missing='ignore')
+    load_seconds = time.perf_counter() - start
+    # the same filter (and filter cache for the output signal) as process_file
+    filter_cache = {} if (config['apply_ica'] or config['apply_beamformer']) else None
+    raw_temp = filter_raw(raw.copy(), **broadband_filter, filter_cache=filter_cache, hooks=hooks)
+    return {
+        'raw': raw,
+        'raw_temp': raw_temp,
+        'filter_cache': filter_cache,
+        'messages': messages,
+        'sample_frequency': config['sample_frequency'],
+        'channel_names': config['channel_names'],
+        'load_seconds': load_seconds,
+        'filter_seconds': time.perf_counter() - start - load_seconds,
+        }
+
+def schedule_prefetch(prefetcher, config):
+    '''
+    Function that starts prefetching the next files (up to the depth of the prefetcher), once the
+    channels to be dropped are known.
+    '''
+    if prefetcher is None:
+        return
+    if config['rerun'] == 0 and config['channels_to_be_dropped_selected'] == 0:
+        return
+    while len(prefetcher['pending']) < prefetcher['depth'] and prefetcher['file_paths']:
+        file_path = prefetcher['file_paths'].popleft()
+        prefetcher['pending'][file_path] = prefetcher['executor'].submit(
+            prefetch_recording, dict(config, file_path=file_path), prefetcher['montage'],
+            prefetcher['no_montage_files'])
+
+def take_prefetched(prefetcher, file_path, hooks):
+    '''
+    Function that returns the prefetched recording of file_path (waits until it is loaded), None
+    if it was not prefetched or prefetching failed (the file is then loaded as usual).
+    '''
+    if prefetcher is None:
+        return None
+    future = prefetcher['pending'].pop(file_path, None)
+    if future is None:
+        if file_path in prefetcher['file_paths']:
+            prefetcher['file_paths'].remove(file_path)
+        return None
+    try:
+        return future.result()
+    except Exception as e:
+        hooks['log']('Prefetching ' + file_path + ' failed (' + repr(e) + '), loading it again', 'run')
+        return None
+
+def use_prefetched(prefetched, config, hooks):
+    '''
+    Function that shows the warnings and messages of a prefetched recording, updates the batch
+    entries set by loading it and returns its signals: raw, filtered raw_temp and filter cache.
+    '''
+    for kind, *args in prefetched['messages']:
+        hooks[kind](*args)
+    config['sample_frequency'] = prefetched['sample_frequency']
+    config['channel_names'] = prefetched['channel_names']
+    msg = 'Recording loaded (' + str(round(prefetched['load_seconds'], 1)) + ' s) and filtered (' + \
+        str(round(prefetched['filter_seconds'], 1)) + ' s) in the background'
+    hooks['log'](msg, 'run')
+    return prefetched['raw'], prefetched['raw_temp'], prefetched['filter_cache']
+
+def close_prefetcher(prefetcher):
+    '''     Function that stops prefetching, recordings that were not used are discarded.     '''
+    if prefetcher is None:
+        return
+    prefetcher['file_paths'].clear()
+    prefetcher['executor'].shutdown(wait=True, cancel_futures=True)
+    prefetcher['pending'].clear()
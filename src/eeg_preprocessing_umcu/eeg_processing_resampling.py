@@ -0,0 +1,71 @@
+"""
+Resampling of the EEG preprocessing pipeline.
+
+The resampling plan of a file decides once which signal is resampled, to which sample frequency,
+with which method and where:
+    'temp':   the temporary signal, to 512 or 500 Hz for recordings above 1000 Hz, after ICA and the
+              spatial filter are fitted (at the original sample frequency), before epoch selection
+    'output': the output signal, to sample_frequency // downsample_factor, directly after the
+              broadband filter. ICA, interpolation of bad channels, average reference and the spatial
+              filter combine channels sample by sample, so they give the same result on the
+              downsampled signal with less work.
+With config['resample_method'] 'auto', integer ratios use polyphase resampling (FIR filter over a
+short neighbourhood) instead of FFT resampling of the whole recording; 'fft' always resamples with
+the FFT (the method of batches created before the resampling plan). Every signal is resampled at
+most once: a second resampling of the same signal raises a RuntimeError.
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+def temporary_sample_frequency(sfreq):
+    '''     Function that returns the sample frequency of the temporary signal: 512 or 500 Hz (power of 2 or not).     '''
+    return 512 if sfreq % 512 == 0 else 500
+
+def resample_method(config, sfreq, new_sfreq):
+    '''     Function that returns the resampling method from sfreq to new_sfreq ('polyphase' or 'fft').     '''
+    method = config.get('resample_method', 'fft') # rerun of old batches: as they were processed
+    if method == 'auto':
+        method = 'polyphase' if sfreq % new_sfreq == 0 else 'fft'
+    if method not in ('polyphase', 'fft'):
+        raise ValueError(f"Unknown resample_method {method!r}, choose from 'auto', 'polyphase', 'fft'")
+    return method
+
+def resampling_plan(config):
+    '''
+    Function that returns the resampling plan of the current file: per signal ('temp', 'output') the
+    step {'sfreq', 'new_sfreq', 'method'}, None if that signal is not resampled.
+    '''
+    sfreq = config['sample_frequency']
+    plan = {'temp': None, 'output': None}
+    if sfreq > 1000:
+        new_sfreq = temporary_sample_frequency(sfreq)
+        plan['temp'] = {'sfreq': sfreq, 'new_sfreq': new_sfreq, 'method': resample_method(config, sfreq, new_sfreq)}
+    if config['downsample_factor'] != 1:
+        new_sfreq = sfreq // config['downsample_factor']
+        plan['output'] = {'sfreq': sfreq, 'new_sfreq': new_sfreq, 'method': resample_method(config, sfreq, new_sfreq)}
+    return plan
+
+def describe_plan(plan):
+    '''     Function that describes the resampling plan for the log.     '''
+    names = {'temp': 'temporary signal', 'output': 'output signal'}
+    steps = [names[name] + ' ' + str(step['sfreq']) + ' -> ' + str(step['new_sfreq']) + ' Hz (' + step['method'] + ')'
+             for name, step in plan.items() if step is not None]
+    return 'Resampling plan: ' + (', '.join(steps) if steps else 'no resampling')
+
+def resample_raw(raw, step):
+    '''
+    Function that resamples raw in place according to a step of the resampling plan and records it in
+    raw.info['temp'] (copied along with the signal). A signal is resampled at most once.
+    '''
+    if not isinstance(raw.info.get('temp'), dict):
+        raw.info['temp'] = {}
+    if 'resampled' in raw.info['temp']:
+        done = raw.info['temp']['resampled']
+        raise RuntimeError(f"Signal already resampled from {done['sfreq']} to {done['new_sfreq']} Hz, "
+                           f"resampling to {step['new_sfreq']} Hz again is not planned")
+    if step['method'] == 'polyphase':
+        raw.resample(step['new_sfreq'], method='polyphase')
+    else:
+        raw.resample(step['new_sfreq'], npad="auto", method='fft')
+    raw.info['temp']['resampled'] = dict(step)
+    return raw
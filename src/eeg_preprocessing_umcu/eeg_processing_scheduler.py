@@ -0,0 +1,160 @@
+"""
+Background stages of a batch, so computation overlaps the interactive review.
+
+As soon as the inputs of an expensive stage are known it is started on a background thread:
+  - the forward solution of the beamformer, when the bad channels of a file are selected (it only
+    depends on the remaining channels): computed during the ICA fit and review;
+  - the output of a file (filtering, resampling, ICA, interpolation, referencing, beamforming,
+    epoching and export, see eeg_processing_engine.export_file), when its review is complete:
+    produced while the next file is loaded and reviewed.
+At most one output is pending: the review of the next file is not completed before the output of
+the previous file is done. Two recordings are then in memory, the one being reviewed and the one
+being exported, plus the recordings loaded ahead when prefetching (eeg_processing_prefetch). The
+memory tracker of a file (eeg_processing_memory) only counts the signals of that file, so there
+are no background stages with a memory budget (config['memory_budget']); they are off by default
+(config['background_stages']). The outputs are added to the batch (config, manifest, log) in file
+order. With background stages the CPU time and peak memory of a stage (eeg_processing_metrics)
+include the stages running at the same time.
+
+A background stage gets its own deep copy of the config, without the entries of the other files
+(see file_snapshot), so the main thread can go on with the next file. When the output of a file
+is done, the completion callback of the scheduler (on_output) is called on the background thread,
+e.g. to record the file as completed in the manifest: a file is only recorded when its own output
+is complete, and the output of the next file is not started after an output failed.
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import copy
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import mne
+from eeg_processing_beamformer import get_forward_solution
+from eeg_processing_logger import now
+
+max_pending_outputs = 1
+
+def create_scheduler(config, on_output=None):
+    '''
+    Function that returns the scheduler (dict) of a batch, None if there are no background stages.
+    on_output(file_path, file_config) is called on the background thread when the output of a file
+    is done.
+    '''
+    if not config.get('background_stages', 0) or config.get('memory_budget', 0):
+        return None
+    return {
+        'executor': ThreadPoolExecutor(max_workers=2, thread_name_prefix='eeg-background'),
+        'forward': None, # (future, messages) of the forward solution being computed
+        'outputs': deque(), # (file path, future, file config, messages) in file order
+        'on_output': on_output,
+        }
+
+def file_snapshot(config, file_name):
+    '''
+    Function that returns a deep copy of the config for a background stage of file_name: the batch
+    entries and the entries of this file, not those of the other files.
+    '''
+    other_files = set(config.get('input_file_names', [])) - {file_name}
+    return copy.deepcopy({key: value for key, value in config.items()
+                          if not (isinstance(key, tuple) and len(key) == 2 and key[0] in other_files)})
+
+def buffered_hooks(hooks, messages):
+    '''
+    Function that returns the hooks for a background stage: log messages are kept in messages, as
+    (time, panel, message) tuples, to be shown in order later; progress is passed on.
+    '''
+    return dict(hooks, log=lambda msg, panel='run': messages.append((now(), panel, msg)))
+
+def schedule_forward(scheduler, info, config):
+    '''
+    Function that starts computing the forward solution for the channels of info without its bad
+    channels (as the beamformer will use them), to be taken from the cache by the beamformer.
+    '''
+    if scheduler is None:
+        return
+    picks = mne.pick_channels(info['ch_names'], include=[], exclude=info['bads'])
+    messages = []
+    future = scheduler['executor'].submit(get_forward_solution, mne.pick_info(info, picks),
+                                          file_snapshot(config, config['file_name']), buffered_hooks({}, messages))
+    scheduler['forward'] = (future, messages)
+
+def wait_for_forward(scheduler, hooks):
+    '''
+    Function that waits for the forward solution started by schedule_forward (if any) and shows its
+    messages. If it failed the beamformer computes it again, the error is only logged.
+    '''
+    if scheduler is None or scheduler['forward'] is None:
+        return
+    future, messages = scheduler['forward']
+    scheduler['forward'] = None
+    try:
+        future.result()
+    except Exception as e:
+        messages.append((now(), 'run', 'Forward solution in the background failed (' + repr(e) + '), computed again'))
+    for _, panel, msg in messages:
+        hooks['log'](msg, panel)
+
+def run_output(scheduler, file_path, export, args, file_config, hooks):
+    '''
+    Function that runs on the background thread: produces the output of the file and calls the
+    completion callback of the scheduler.
+    '''
+    file_config = export(*args, file_config, hooks)
+    if scheduler['on_output'] is not None:
+        scheduler['on_output'](file_path, file_config)
+    return file_config
+
+def schedule_output(scheduler, file_path, export, config, hooks, *args):
+    '''
+    Function that starts export(*args, config, hooks) for the file on the background thread, with
+    its own copy of the config (file_snapshot). Waits first if the output of the previous file is
+    still pending; raises a RuntimeError if the output of a previous file failed.
+    '''
+    running = [future for _, future, _, _ in scheduler['outputs'] if not future.done()]
+    while len(running) >= max_pending_outputs:
+        wait(running, return_when=FIRST_COMPLETED)
+        running = [future for future in running if not future.done()]
+    for path, future, _, _ in scheduler['outputs']:
+        if future.done() and future.exception() is not None:
+            raise RuntimeError('Output of ' + path + ' in the background failed, ' + file_path + ' not started')
+    given = file_snapshot(config, config['file_name'])
+    messages = []
+    future = scheduler['executor'].submit(run_output, scheduler, file_path, export, args, dict(given),
+                                          buffered_hooks(hooks, messages))
+    scheduler['outputs'].append((file_path, future, given, messages))
+
+def output_pending(scheduler, file_path):
+    '''     Function that returns whether the output of file_path is produced in the background.     '''
+    return scheduler is not None and any(path == file_path for path, _, _, _ in scheduler['outputs'])
+
+def completed_outputs(scheduler, wait_all=False):
+    '''
+    Generator that yields the outputs produced in the background, in file order, that are done (all
+    of them with wait_all): file path, the entries set by the output (to merge into the batch config
+    without reverting batch entries updated since by the main thread), log messages ((time, panel,
+    message) tuples) and the traceback (None if successful).
+    '''
+    if scheduler is None:
+        return
+    while scheduler['outputs']:
+        file_path, future, given, messages = scheduler['outputs'][0]
+        if not wait_all and not future.done():
+            return
+        updates, error = {}, None
+        try:
+            file_config = future.result()
+            updates = {key: value for key, value in file_config.items() if key not in given or given[key] is not value}
+        except Exception:
+            error = traceback.format_exc()
+        scheduler['outputs'].popleft()
+        yield file_path, updates, messages, error
+
+def close_scheduler(scheduler):
+    '''     Function that waits for the background stages that are running and stops the scheduler.     '''
+    if scheduler is None:
+        return
+    scheduler['executor'].shutdown(wait=True, cancel_futures=True)
+    scheduler['forward'] = None
+    scheduler['outputs'].clear()
@@ -5,34 +5,30 @@
 PySimpleGUI_License = "e1yWJaMdasWkN4l4b7nYNllfVqHolVwwZUS5IA6pIekqRAp7cf3FRNyZakWgJy1ldnGXlZv7bhi9Ihs0Ifkvxbp2YA2KVOuKct2IVPJHRsC1IZ6tMETZcDyzOjDDQI2KMEzVIM3WMoSXw2izTBGmlgjvZrWx5GzDZHUvR0lZcOGCxBvSeXWR1OlFbsnKRlWGZkXNJYzXaLWC9TuQIljdo8iaNpSW4GwlIiiBwZi0TOmBFwtvZnUCZrpQc3ntNF0IIcj3ozi6W3Wj9QycYnmfV7u4ImirwWiLTimEFutRZ8Ujxih2c238QuirOCi9JAMabp29R9lzbBWSE9i2LWCrJkDfbX2A1vwVYAWY5y50IEjGojizI4itwdikQk3XVdzJdnGF94tYZjXDJnJhRpCNIr6RIijsQVxDNgjmYQyvIki5wWitRgGVFK0BZqUol9z8cU3cVIlyZaCkIY6uITj1IcwxMcjgQytEMtTZAztcMnD3k0ieLgCGJwEBYvXXRlldRuXLhgwwavX0J8lycMydIL6QI5j7IVwwMCjZYotyMgTmA6tQMmDUkZivLzCZJLFEbZWOFGp1biEHFjkAZ5HMJAlIcP3RMtinOoiaJJ5gbP3JJRimZIWn50sZbd2CRjlxbfWUFyAhcRHHJNv7d4Gf94uFLgmg1TlPIpilwAihS8VkBBBnZ8GER2yKZeX9NmzdIwjqociiMqTDQjz6LYj8Eky4MqSc4gydM5zvkfueMQTlEuiOf9Qt=e=R474cb6624d46e0ffc4738da48ec40ec6c752493664e4752ff53db807cace7e4621380eceb4d5de156b785a4403be2968b7a6a22be5c76e8b9cda0494edde848854d6e93a408dc85a76a78ee44989fdb316aafe12f99184914c3eec2accd1689a7983cb8f627bbf1c1ce62f546cc997b117824f4bed3d811de3d6eefd462b467e4bf7bd325190f51155d825c4ba5f300245d7b67550db63b79c8ffc6a34adf6fda39fcd06e2ab1406812358a35ac9f95eca70f2369b30c64b8b61a8e5ae61aa337084058d6616a62e06a4d4a75f10498e2d8a535e4f9dcc1ab389b8bb1a1528df10f2e8b9137f1d9b337c4dca8e20eec88414377e4e374e231b63e0eeae6d2490a0960db48c15809ff54ae57ae06fb1e9679b64dbba7458a9ae271203fa38d2582b5492c92269e8af8ec7cd3e88b50fbaa8a616fa3091ce0a1b5a90abe67666dc7c30d83f4c175d759481f7bda16854a7c1c52148763b845bba4303a8ea97104cdc0258b227c08f59d18db8b753b21f5caa0a47c28958d09ed5cd65c86741a5424a118cb0336ee21aa8e7caa2dc99a093c8d4ec1f77ebf0edebc4b4a59b2014bd44597b3a46b97b3471f8ef2314fe0cc2786e03a1c1881fe3a9c5fdf5b993cde580024846d9921808d77889b25eeea64761c94b44582e0b630a8b888e6d51574b89e1f4fa872f61d1a4842e09ea9db5cd5ae5ed40fc2a96e59b5c62c72d9734b0"
 
 import os
+import sys
+import threading
+import time
+from collections import deque
 
 import PySimpleGUI as sg
-import pandas as pd
-import mne
-import numpy as np
-import pickle
-import posixpath
-from pathlib import Path
-import traceback
 import webbrowser as wb
-from mne.preprocessing import ICA
-from datetime import datetime
-from mne.beamformer import apply_lcmv_raw, make_lcmv
-from mne.datasets import fetch_fsaverage
 
 from eeg_processing_settings import *
+from eeg_processing_settings import (gui_log_lines, gui_log_refresh, gui_theme, logo_file, matplotlib_backend,
+                                    mne_browser_backend, tooltip_font)
+from eeg_processing_engine import load_config, print_dict, resume_batch, run_interaction, set_batch_names
+from eeg_processing_thread import (PostedStream, batch_done_event, handle_hook_event, hook_event, log_event,
+                                   start_batch_thread)
 
 #settings={} # suppress warnings
 
-# Set the working directory to the script directory
+# Files of the GUI (logo) are found relative to the script directory, the working directory is not changed
 script_dir = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_dir)
 font=font # taken from settings
 f_font=f_font  # font filter frequency inputs taken from settings
 f_size=f_size # font size filter frequency inputs taken from settings
 settings=settings # taken from settings
 filter_settings=filter_settings
-my_image=my_image # taken from settings
 
 EEG_version = "v4.0"
 
@@ -49,53 +45,45 @@ button_style = {
     'mouseover_colors': ('#FFFFFF', '#1976D2'),  # Slightly darker blue on hover
 }
 
-layout = [
-    [sg.Column([
-        [sg.Text('',font=('Default', 3), background_color="#E6F3FF")], 
-        [sg.Button('Choose settings for this batch', **button_style), 
-         sg.Button('Rerun previous batch', **button_style), sg.Button('Start processing', **button_style)],
-        [sg.Text('',font=('Default', 3), background_color="#E6F3FF")], 
-        [sg.Text('File info', font=('Default', 14, 'bold'), background_color="#E6F3FF")],
-        [sg.Multiline('', autoscroll=True, size=(120, 10), k='-FILE_INFO-', reroute_stdout=True)],
-        [sg.Text('Run info', font=('Default', 14, 'bold'), background_color="#E6F3FF")],
-        [sg.Multiline('', autoscroll=True, size=(120, 10), k='-RUN_INFO-', reroute_stdout=True)],
-        [sg.ProgressBar(progress_value1, orientation='h', size=(110, 10), 
-                       key='progressbar_files', bar_color=['red', 'lightgrey'])],
-        [sg.ProgressBar(progress_value2, orientation='h', size=(110, 10), 
-                       key='progressbar_epochs', bar_color=['#003DA6', 'lightgrey'])],
-        [sg.Text('',font=('Default', 3), background_color="#E6F3FF")], 
-        [sg.Button('Exit', button_color=exit_button_color, 
-                   border_width=0, pad=(10, 5), mouseover_colors=('#FFFFFF', 'firebrick'))],
-        [sg.Text('Yorben Lodema \nHerman van Dellen',font=('Default', 12), background_color="#E6F3FF")], 
-        [sg.VPush(background_color="#E6F3FF")],  # Added background color
-        [sg.Push(background_color="#E6F3FF"), sg.Column([[my_image]], pad=(0,0), background_color="#E6F3FF")]  # Added background color
-    ], expand_y=True, background_color="#E6F3FF")]  # Added background color to main Column
-]
-
-def print_dict(dict):# pprint and json.print do not work well with composite keys!
-    '''     Function to print dictionary.     '''
-    for key in dict.keys():
-        print(key, ":", dict[key])  
-
-def write_config_file(config):
-    '''     Function to write config file in .pkl format.     '''
-    fn = config['config_file']
-    config.pop('raw', None) # remove from dict if exists
-    config.pop('raw_temp', None) # remove from dict if exists
-    config.pop('raw_temp_filtered', None) # remove from dict if exists
-    config.pop('raw_interpolated', None) # remove from dict if exists
-    config.pop('raw_ica', None) # remove from dict if exists
-    config.pop('ica', None)  # remove from dict if exists
-    config.pop('file_path', None)  # remove from dict, this is the current file_path in loop
-    with open(fn, 'wb') as f:
-        pickle.dump(config, f)
-    return fn
-
-def load_config(fn):
-    '''     Function to read config file in .pkl format.     '''
-    with open(fn, 'rb') as f:
-        config = pickle.load(f)
-    return config
+def init_gui():
+    '''
+    Function to set the plotting backends (for this session, the MNE config file of the user is not
+    changed) and the look of the GUI. Only called when the GUI is launched, not on import.
+    '''
+    import matplotlib
+    import mne
+    matplotlib.use(matplotlib_backend)
+    mne.viz.set_browser_backend(mne_browser_backend)
+    sg.theme(gui_theme)
+    sg.set_options(tooltip_font=(tooltip_font))
+
+def create_layout():
+    '''     Function to create the layout of the main window.     '''
+    my_image = sg.Image(os.path.join(script_dir, logo_file), subsample=2, pad=(0,0), background_color="#E6F3FF")  # UMC logo
+    layout = [
+        [sg.Column([
+            [sg.Text('',font=('Default', 3), background_color="#E6F3FF")], 
+            [sg.Button('Choose settings for this batch', **button_style), 
+             sg.Button('Rerun previous batch', **button_style), sg.Button('Resume interrupted batch', **button_style),
+             sg.Button('Start processing', **button_style)],
+            [sg.Text('',font=('Default', 3), background_color="#E6F3FF")], 
+            [sg.Text('File info', font=('Default', 14, 'bold'), background_color="#E6F3FF")],
+            [sg.Multiline('', autoscroll=True, size=(120, 10), k='-FILE_INFO-', disabled=True)],
+            [sg.Text('Run info', font=('Default', 14, 'bold'), background_color="#E6F3FF")],
+            [sg.Multiline('', autoscroll=True, size=(120, 10), k='-RUN_INFO-', disabled=True)],
+            [sg.ProgressBar(progress_value1, orientation='h', size=(110, 10), 
+                           key='progressbar_files', bar_color=['red', 'lightgrey'])],
+            [sg.ProgressBar(progress_value2, orientation='h', size=(110, 10), 
+                           key='progressbar_epochs', bar_color=['#003DA6', 'lightgrey'])],
+            [sg.Text('',font=('Default', 3), background_color="#E6F3FF")], 
+            [sg.Button('Exit', button_color=exit_button_color, 
+                       border_width=0, pad=(10, 5), mouseover_colors=('#FFFFFF', 'firebrick'))],
+            [sg.Text('Yorben Lodema \nHerman van Dellen',font=('Default', 12), background_color="#E6F3FF")], 
+            [sg.VPush(background_color="#E6F3FF")],  # Added background color
+            [sg.Push(background_color="#E6F3FF"), sg.Column([[my_image]], pad=(0,0), background_color="#E6F3FF")]  # Added background color
+        ], expand_y=True, background_color="#E6F3FF")]  # Added background color to main Column
+    ]
+    return layout
 
 def select_input_file_paths(config, settings):
     '''     Function to select input files.     '''
@@ -122,7 +110,23 @@ def load_config_file():
     config=load_config(config_file)
     config['previous_run_config_file']=config_file
     msg = '\nConfig ' + config_file + ' loaded for rerun\n'
-    window['-FILE_INFO-'].update(msg+'\n', append=True)
+    gui_log(msg, 'file')
+    return config
+
+def load_interrupted_batch():
+    '''
+    Function to select the .manifest.sqlite (or .pkl) of an interrupted batch and load it to be resumed
+    in its own output directory. Returns None if no file is selected.
+    '''
+    txt = 'Select the .manifest.sqlite file of the interrupted batch'
+    config_file = sg.popup_get_file(txt, file_types=(('Batch files', '*.pkl *.sqlite'),), no_window=False,
+                                    background_color='white', font=font, location=(100, 100))
+    if not config_file:
+        sg.popup_error("No file selected", "Ok")
+        return None
+    config = resume_batch(config_file)
+    msg = '\nBatch ' + config['batch_name'] + ' loaded to resume in ' + config['batch_output_subdirectory'] + '\n'
+    gui_log(msg, 'file')
     return config
 
 def ask_apply_output_filtering(config):
@@ -527,8 +531,6 @@ def set_batch_related_names(config):
     entire batch.
     '''
     # batch_prefix batch_name batch_output_subdirectory config_file logfile
-    today = datetime.today()
-    dt = today.strftime('%Y%m%d_%H%M%S')  # suffix
     if config['rerun']==0:
         tooltip = 'Enter a prefix (e.g. study name) for this batch. The log file will be named <prefix><timestamp>.log'
         txt="Enter a name for this file batch (e.g. study1_batch1).\nThis name should not contain spaces."
@@ -560,37 +562,7 @@ def set_batch_related_names(config):
         window.close()
         
     # else use config['batch_prefix'] from previous run  
-    config['batch_name'] = config['batch_prefix'] + '_' + dt
-    config['batch_output_subdirectory'] = os.path.join(config['output_directory'], config['batch_name'])    
-    # create if not existing
-    if not os.path.exists(config['batch_output_subdirectory']):
-       os.makedirs(config['batch_output_subdirectory']) 
-    
-    fn = config['batch_name'] + '.log'
-    config['logfile'] = os.path.join(config['batch_output_subdirectory'], fn)
-    fn = config['batch_name'] + '.pkl'
-    config['config_file'] = os.path.join(config['batch_output_subdirectory'], fn)
-    return config
-
-def set_file_output_related_names(config):
-    # Scope:in file loop
-    '''
-    Function that performs the actions necessary to define all file/folder/path names
-    associated with the current EEG FILE that is being processed. These names change
-    for each file in the batch.
-    '''
-    # strip file_name for use as sub dir
-    fn = config['file_name'].replace(" ", "")
-    fn = fn.replace(".", "")
-    # Split the file path and extension to use when constructing the output file names
-    root, ext = os.path.splitext(config['file_path'])
-    config['file_output_subdirectory'] = posixpath.join(config['batch_output_subdirectory'], fn ) # this is the sub-dir for output (epoch) files, remove spaces
-    if not os.path.exists(config['file_output_subdirectory']):
-       os.makedirs(config['file_output_subdirectory'])  
-    file_name_sensor = os.path.basename(root) + "_Sensor_level"
-    config['file_path_sensor'] = os.path.join(config['file_output_subdirectory'], file_name_sensor)
-    file_name_source = os.path.basename(root) + "_Source_level"
-    config['file_path_source'] = os.path.join(config['file_output_subdirectory'], file_name_source)
+    config = set_batch_names(config)
     return config
 
 def create_dict():
@@ -602,760 +574,186 @@ def create_dict():
         sg.popup_error('Error create_dict: ', location=(100, 100),font=font)
         window.close()
         
-def create_spatial_filter(raw_b,config):
-    '''
-    Function used to create a spatial filter for the LCMV beamforming method. 
-    The MNE function make_lcmv is used.
-    '''
-    fs_dir = fetch_fsaverage(verbose=True)
-    subject = "fsaverage"
-    trans = "fsaverage"
-    # Loading boundary-element model
-    bem = os.path.join(fs_dir, "bem", "fsaverage-5120-5120-5120-bem-sol.fif")
-    # Setting up source space according to Desikan-Killiany atlas
-    DesikanVox = pd.read_excel('DesikanVox.xlsx', header=None)
-    Voxels_pos = DesikanVox.values
-    Voxels_pos = Voxels_pos.astype(float)
-    Voxels_nn = -Voxels_pos
-    # Normalize the normals to unit length
-    Voxels_nn /= np.linalg.norm(Voxels_nn, axis=1)[:, np.newaxis]
-    Voxels_pos_dict = {'rr':Voxels_pos, 'nn':Voxels_nn}
-    src = mne.setup_volume_source_space(
-        subject=subject,
-        pos=Voxels_pos_dict,
-        mri=None,
-        bem=bem,
-    )
-
-    # Forward Solution
-    fwd = mne.make_forward_solution(
-        raw_b.info,
-        trans=trans,
-        src=src,
-        bem=bem,
-        eeg=True,
-        mindist=0,
-        n_jobs=None
-    )
-
-    # Inverse Problem
-    data_cov = mne.compute_raw_covariance(raw_b)
-
-    # Create a new matrix noise_matrix (noise cov. matrix) with the same size as data_cov
-    noise_matrix = np.zeros_like(data_cov['data'])
-    diagonal_values = np.diag(data_cov['data'])
-    # Set the diagonal values of noise_matrix to the diagonal values of data_cov
-    np.fill_diagonal(noise_matrix, diagonal_values)
-    noise_cov = mne.Covariance(data=noise_matrix,
-                               names=data_cov['names'],
-                               bads=data_cov['bads'],
-                               projs=data_cov['projs'],
-                               nfree=data_cov['nfree']
-                               )
-    # LCMV beamformer
-    spatial_filter = make_lcmv(raw_b.info,
-                               fwd,
-                               data_cov,
-                               reg=0.05,
-                               noise_cov=noise_cov,
-                               pick_ori='max-power',
-                               weight_norm='unit-noise-gain',
-                               rank=None,
-                               )
-    return spatial_filter
-
-def create_raw(config, montage, no_montage_files):
-    '''
-    Function used to load a raw EEG file using the correct MNE function based on the file type.
-    Now handles .txt files both with and without headers by detecting if the first row contains numeric data.
-    If no header is present, it generates channel names automatically (CH1, CH2, etc.).
-    '''
-    if config['file_pattern'] == "*.txt":
-        with open(file_path) as file:
-            first_line = file.readline().strip()
-            
-        # Try to convert first line values to float to check if they're numeric
-        try:
-            _ = [float(x) for x in first_line.split('\t')]
-            has_header = False
-        except ValueError:
-            has_header = True
-            
-        if has_header:
-            df = pd.read_csv(file_path, sep='\t', index_col=False, header=0)
-            if config['channel_names'] == []:
-                ch_names = list(df.columns)
-                config['channel_names'] = ch_names
-        else:
-            df = pd.read_csv(file_path, sep='\t', index_col=False, header=None)
-            if config['channel_names'] == [] and settings['montage', config['input_file_pattern']] == "biosemi64":
-                ch_names = [
-                'Fp1', 'AF7', 'AF3', 'F1', 'F3', 'F5', 'F7', 'FT7',
-                'FC5', 'FC3', 'FC1', 'C1', 'C3', 'C5', 'T7', 'TP7',
-                'CP5', 'CP3', 'CP1', 'P1', 'P3', 'P5', 'P7', 'P9',
-                'PO7', 'PO3', 'O1', 'Iz', 'Oz', 'POz', 'Pz', 'CPz',
-                'Fpz', 'Fp2', 'AF8', 'AF4', 'AFz', 'Fz', 'F2', 'F4',
-                'F6', 'F8', 'FT8', 'FC6', 'FC4', 'FC2', 'FCz', 'Cz',
-                'C2', 'C4', 'C6', 'T8', 'TP8', 'CP6', 'CP4', 'CP2',
-                'P2', 'P4', 'P6', 'P8', 'P10', 'PO8', 'PO4', 'O2'
-                ]
-                # Check if number of channels matches BioSemi64
-                if len(ch_names) != df.shape[1]:
-                    sg.popup_ok(f'Warning: File has {df.shape[1]} channels but BioSemi64 requires 64 channels.\n'
-                              'Using generic channel names instead.',
-                              location=(100, 100))
-                    ch_names = [f'CH{i+1}' for i in range(df.shape[1])]
-                config['channel_names'] = ch_names
-            else:
-                ch_names = [f'CH{i+1}' for i in range(df.shape[1])]
-                config['channel_names'] = ch_names
-                
-        ch_types = ["eeg"] * len(ch_names)
-        info = mne.create_info(
-            ch_names=ch_names, 
-            sfreq=config['sample_frequency'], 
-            ch_types=ch_types
-        )
-        
-        # Ensure we're only taking the data columns
-        df = df.iloc[:, 0:len(ch_names)]
-        
-        try:
-            df = df.astype(float)
-        except ValueError as e:
-            raise ValueError(f"Non-numeric values found in the data. Please check your file format. Error: {e}")
-            
-        samples = df.T * 1e-6  # Scaling from µV to V
-        raw = mne.io.RawArray(samples, info)
-        
-        # Check for missing values
-        missing_channels = []
-        for col in df.columns:
-            if df[col].isna().any():
-                missing_channels.append(str(col))
-                
-        if missing_channels:
-            missing_str = ', '.join(missing_channels)
-            sg.popup_ok(f'Warning: channels with missing values found:\n{missing_str}\n'
-                       'Please drop these channel(s)!',
-                       location=(100, 100))
-            
-        
-    elif config['file_pattern'] == "*.bdf":
-        raw = mne.io.read_raw_bdf(file_path, preload=True)
-    elif config['file_pattern'] == "*.vhdr":
-        raw = mne.io.read_raw_brainvision(file_path, preload=True)
-    elif config['file_pattern'] == "*.edf":
-        raw = mne.io.read_raw_edf(file_path, preload=True)
-    elif config['file_pattern'] == "*.fif":
-        raw = mne.io.read_raw_fif(file_path, preload=True)
-        raw.pick_types(eeg=True, meg=False, eog=False)
-    
-    if config['file_pattern'] not in no_montage_files:
-        raw.set_montage(montage=montage, on_missing='ignore')
-    config['sample_frequency'] = raw.info["sfreq"]
-    return raw, config
-
-def update_channels_to_be_dropped (raw,config):
-    '''     Function to ask channels_to_be_dropped     '''
-    channel_names = raw.ch_names
-    channels_to_be_dropped = select_channels_to_be_dropped(channel_names)  # ask user to select
-    config['channels_to_be_dropped'] = channels_to_be_dropped # store for rerun function
-    return raw,config
-
-def perform_ica(raw, raw_temp, config):
-    '''     
-    Function to perform ICA on data with bad channels marked but not dropped.
-    '''
-    msg = 'Max # components = ' + str(config['max_channels'])
-    window['-RUN_INFO-'].update(msg+'\n', append=True)
-
-    # Preparation of clean raw object to calculate ICA on
-    raw_ica = raw.copy()
-    raw_ica.filter(l_freq=1, h_freq=47, l_trans_bandwidth=0.5, h_trans_bandwidth=1.5)
-
-    # Mark bad channels but don't drop them yet
-    raw_ica.info['bads'] = config[file_name, 'bad']
-    
-    # Fit ICA excluding bad channels but without dropping them
-    ica = ICA(n_components=config['nr_ica_components'],
-              method='fastica')
-    # Ignores bad channels during fitting
-    ica.fit(raw_ica, picks='eeg')
-
-    ica.plot_components()  # head plot heat map
-    ica.plot_sources(raw_ica, block=True)
-
-    # Calculate and display explained variance
-    pca_explained_variances = ica.pca_explained_variance_ / ica.pca_explained_variance_.sum()
-    ica_explained_variances = pca_explained_variances[:ica.n_components_]
-    cumul_pct = 0.0
-
-    for idx, var in enumerate(ica_explained_variances):
-        pct = round(100 * var, 2)
-        cumul_pct += pct
-        msg = f'Explained variance for ICA component {idx}: {pct}% ({round(cumul_pct, 1)}%)'
-        window['-RUN_INFO-'].update(msg+'\n', append=True)
-
-    # Apply ICA to the temporary raw object
-    raw_temp.info['bads'] = config[file_name, 'bad']
-    ica.apply(raw_temp)
-    
-    return raw_temp, ica, config
-
-def perform_bad_channels_selection(raw,config):
-    '''
-    Function that applies MNE plotting to interactively select bad channels and save these to the config. 
-    These channels can later be interpolated or dropped depending on the needs.
-    '''
-    msg = "Select bad channels by left-clicking channels"
-    window['-RUN_INFO-'].update(msg+'\n', append=True)
-    raw.plot(n_channels=len(
-        raw.ch_names), block=True, title="Bandpass filtered data")
-
-    config[file_name, 'bad'] = raw.info['bads']  # *1 ### Aparte bad_channels variable is nu weg
-    return raw,config
-
-def plot_power_spectrum(raw, filtered=False):
-    '''
-    Function that plots the power spectrum of the separate EEG channels
-    of either the unfiltered or filtered EEG (from 0-60 Hz).
-    '''
-    fig = raw.compute_psd(fmax=60).plot(
-        picks='eeg', exclude=[])
-    axes = fig.get_axes()
-    if filtered:
-        axes[0].set_title("Band 0.5-47 Hz filtered power spectrum.")
-    else:
-        axes[0].set_title("Unfiltered power spectrum")
-    fig.tight_layout(rect=[0, 0, 1, 0.95])
-    fig.canvas.draw()   
-    
-def perform_temp_down_sampling(raw,config):
-    '''
-    Function that down samples the temporary raw EEG to 500 or 512 Hz depending on the sample frequency
-    (power of 2 or not). This should speed up preprocessing.
-    '''
-    temporary_sample_f = 512 if config['sample_frequency'] % 512 == 0 else 500
-    print("temp. sample fr:", temporary_sample_f)
-    raw.resample(temporary_sample_f, method='fft')
-    return raw, temporary_sample_f
-
-def perform_average_reference(raw):
-    '''
-    Function that applies a global average reference on the 'eeg' type channels 
-    of the raw EEG.
-    '''
-    raw.set_eeg_reference('average', projection=True, ch_type='eeg')
-    raw.apply_proj()
-    return raw
-
-def perform_beamform(raw,config):
-    '''
-    Function that drops bad channels and creates the spatial filter 
-    used for LCMV beamforming.
-    '''
-    raw.drop_channels(config[file_name, 'bad'])
-    msg = "channels left in raw_beamform:" + str(len(raw.ch_names))
-    window['-RUN_INFO-'].update(msg+'\n', append=True)
-    raw = perform_average_reference(raw)
-    spatial_filter = create_spatial_filter(raw,config)
-    return spatial_filter
-
-def perform_epoch_selection(raw,config,sfreq):
-    '''
-    Function that performs epoch selection on the raw file. 
-    This function is for use on the temporary raw object.
-    '''    
-    events = mne.make_fixed_length_events(raw, duration=(config['epoch_length']))
-    epochs = mne.Epochs(raw, events=events, tmin=0, tmax=(
-        config['epoch_length']-(1/sfreq)), 
-            baseline=(0, config['epoch_length']-(1/sfreq)), preload=True)
-    
-    # Generate events at each second as seconds markers for the epochs plot
-    time_event_ids = np.arange(config['epoch_length']*len(events))
-    time_event_samples = (sfreq * time_event_ids).astype(int)
-    time_events = np.column_stack(
-        (time_event_samples, np.zeros_like(time_event_samples), time_event_ids))
-
-    # Plot the epochs for visual inspection
-    msg = "Select bad epochs by left-clicking data"
-    window['-RUN_INFO-'].update(msg+'\n', append=True)
-    epochs.plot(n_epochs=1, n_channels=len(
-        raw.ch_names), events=time_events, event_color= 'm',block=True, picks=['eeg', 'eog', 'ecg'])
-
-    config[file_name, 'epochs'] = epochs.selection
-    return config
- 
-def apply_epoch_selection(raw_output,config,sfreq,filtering=False,l_freq=None,h_freq=None):
-    '''
-    Function that applies the epoch selection made earlier (either in a previous run
-    or during current pre processing) to the raw EEG used for saving output to file.
-    Filtering is optionally applied before applying the epoch selection.
-    ''' 
-    
-    if filtering:
-        raw_output = filter_output_raw(raw_output,config,l_freq,h_freq)
-    
-    events_out = mne.make_fixed_length_events(raw_output, duration=config['epoch_length'])
-    epochs_out = mne.Epochs(raw_output, events=events_out, tmin=0, tmax=(config['epoch_length'] - \
-        (1 / sfreq)), baseline=(0, config['epoch_length']))
-    selected_epochs_out = epochs_out[config[file_name, 'epochs']]
-    selected_epochs_out.drop_bad()
-    return selected_epochs_out
-
-def filter_output_raw(raw_output,config,l_freq,h_freq):
-    '''
-    Applys a FIR bandpass filter to the raw EEG object. If either ICA or Beamforming is also applied,
-    bandpass filtering at 0.5-47 Hz (or broader frequencies) is not performed a second time. The transition
-    band is calculated in a separate function.
-    '''
-    l_freq = float(l_freq)
-    h_freq = float(h_freq)
-    l_trans = calc_filt_transition(l_freq)
-    h_trans = calc_filt_transition(h_freq)
-    if (config['apply_beamformer'] or config['apply_ica']) and (l_freq <= 0.5):
-        l_freq = None
-        print("No additional (<) 0.5 Hz high pass filter applied, already broadband filtered before beamformer and/or ICA")
-    
-    if (config['apply_beamformer'] or config['apply_ica']) and (h_freq >= 47):
-        h_freq = None
-        print("No additional (>) 47 Hz low pass filter applied, already broadband filtered before beamformer and/or ICA")
-    
-    if l_freq or h_freq:
-        raw_output= raw_output.copy().filter(l_freq=l_freq, h_freq=h_freq,
-            picks='eeg',l_trans_bandwidth=l_trans, h_trans_bandwidth=h_trans)
-    return raw_output
+##################################################################################
 
-def apply_bad_channels(raw,config):
-    '''
-    Function that applies bad channels (either from previous run or current pre processing)
-    to raw EEG object used to export the final output.
-    '''
-    raw.info['bads'] = config[file_name, 'bad']
-    raw.interpolate_bads(reset_bads=True)
-    msg = "Interpolated " + str(len(config[file_name, 'bad'])) + \
-        " channels on (non-beamformed) output signal"
-    window['-RUN_INFO-'].update(msg+'\n', append=True)
-    return raw
-    
-def apply_spatial_filter(raw, config, spatial_filter):
+def create_main_window():
     '''
-    Function that applies the spatial filter created earlier to the final 
-    raw EEG object used to export the final output.
+    Function to create the main window, its progress bars and the line buffers of the run and file
+    info widgets. Printed output is posted to the run info widget as events (thread safe).
     '''
-    desikanlabels = pd.read_csv('DesikanVoxLabels.csv', header=None)
-    desikan_channel_names = desikanlabels[0].tolist()
-    stc = apply_lcmv_raw(raw, spatial_filter)
-    info = mne.create_info(
-        ch_names = desikan_channel_names, sfreq = config['sample_frequency'], ch_types='eeg')
-    raw_source = mne.io.RawArray(stc.data, info)
-    raw_source.resample(config['sample_frequency']//config['downsample_factor'], npad="auto")
-    msg = "Beamformed output signal downsampled to " + \
-          str(config['sample_frequency']//config['downsample_factor']) + " Hz"
-    window['-RUN_INFO-'].update(msg+'\n', append=True)
-    return raw_source
-
-def save_epoch_data_to_txt(epoch_data, base, scalings=None,filtering=False,l_freq=0.0,h_freq=1000.0):
-    '''     Function to save an MNE epoch object to txt files.      '''
-    l_freq=float(l_freq)
-    h_freq=float(h_freq)
-    for i in range(len(epoch_data)):
-        epoch_df = epoch_data[i].to_data_frame(picks='eeg', scalings=scalings)
-        epoch_df = epoch_df.drop(columns=['time', 'condition', 'epoch'])
-        epoch_df = np.round(epoch_df, decimals=settings['output_txt_decimals'])
-        
-        if (config['apply_beamformer'] or config['apply_ica']) and l_freq <= 0.5:
-            l_freq = 0.5 # Since both beamformer and ICA already bandpass filter from 0.5 to 47 Hz
-            
-        if (config['apply_beamformer'] or config['apply_ica']) and h_freq >= 47.0:
-            h_freq = 47 # Since both beamformer and ICA already bandpass filter from 0.5 to 47 Hz
-        
-        if filtering or config['apply_beamformer'] or config['apply_ica']:
-            file_name_out = base + "_" + str(l_freq) + "-" + str(h_freq) + " Hz_Epoch_"  + str(i + 1) + ".txt"
-        else:
-            file_name_out = base + "_Epoch_" + str(i + 1) + ".txt"
-        
-        epoch_df.to_csv(file_name_out, sep='\t', index=False)
-        msg = 'Output file ' + file_name_out + ' created'
-        window['-FILE_INFO-'].update(msg+'\n', append=True)
-        progress_bar_epochs.UpdateBar(i+1)
-        
-def calc_filt_transition(cutoff_freq):
+    global window, progress_bars, log_lines, log_changed
+    window = sg.Window('MNE-python based EEG Preprocessing', create_layout(), location=(
+        30, 30), size=(1000, 775), background_color="#E6F3FF", finalize=True, font=font)
+
+    progress_bar_files = window.find_element('progressbar_files')
+    progress_bar_epochs = window.find_element('progressbar_epochs')
+    progress_bars = {'files': progress_bar_files, 'epochs': progress_bar_epochs}
+    # only the last gui_log_lines lines are shown, the complete log is in the .log file of the batch
+    log_lines = {'run': deque(maxlen=gui_log_lines), 'file': deque(maxlen=gui_log_lines)}
+    log_changed = set()
+    sys.stdout = PostedStream(window.write_event_value)
+    return window
+
+def gui_log(msg, panel='run'):
     '''
-    Function that returns the FIR filter transition bandwidth based on the cutoff
-    frequency. Below 5 Hz, this is 0.4 (minimum), while above 15 Hz this is 1.5 Hz
-    (maximum). Below 0.4 Hz, the cutoff frequency is used as transition bandwidth.
+    Function to add a message of the processing engine to the run or file info widget. The widget
+    is updated by refresh_log_widgets, not per message.
     '''
-    base_transition = min(max(cutoff_freq * 0.1, 0.4), 1.5)
-    return float(min(base_transition, cutoff_freq))
-
-def save_whole_EEG_to_txt(raw_output,config,base,scalings=None,filtering=False,l_freq=0.0,h_freq=1000.0):
-    ''' Function to slightly process the raw EEG object and export it to one continuous .txt file. '''
-    l_freq=float(l_freq)
-    h_freq=float(h_freq)
-    
-    raw_df = raw_output.to_data_frame(picks='eeg', scalings=scalings)
-    raw_df = raw_df.iloc[:, 1:]
-    raw_df = np.round(raw_df, decimals=config['output_txt_decimals'])
-    
-    if (config['apply_beamformer'] or config['apply_ica']) and l_freq <= 0.5:
-        l_freq = 0.5 # Since both beamformer and ICA already bandpass filter from 0.5 to 45 Hz
-        
-    if (config['apply_beamformer'] or config['apply_ica']) and h_freq >= 47.0:
-        h_freq = 47 # Since both beamformer and ICA already bandpass filter from 0.5 to 45 Hz
-    
-    if filtering or config['apply_beamformer'] or config['apply_ica']:
-        file_name_out = base + "_" + str(l_freq) + "-" + str(h_freq) + "_" + "Hz.txt"
-    else:
-        file_name_out = base + ".txt"
-    
-    raw_df.to_csv(file_name_out, sep='\t', index=False)
-
-
-##################################################################################
-
-window = sg.Window('MNE-python based EEG Preprocessing', layout, location=(
-    30, 30), size=(1000, 775), background_color="#E6F3FF", finalize=True, font=font)
+    panel = 'file' if panel == 'file' else 'run'
+    log_lines[panel].extend(str(msg).split('\n'))
+    log_changed.add(panel)
+
+def refresh_log_widgets():
+    '''     Function to show the buffered lines in the run and file info widgets that changed.     '''
+    for panel in log_changed:
+        key = '-FILE_INFO-' if panel == 'file' else '-RUN_INFO-'
+        window[key].update('\n'.join(log_lines[panel]))
+    log_changed.clear()
+
+def gui_progress(bar, value, maximum=None):
+    '''     Function to update the files or epochs progress bar.     '''
+    progress_bars[bar].UpdateBar(value, maximum)
+
+def gui_warn(msg):
+    '''     Function to show a warning of the processing engine in a popup.     '''
+    sg.popup_ok('Warning: ' + msg, location=(100, 100))
+
+gui_hooks = {
+    'log': gui_log,
+    'progress': gui_progress,
+    'warn': gui_warn,
+    'select_channels_to_be_dropped': select_channels_to_be_dropped,
+    'interact': run_interaction, # called on the GUI thread (plots of the worker thread)
+}
 
-progress_bar_files = window.find_element('progressbar_files')
-progress_bar_epochs = window.find_element('progressbar_epochs')
+batch_buttons = ('Choose settings for this batch', 'Rerun previous batch', 'Resume interrupted batch', 'Start processing')
+
+def set_batch_buttons(disabled):
+    '''     Function to disable the buttons that change or start a batch while a batch is processed.     '''
+    for key in batch_buttons:
+        window[key].update(disabled=disabled)
+
+
+def main():
+    '''     Function to launch the GUI and handle its events until it is closed.     '''
+    init_gui()
+    create_main_window()
+    batch_thread = None # processing runs on this thread, its callbacks arrive as events
+    stop_batch = threading.Event() # set: the batch ends after the current file
+    exit_when_done = False
+    last_refresh = 0
+    while True:# @noloop remove
+        # https://trinket.io/pygame/36bf0df5f3, https://github.com/PySimpleGUI/PySimpleGUI/issues/2805
+        event, values = window.read(timeout=gui_log_refresh)
+        if time.monotonic() - last_refresh >= gui_log_refresh / 1000:
+            refresh_log_widgets()
+            last_refresh = time.monotonic()
+        if event == sg.WIN_CLOSED:
+            break
+        if event == "Exit":
+            if batch_thread is None:
+                break
+            if not exit_when_done:
+                if sg.popup_yes_no('Processing is running, stop after the current file and exit?',
+                                   location=(100, 100), font=font) == 'Yes':
+                    # the batch ends after the current file (its output, log and .pkl are written), then exit
+                    stop_batch.set()
+                    exit_when_done = True
+                    gui_log('Stopping after the current file, the remaining files can be processed later '
+                            'with Resume interrupted batch', 'run')
+            elif sg.popup_yes_no('Exit now without waiting for the current file? It is processed again '
+                                 'with Resume interrupted batch.', location=(100, 100), font=font) == 'Yes':
+                break
+            continue
 
+        if event == hook_event:
+            handle_hook_event(gui_hooks, values[event])
+        elif event == log_event:
+            gui_log(*values[event])
+        elif event == batch_done_event:
+            batch_thread = None
+            set_batch_buttons(False)
+            result, error = values[event]
+            refresh_log_widgets()
+            if error is None:
+                config = result
+                msg = 'Processing complete \n'
+                gui_log(msg, 'run')
+            else: # config and log file (with traceback) are written by run_batch
+                sg.popup_error_with_traceback(
+                    'Error - info: ', error)
+            if exit_when_done:
+                break
 
-while True:# @noloop remove
-    # https://trinket.io/pygame/36bf0df5f3, https://github.com/PySimpleGUI/PySimpleGUI/issues/2805
-    event, values = window.read()
-    if event == "Exit" or event == sg.WIN_CLOSED:
-        break
-    
-    rerun_no_previous_epoch_selection = 0
-    
-    
-    # note:dependencies on config['rerun'] are always handled in the ask_ or select_ functions
-    if event == "Rerun previous batch" :
-        config = load_config_file() # .pkl file
-        config['rerun']=1
-        config = select_input_file_paths(config, settings) # read from pkl
-        config = set_batch_related_names(config) # batch_prefix batch_name batch_output_subdirectory config_file logfile
-        config = select_output_directory(config)
-        config = ask_epoch_selection(config) # function will check if epoch_selection has already been made, if not then it will ask
-        config = ask_average_ref(config)
-        config = ask_downsample_factor(config,settings)
-        config = ask_apply_output_filtering(config)
-        config = ask_ica_option(config)
-        config = ask_beamformer_option(config)
-        msg = 'Loaded config: '
-        window['-RUN_INFO-'].update(msg+'\n', append=True)
-        print_dict(config)
-        msg = 'You may now start processing'
-        window['-RUN_INFO-'].update(msg+'\n', append=True)
+        # note:dependencies on config['rerun'] are always handled in the ask_ or select_ functions
+        if event == "Rerun previous batch" :
+            config = load_config_file() # .pkl file
+            config['rerun']=1
+            config = select_input_file_paths(config, settings) # read from pkl
+            config = set_batch_related_names(config) # batch_prefix batch_name batch_output_subdirectory config_file logfile
+            config = select_output_directory(config)
+            config = ask_epoch_selection(config) # function will check if epoch_selection has already been made, if not then it will ask
+            config = ask_average_ref(config)
+            config = ask_downsample_factor(config,settings)
+            config = ask_apply_output_filtering(config)
+            config = ask_ica_option(config)
+            config = ask_beamformer_option(config)
+            msg = 'Loaded config: '
+            gui_log(msg, 'run')
+            print_dict(config)
+            msg = 'You may now start processing'
+            gui_log(msg, 'run')
         
-    elif event == 'Choose settings for this batch':
-        print('Choose settings for this batch')
-        config = create_dict()  # before file loop
-        config['rerun'] = 0
-        config = select_input_file_paths(config, settings) # gui file explorer
-        config = select_output_directory(config) # gui file explorer
-        config = set_batch_related_names(config) # batch_prefix batch_name batch_output_subdirectory config_file logfile
-        config = ask_average_ref(config)
-        config = ask_epoch_selection(config)
-        config = ask_apply_output_filtering(config)
-        config = ask_ica_option(config)
-        config = ask_beamformer_option(config)  # before file loop
-        # list of patterns read from eeg_processing_config_XX
-        config = ask_input_file_pattern(config, settings)
+        elif event == 'Resume interrupted batch':
+            resumed = load_interrupted_batch()
+            if resumed is not None:
+                config = resumed
+                msg = 'Completed files are skipped, the other files are processed (new batch: with review)'
+                gui_log(msg, 'run')
+                msg = 'You may now start processing'
+                gui_log(msg, 'run')
+
+        elif event == 'Choose settings for this batch':
+            print('Choose settings for this batch')
+            config = create_dict()  # before file loop
+            config['rerun'] = 0
+            config = select_input_file_paths(config, settings) # gui file explorer
+            config = select_output_directory(config) # gui file explorer
+            config = set_batch_related_names(config) # batch_prefix batch_name batch_output_subdirectory config_file logfile
+            config = ask_average_ref(config)
+            config = ask_epoch_selection(config)
+            config = ask_apply_output_filtering(config)
+            config = ask_ica_option(config)
+            config = ask_beamformer_option(config)  # before file loop
+            # list of patterns read from eeg_processing_config_XX
+            config = ask_input_file_pattern(config, settings)
         
-        # sample frequency of bdf, eeg and edf are available in raw
-        if (config['input_file_pattern'].find('.txt') >= 0):
-            config = ask_sample_frequency(
-                config,settings)  # ask sample frequency
-            sample_frequency = config['sample_frequency']  # check
+            # sample frequency of bdf, eeg and edf are available in raw
+            if (config['input_file_pattern'].find('.txt') >= 0):
+                config = ask_sample_frequency(
+                    config,settings)  # ask sample frequency
 
-        config = ask_downsample_factor(config,settings)
+            config = ask_downsample_factor(config,settings)
         
-        msg = 'Created config: '
-        window['-RUN_INFO-'].update(msg+'\n', append=True)
-        print_dict(config)
-        msg = 'You may now start processing'
-        window['-RUN_INFO-'].update(msg+'\n', append=True)
+            msg = 'Created config: '
+            gui_log(msg, 'run')
+            print_dict(config)
+            msg = 'You may now start processing'
+            gui_log(msg, 'run')
 
 
-    elif event == 'Start processing':
-        try:
+        elif event == 'Start processing':
             # reset progress bars
-            progress_bar_files.UpdateBar(0,0)
-            progress_bar_epochs.UpdateBar(0,0)
-            no_montage_patterns = ["*.vhdr", "*.fif"]
-            config['file_pattern'] = settings['input_file_pattern', config['input_file_pattern']]
-            
-            if config['file_pattern'] not in no_montage_patterns:
-                montage = mne.channels.make_standard_montage(settings['montage', config['input_file_pattern']])
-            else:
-                montage = "NA"
-                        
-            # Adjust the file extension as needed to recognize the correct file type
-            if config['file_pattern'] != "*.vhdr" and config['file_pattern'] != "*.fif":
-                montage = mne.channels.make_standard_montage(settings['montage',config['input_file_pattern']])
-            else:
-                montage = "NA"
-
-            # progess bar vars
-            lfl = len(config['input_file_paths'])
-            filenum = 0
-
-            for file_path in config['input_file_paths']:# @noloop do not execute
-                config['file_path'] = file_path # to be used by functions, this is the current file_path
-                f = Path(file_path)
-                file_name = f.name
-                input_dir = str(f.parents[0]) # to prevent error print config json
-                config['input_directory'] = input_dir # save, scope=batch
-                config['file_name'] = file_name
-                config=set_file_output_related_names(config) # set output directory for epochs etc. 
-                # add file name to list in config file, to be used in rerun                
-                config['input_file_names'].append(file_name) # add file name to config file, to be used in rerun
-                msg = '\n*** Processing file ' + file_path + ' ***'
-                window['-RUN_INFO-'].update(msg+'\n', append=True)
-                window['-FILE_INFO-'].update(msg+'\n', append=True)
-                           
-                raw, config = create_raw(config, montage, no_montage_patterns)   
-                
-                if config['rerun'] == 0 and config['channels_to_be_dropped_selected'] == 0:
-                    raw, config = update_channels_to_be_dropped(raw, config)
-                    config['channels_to_be_dropped_selected'] = 1
-                
-                # Only drop non-EEG channels, not bad channels
-                raw.drop_channels(config['channels_to_be_dropped'])
-                
-                # Temporary raw file to work with during preprocessing
-                raw_temp = raw.copy()
-
-                plot_power_spectrum(raw_temp, filtered=False)
-
-                raw_temp.filter(l_freq=0.5, h_freq=47, l_trans_bandwidth=0.4,
-                                h_trans_bandwidth=1.5, picks='eeg')
-                
-                # Mark bad channels (but don't interpolate yet)
-                if config['rerun'] == 1:
-                    raw_temp.info['bads'] = config[file_name, 'bad']
-                    
-                raw_temp, config = perform_bad_channels_selection(raw_temp, config)
-                
-                # Calculate max channels before any interpolation
-                config['max_channels'] = len(raw.ch_names) - len(config[file_name, 'bad'])
-                
-                # Apply ICA before interpolation if requested
-                if config['apply_ica']:
-                    raw_temp, ica, config = perform_ica(raw, raw_temp, config)
-                
-                # Interpolate bad channels after ICA
-                raw_temp.interpolate_bads(reset_bads=True)
-                
-                if config['apply_beamformer']:
-                    spatial_filter = perform_beamform(raw_temp,config)
-                
-                if config['sample_frequency'] > 1000:
-                    raw_temp,temporary_sample_f = perform_temp_down_sampling(raw_temp,config)
-                else:
-                    temporary_sample_f = config['sample_frequency']
-                    
-                raw_temp = perform_average_reference(raw_temp)
-                                
-                if config['apply_epoch_selection']:
-                    plot_power_spectrum(raw_temp, filtered=True)
-
-                if config['apply_epoch_selection'] and config['rerun'] == 0:
-                    config = perform_epoch_selection(raw_temp,config,temporary_sample_f)
-                elif config['apply_epoch_selection'] and rerun_no_previous_epoch_selection == 1:
-                    config = perform_epoch_selection(raw_temp,config,temporary_sample_f)
-
-
-                # ********** Preparation of the final raw file and epochs for export **********                
-                if config['apply_ica'] or config['apply_beamformer']:
-                    raw.filter(l_freq=0.5, h_freq=47, l_trans_bandwidth=0.4,
-                               h_trans_bandwidth=1.5, picks='eeg')
-                    msg = "Output signal filtered to 0.5-47 Hz (transition bands 0.4 Hz and 1.5 Hz resp. \
-                        Necessary for ICA and/or Beamforming"
-                    window['-RUN_INFO-'].update(msg+'\n', append=True)
-
-                # Mark bad channels but don't interpolate yet
-                raw.info['bads'] = config[file_name, 'bad']
+            progress_bars['files'].UpdateBar(0,0)
+            progress_bars['epochs'].UpdateBar(0,0)
+            set_batch_buttons(True)
+            stop_batch.clear()
+            batch_thread = start_batch_thread(config, gui_hooks, window.write_event_value, interactive=True,
+                                              stop=stop_batch)
 
-                # Apply ICA before interpolation if requested
-                if config['apply_ica']:
-                    ica.apply(raw)  # ICA will automatically exclude bad channels
-                    msg = "ICA applied to output signal"
-                    window['-RUN_INFO-'].update(msg+'\n', append=True)
-                                
-                # Now interpolate bad channels after ICA
-                raw.interpolate_bads(reset_bads=True)
-                msg = f"Interpolated {len(config[file_name, 'bad'])} channels on output signal"
-                window['-RUN_INFO-'].update(msg+'\n', append=True)
-
-                if config['apply_average_ref']:
-                    raw = perform_average_reference(raw)
-                    msg = "Average reference set on output signal"
-                else:
-                    msg = "No rereferencing applied"
-                window['-RUN_INFO-'].update(msg+'\n', append=True)
-                    
-                if config['apply_beamformer']:
-                    raw_beamform_output = raw.copy()
-                    raw_beamform_output = perform_average_reference(raw_beamform_output)
-                    msg = "Average reference applied for beamforming"
-                    window['-RUN_INFO-'].update(msg+'\n', append=True)
-                    
-                    raw_beamform_output.drop_channels(config[file_name, 'bad'])
-                    msg = "Dropped " + str(len(config[file_name, 'bad'])) + \
-                        " bad channels on beamformed output signal"
-                    window['-RUN_INFO-'].update(msg+'\n', append=True)
-                    msg = "The EEG file used for beamforming now contains " + \
-                        str(len(raw_beamform_output.ch_names)) + " channels"
-                    window['-RUN_INFO-'].update(msg+'\n', append=True)
-                    
-                    raw_source = apply_spatial_filter(raw_beamform_output, config, spatial_filter)
-
-                config['downsampled_sample_frequency'] = config['sample_frequency']//config['downsample_factor']
-                
-                if config['downsample_factor'] != 1:
-                    raw.resample(config['downsampled_sample_frequency'], npad="auto")
-                    if config['apply_beamformer']:
-                        raw_source.resample(config['downsampled_sample_frequency'], npad="auto")
-                    msg = "Output signal downsampled to " + \
-                        str(config['downsampled_sample_frequency']) + " Hz"
-                else:
-                    msg = "No downsampling applied to output signal"
-                window['-RUN_INFO-'].update(msg+'\n', append=True)
-
-                root, ext = os.path.splitext(file_path) ### Nog nodig?
-
-                # Create output epochs and export to .txt
-                if config['apply_epoch_selection']:
-                    selected_epochs_sensor = apply_epoch_selection(raw, config, config['downsampled_sample_frequency'])
-
-                    len2 = len(selected_epochs_sensor)
-                    progress_bar_epochs.UpdateBar(0, len2)
-
-                    save_epoch_data_to_txt(selected_epochs_sensor, config['file_path_sensor'])
-                    
-                    if config['apply_output_filtering']:
-                        
-                        frequency_band_pairs = list(zip(config['frequency_bands'][::2], config['frequency_bands'][1::2], strict=True))
-
-                        for low_band, high_band in frequency_band_pairs:
-                            selected_epochs_sensor_filt = apply_epoch_selection(
-                                raw,config,sfreq=config['downsampled_sample_frequency'],
-                                filtering=True,
-                                l_freq=config['cut_off_frequency', low_band],
-                                h_freq=config['cut_off_frequency', high_band]
-                            )
-                            
-                            save_epoch_data_to_txt(
-                                selected_epochs_sensor_filt, config['file_path_sensor'],
-                                filtering=True,
-                                l_freq=config['cut_off_frequency',low_band],
-                                h_freq=config['cut_off_frequency', high_band]
-                            )
-                            
-                    if config['apply_beamformer']:
-                        # Export beamformed epochs
-                        selected_epochs_source = apply_epoch_selection(raw_source, config, config['downsampled_sample_frequency'])
-                        save_epoch_data_to_txt(selected_epochs_source, config['file_path_source'],scalings=dict(
-                            eeg=10, mag=1e15, grad=1e13))
-                        
-                        if config['apply_output_filtering']:
-                            
-                            for low_band, high_band in frequency_band_pairs:
-                                selected_epochs_source_filt = apply_epoch_selection(
-                                    raw_source,config,sfreq=config['downsampled_sample_frequency'],
-                                    filtering=True,
-                                    l_freq=config['cut_off_frequency', low_band],
-                                    h_freq=config['cut_off_frequency', high_band]
-                                )
-                                
-                                save_epoch_data_to_txt(
-                                    selected_epochs_source_filt, config['file_path_source'],
-                                    scalings=dict(eeg=10, mag=1e15, grad=1e13),
-                                    filtering=True,
-                                    l_freq=config['cut_off_frequency',low_band],
-                                    h_freq=config['cut_off_frequency', high_band]
-                                )
-
-                else: # equals no epoch_output
-                    msg = "No epoch selection performed"
-                    window['-RUN_INFO-'].update(msg+'\n', append=True)
-                    
-                    save_whole_EEG_to_txt(raw,config,config['file_path_sensor'])
-                    progress_bar_epochs.UpdateBar(1, 1)
-                    
-                    if config['apply_output_filtering']:
-                        frequency_band_pairs = list(zip(config['frequency_bands'][::2], config['frequency_bands'][1::2], strict=True))
-                        
-                        for low_band, high_band in frequency_band_pairs:
-                            raw_filt = filter_output_raw(raw,config,
-                                l_freq=config['cut_off_frequency', low_band],h_freq=config['cut_off_frequency', high_band])
-                            save_whole_EEG_to_txt(
-                                raw_filt,config,config['file_path_sensor'],
-                                filtering=True,
-                                l_freq=config['cut_off_frequency', low_band],
-                                h_freq=config['cut_off_frequency', high_band]
-                            )
-                            
-                    if config['apply_beamformer']:
-                        save_whole_EEG_to_txt(raw_source,config,config['file_path_source'],
-                            scalings=dict(eeg=10, mag=1e15, grad=1e13)
-                        )
-
-                        if config['apply_output_filtering']:
-                            frequency_band_pairs = list(zip(config['frequency_bands'][::2], config['frequency_bands'][1::2], strict=True))
-        
-                            for low_band, high_band in frequency_band_pairs:
-                                raw_source_filt = filter_output_raw(raw_source,config,
-                                    l_freq=config['cut_off_frequency', low_band],h_freq=config['cut_off_frequency', high_band])
-                                save_whole_EEG_to_txt(
-                                    raw_source_filt,config,config['file_path_source'],
-                                    scalings=dict(eeg=10, mag=1e15, grad=1e13),
-                                    filtering=True,
-                                    l_freq=config['cut_off_frequency', low_band],
-                                    h_freq=config['cut_off_frequency', high_band]
-                                )
-
-                filenum = filenum+1
-                progress_bar_files.UpdateBar(filenum, lfl) # files
-                # end of for loop over files
-
-        # except:
-        except Exception as e:
-
-            print(traceback.format_exc())
-            print_dict(config)
-            # write config to pkl file
-            write_config_file(config)
-            fn = config['logfile']
-            with open(fn, "a", encoding='UTF-8') as f:
-                f.write(traceback.format_exc())
-                f.write(window['-FILE_INFO-'].get())
-            with open(fn, "wt", encoding='UTF-8') as f:
-                f.write(window['-RUN_INFO-'].get())
-            sg.popup_error_with_traceback(
-                'Error - info: ', e)
-            # window.close()
-            # break
+    window.close()
+    sys.stdout = sys.__stdout__
 
-        # write config to pkl file
-        print_dict(config)
-        fn=write_config_file(config)
-        msg = 'Config created for this batch (to be used for rerun) : '+fn
-        window['-FILE_INFO-'].update(msg+'\n', append=True)
-        # write log file
-        fn = config['logfile']
-        with open(fn, "wt", encoding='UTF-8') as f:
-            f.write(window['-RUN_INFO-'].get())
-        with open(fn, "a", encoding='UTF-8') as f:
-            f.write(window['-FILE_INFO-'].get())
-        msg = 'Log file created: ' + fn
-        window['-FILE_INFO-'].update(msg+'\n', append=True)
-        msg = 'Processing complete \n'
-        window['-RUN_INFO-'].update(msg+'\n', append=True)
-        
 
-window.close()
+if __name__ == '__main__':
+    main()
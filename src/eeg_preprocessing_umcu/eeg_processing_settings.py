@@ -4,23 +4,23 @@ Created on Wed May  1 09:56:45 2024
 @author: hvand
 """
 
-import matplotlib
-import mne
-import PySimpleGUI as sg
+# Only data here: importing the settings has no side effects. The plotting backends and the look
+# of the GUI are set by eeg_processing_script.py when the GUI is launched.
 
-# matplotlib.use('Qt5Agg')  # Set the backend to Qt5
-# mne.set_config('MNE_BROWSER_BACKEND', 'matplotlib')
-matplotlib.use('TkAgg')  # Setting bakcend working best for Spyder
-mne.set_config('MNE_BROWSER_BACKEND', 'matplotlib')  # Setting for Spyder
+# matplotlib_backend = 'Qt5Agg'  # Set the backend to Qt5
+matplotlib_backend = 'TkAgg'  # Setting backend working best for Spyder
+mne_browser_backend = 'matplotlib'  # Setting for Spyder
 
 # deaults for gui user input
-sg.theme('Default1')
+gui_theme = 'Default1'
 font = ("Ubuntu Medium", 14)
 f_font=("Courier New", 12) # font filter frequency inputs
 f_size=5 # font size filter frequency inputs
-my_image = sg.Image('UMC_logo.png', subsample=2, pad=(0,0), background_color="#E6F3FF")  # UMC logo
+logo_file = 'UMC_logo.png' # UMC logo, in the directory of the scripts
+tooltip_font = 16 # tootip size
+gui_log_lines = 1000 # lines shown in the run and file info windows (complete log in the .log file)
+gui_log_refresh = 200 # ms between updates of the run and file info windows
 
-sg.set_options(tooltip_font=(16))  # tootip size
 settings={}
 filter_settings={}
 
@@ -59,6 +59,23 @@ settings['input_directory'] = ' '
 settings['batch_name'] = ' '
 settings['frequency_bands_modified'] = 0
 settings['batch_prefix'] = ' '
+settings['nr_workers'] = 1 # number of worker processes for a parallel (headless) rerun
+settings['blas_threads_per_worker'] = 1 # BLAS/OpenMP threads per worker process
+settings['forward_cache_directory'] = '' # on-disk beamformer forward solution cache, empty: in MNE data directory
+settings['forward_cache_size'] = 4 # forward solutions kept in memory
+settings['forward_cache_max_bytes'] = 1024**3 # size limit of the on-disk forward solution cache
+settings['beamformer_dtype'] = 'float64' # precision of the projection to source space, 'float32' is faster
+settings['resample_method'] = 'auto' # 'auto': polyphase for integer ratios, FFT otherwise; 'fft': always FFT
+settings['txt_binary_cache'] = 1 # keep a binary copy (<file>.eegcache.npz) of parsed .txt input files
+settings['txt_cache_directory'] = '' # directory of the binary copies, empty: eegcache in the output directory
+settings['txt_reader_threads'] = 1 # threads parsing a .txt input file
+settings['memory_budget'] = 0 # bytes of signal data per file (0: no budget), see eeg_processing_memory.py
+settings['memory_spill_directory'] = '' # directory for signals moved out of memory, empty: no spilling
+settings['reuse_ica'] = 1 # rerun: use the ICA of the previous run if fitted on the same data and bad channels
+settings['prefetch_files'] = 0 # next recordings loaded and filtered in the background (0: off, not with a memory budget), each needs the memory of a recording
+settings['background_stages'] = 0 # forward solution and output of a file computed in the background while the next file is reviewed (0: off, not with a memory budget), a second recording in memory
+settings['log_flush_interval'] = 1.0 # seconds between writes of the batch log, see eeg_processing_logger.py
+settings['log_json_lines'] = 0 # also write the log as JSON records (<batch_name>.log.jsonl)
 
 
 settings['montage',".txt_bio32"] = "biosemi32"
@@ -119,3 +136,5 @@ settings['input_file_paths','type_EEG']=(("EEG .txt Files", "*.txt"), ("EEG .bdf
 settings['input_file_paths','text']="Select input EEG file(s) - on Mac use 'Options' to filter file types "  
 
 settings['output_txt_decimals']=4 # used in np.round to round down exported txt files
+settings['output_formats']=['txt'] # any of 'txt', 'npy' (memory-mappable array + .json metadata), 'fif'
+settings['output_binary_dtype']='float32' # data type of .npy output files
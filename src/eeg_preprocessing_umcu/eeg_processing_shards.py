@@ -0,0 +1,219 @@
+"""
+Sharding of a batch for array jobs on a cluster.
+
+A rerun of a batch is split deterministically into n shards, each processed by an independent job
+in the same batch output directory, after which the shards are merged into the batch .pkl and .log:
+
+    python eeg_processing_shards.py split <previous_batch>.pkl --shards 8 [--by size]
+    python eeg_processing_shards.py run <batch_name>.pkl --shard $SLURM_ARRAY_TASK_ID    (shards 0-7)
+    python eeg_processing_shards.py merge <batch_name>.pkl
+
+Files are assigned by file index (file i to shard i % n) or by size: longest recording first to the
+shard with the least total size so far (duration from the header, the file size for .txt files).
+Each shard is a batch of its own in the batch output directory (<batch_name>_shard<i>.pkl, .log,
+.manifest.sqlite: one SQLite database per job, also on network file systems), so a shard job that
+is interrupted or fails can simply be run again (completed files are skipped). The merge combines
+the per-file results, logs, manifests and metrics of all shards; it can be repeated after rerunning
+failed shards.
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import argparse
+import copy
+import os
+
+from eeg_processing_engine import (
+    headless_hooks,
+    log_batch_metrics,
+    prepare_rerun,
+    resume_batch,
+    run_batch,
+    write_config_file,
+    write_log_file,
+)
+from eeg_processing_io import open_raw
+from eeg_processing_manifest import (
+    file_complete,
+    file_entries,
+    load_manifest,
+    manifest_path,
+    merge_manifest,
+    write_settings,
+)
+
+shard_strategies = ('index', 'size')
+
+def recording_size(config, file_path):
+    '''
+    Function that returns the size of a recording used to balance the shards: its duration in seconds
+    from the header, the file size for .txt files (no header).
+    '''
+    if config['file_pattern'] == "*.txt":
+        return os.path.getsize(file_path)
+    raw = open_raw({**config, 'file_path': file_path})
+    return raw.n_times / raw.info['sfreq']
+
+def plan_shards(config, n_shards, by='index'):
+    '''
+    Function that assigns the files of config['input_file_paths'] to n_shards shards, by file index
+    or by size (longest first, to the shard with the smallest total). Returns per shard the file
+    paths (in batch order) and the total size (None by index).
+    '''
+    file_paths = config['input_file_paths']
+    if by not in shard_strategies:
+        raise ValueError(f"Unknown shard strategy {by!r}, choose from {', '.join(shard_strategies)}")
+    if by == 'index':
+        shards = [list(range(k, len(file_paths), n_shards)) for k in range(n_shards)]
+        totals = [None] * n_shards
+    else:
+        sizes = [recording_size(config, file_path) for file_path in file_paths]
+        shards = [[] for _ in range(n_shards)]
+        totals = [0] * n_shards
+        for idx in sorted(range(len(file_paths)), key=lambda idx: (-sizes[idx], idx)):
+            k = min(range(n_shards), key=lambda k: (totals[k], k)) # ties: lowest shard number
+            shards[k].append(idx)
+            totals[k] += sizes[idx]
+    return [[file_paths[idx] for idx in sorted(shard)] for shard in shards], totals
+
+def split_batch(config, n_shards, by='index'):
+    '''
+    Function that stores the shard plan in the batch config (config['shards']) and writes the batch
+    .pkl and .log, for the shard jobs to start from.
+    '''
+    file_paths, totals = plan_shards(config, n_shards, by)
+    config['shards'] = {'n_shards': n_shards, 'by': by, 'file_paths': file_paths}
+    run_info = ['*** Batch ' + config['batch_name'] + ' split into ' + str(n_shards) + ' shards (by ' + by + ') ***']
+    for k, (shard, total) in enumerate(zip(file_paths, totals, strict=True)):
+        msg = 'Shard ' + str(k) + ': ' + str(len(shard)) + ' files'
+        if total is not None:
+            msg += ', size ' + str(round(total, 1))
+        run_info.append(msg)
+    config['shards']['log'] = run_info # start of the batch log, also when merged again
+    manifest = load_manifest(config)
+    write_settings(config, manifest)
+    manifest.close()
+    write_config_file(config)
+    write_log_file(config, run_info, [])
+    return config, run_info
+
+def shard_path(config, shard):
+    '''     Function that returns the path of the .pkl of a shard of the batch.     '''
+    return os.path.join(config['batch_output_subdirectory'], config['batch_name'] + '_shard' + str(shard) + '.pkl')
+
+def shard_config(config, shard):
+    '''
+    Function that returns the config of a shard: the batch config with the files of the shard and
+    its own batch name, so its .pkl, .log, manifest and metrics do not collide with other shards.
+    '''
+    n_shards = config['shards']['n_shards']
+    if not 0 <= shard < n_shards:
+        raise ValueError(f'Shard {shard} does not exist, the batch has shards 0-{n_shards - 1}')
+    shard_cfg = copy.deepcopy(config)
+    shard_cfg.pop('shards')
+    shard_cfg['shard'] = {'batch_name': config['batch_name'], 'shard': shard, 'n_shards': n_shards}
+    shard_cfg['input_file_paths'] = config['shards']['file_paths'][shard]
+    shard_cfg['batch_name'] = config['batch_name'] + '_shard' + str(shard)
+    shard_cfg['logfile'] = os.path.join(config['batch_output_subdirectory'], shard_cfg['batch_name'] + '.log')
+    shard_cfg['config_file'] = shard_path(config, shard)
+    if os.path.exists(manifest_path(shard_cfg)): # shard run before: resume it
+        return resume_batch(manifest_path(shard_cfg))
+    return shard_cfg
+
+def run_shard(config_file, shard, nr_workers=1, blas_threads=None, hooks=None):
+    '''     Function that processes one shard of the batch of config_file (written by split_batch).     '''
+    config = shard_config(resume_batch(config_file), shard)
+    if nr_workers > 1:
+        from eeg_processing_parallel import run_batch_parallel
+        return run_batch_parallel(config, nr_workers, blas_threads, hooks)
+    return run_batch(config, hooks)
+
+def merge_shards(config_file, hooks=None):
+    '''
+    Function that merges the shards of the batch of config_file: the per-file entries of the shard
+    manifests (config[file_name, ...]), their logs, manifests and metrics are combined into the batch
+    .pkl, .log, manifest and metrics. Files that are not completed (shard not run or failed) are
+    listed in a RuntimeError after the merge.
+    '''
+    if hooks is None:
+        hooks = headless_hooks()
+    config = resume_batch(config_file)
+    run_info = []
+    file_info = []
+    def log(msg, panel='run'):
+        (file_info if panel == 'file' else run_info).append(msg)
+        hooks['log'](msg, panel)
+    run_info.extend(config['shards']['log'])
+
+    manifest = load_manifest(config)
+    incomplete = []
+    for shard in range(config['shards']['n_shards']):
+        shard_cfg = shard_config(config, shard)
+        fn = manifest_path(shard_cfg)
+        if not os.path.exists(fn):
+            log('\n*** Shard ' + str(shard) + ' not run ***')
+            incomplete.extend(config['shards']['file_paths'][shard])
+            continue
+        merge_manifest(manifest, fn)
+        if os.path.exists(shard_cfg['logfile']):
+            with open(shard_cfg['logfile'], encoding='UTF-8') as f:
+                log('\n*** Shard ' + str(shard) + ' (' + shard_cfg['logfile'] + ') ***\n' + f.read().rstrip('\n'))
+        for file_path in config['shards']['file_paths'][shard]:
+            file_name = os.path.basename(file_path)
+            config.update(file_entries(manifest, file_name))
+            if file_name not in config['input_file_names']:
+                config['input_file_names'].append(file_name)
+            if not file_complete(config, manifest, file_path):
+                incomplete.append(file_path)
+    write_settings(config, manifest)
+    manifest.close()
+
+    msg = '\n*** Shards of batch ' + config['batch_name'] + ' merged, ' + \
+        str(len(config['input_file_paths']) - len(incomplete)) + ' of ' + str(len(config['input_file_paths'])) + \
+        ' files completed ***'
+    log(msg, 'run')
+    log_batch_metrics(config, log)
+    fn = write_config_file(config)
+    log('Config created for this batch (to be used for rerun) : ' + fn, 'file')
+    fn = write_log_file(config, run_info, file_info)
+    log('Log file created: ' + fn, 'file')
+    if incomplete:
+        raise RuntimeError('Processing not completed for ' + str(len(incomplete)) + ' file(s): ' + \
+                           ', '.join(incomplete) + '\nRun their shards again and merge again.')
+    return config
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split a rerun of an EEG batch into shards for array jobs, '
+                                                 'run one shard, or merge the shards.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    split = commands.add_parser('split', help='create the batch and its shard plan from a previous batch')
+    split.add_argument('config_file', help='.pkl file created by a previous run of the batch')
+    split.add_argument('--shards', type=int, required=True, help='number of shards (array jobs)')
+    split.add_argument('--by', default='index', choices=shard_strategies,
+                       help='assign files by file index or balance the shards by recording size (default: index)')
+    split.add_argument('--output-directory', default=None,
+                       help='base output directory (default: output directory of the previous run)')
+    run = commands.add_parser('run', help='process one shard of the batch')
+    run.add_argument('config_file', help='.pkl file of the batch written by split')
+    run.add_argument('--shard', type=int, default=os.environ.get('SLURM_ARRAY_TASK_ID'),
+                     help='shard number, 0 to shards-1 (default: $SLURM_ARRAY_TASK_ID)')
+    run.add_argument('--workers', type=int, default=1, help='number of files of the shard processed in parallel')
+    run.add_argument('--blas-threads', type=int, default=None,
+                     help='BLAS/OpenMP threads per worker process (default: 1)')
+    merge = commands.add_parser('merge', help='merge the shards into the batch .pkl and .log')
+    merge.add_argument('config_file', help='.pkl file of the batch written by split')
+    args = parser.parse_args()
+    if args.command == 'split':
+        config = prepare_rerun(args.config_file, args.output_directory)
+        config, run_info = split_batch(config, args.shards, args.by)
+        print('\n'.join(run_info))
+        print('Batch created: ' + config['config_file'])
+    elif args.command == 'run':
+        if args.shard is None:
+            parser.error('run: --shard is required (or $SLURM_ARRAY_TASK_ID)')
+        run_shard(args.config_file, int(args.shard), args.workers, args.blas_threads)
+        print('Processing complete')
+    else:
+        merge_shards(args.config_file)
+        print('Merge complete')
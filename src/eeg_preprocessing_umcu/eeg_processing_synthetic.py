@@ -0,0 +1,211 @@
+"""
+Deterministic synthetic EEG recordings, for benchmarks and tests.
+
+synthetic_raw returns a recording with 1/f background activity (a mix of spatially spread sources),
+a posterior alpha rhythm and optional artefacts. write_recording writes it as a .txt, .bdf, .edf,
+.vhdr or .fif input file that eeg_processing_io.create_raw reads. The same arguments (including the
+seed) always give the same recording.
+
+    python eeg_processing_synthetic.py rec.bdf --montage biosemi64 --sfreq 2048 --duration 3600
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import argparse
+import os
+
+import mne
+import numpy as np
+from scipy.signal import lfilter
+
+artefact_types = ('blinks', 'line_noise', 'muscle', 'drift', 'bad_channel', 'flat_channel')
+# IIR approximation of 1/f (pink) noise, from white noise
+pink_b = [0.049922035, -0.095993537, 0.050612699, -0.004408786]
+pink_a = [1, -2.494956002, 2.017265875, -0.522189400]
+background_amplitude = 10e-6 # V, standard deviation of the background activity
+n_sources = 16 # background sources mixed into the channels
+
+def channel_positions(montage, n_channels):
+    '''     Function that returns channel names and positions (m), of the montage or a generic ring.     '''
+    if montage is not None:
+        positions = mne.channels.make_standard_montage(montage).get_positions()['ch_pos']
+        ch_names = list(positions)[:n_channels] if n_channels else list(positions)
+        return ch_names, np.array([positions[ch] for ch in ch_names])
+    n_channels = n_channels or 32
+    angles = np.linspace(0, 2 * np.pi, n_channels, endpoint=False)
+    pos = 0.09 * np.column_stack([np.cos(angles), np.sin(angles), np.zeros(n_channels)])
+    return [f'CH{i+1}' for i in range(n_channels)], pos
+
+def synthetic_data(pos, sfreq, n_times, artefacts, line_frequency, rng):
+    '''     Function that returns the synthetic signals (n_channels, n_times) in V for channels at pos.     '''
+    n_channels = len(pos)
+    times = np.arange(n_times) / sfreq
+    # background: 1/f sources, mixed with a smooth spatial spread, plus some channel noise
+    sources = lfilter(pink_b, pink_a, rng.standard_normal((n_sources, n_times)), axis=1)
+    source_pos = rng.normal(0, 0.05, (n_sources, 3))
+    distance = np.linalg.norm(pos[:, None, :] - source_pos[None, :, :], axis=2)
+    data = np.exp(-(distance / 0.05) ** 2) @ sources
+    data += 0.3 * lfilter(pink_b, pink_a, rng.standard_normal((n_channels, n_times)), axis=1)
+    data *= background_amplitude / data.std()
+
+    # alpha rhythm (10 Hz, waxing and waning) over posterior channels
+    posterior = np.clip(-pos[:, 1] / 0.1, 0, 1)
+    envelope = 1 + 0.5 * np.sin(2 * np.pi * 0.2 * times + rng.uniform(0, 2 * np.pi))
+    data += np.outer(posterior, 8e-6 * envelope * np.sin(2 * np.pi * 10 * times))
+
+    frontal = np.clip(pos[:, 1] / 0.08, 0, 1) ** 2
+    lateral = np.clip(np.abs(pos[:, 0]) / 0.08, 0, 1) ** 2
+    if 'blinks' in artefacts: # 300 ms blinks of 100 µV over frontal channels, every 2-6 s
+        blink = 100e-6 * np.hanning(int(0.3 * sfreq))
+        for onset in np.cumsum(rng.uniform(2, 6, int(times[-1] / 2) + 1)):
+            start = int(onset * sfreq)
+            if start + len(blink) > n_times:
+                break
+            data[:, start:start + len(blink)] += np.outer(frontal, blink)
+    if 'muscle' in artefacts: # 1 s high frequency bursts over lateral channels, every 10-20 s
+        for onset in np.cumsum(rng.uniform(10, 20, int(times[-1] / 10) + 1)):
+            start, stop = int(onset * sfreq), int((onset + 1) * sfreq)
+            if stop > n_times:
+                break
+            burst = np.diff(rng.standard_normal((n_channels, stop - start + 1)), axis=1) * 10e-6
+            data[:, start:stop] += lateral[:, None] * burst
+    if 'line_noise' in artefacts and line_frequency < sfreq / 2:
+        data += np.outer(rng.uniform(1e-6, 5e-6, n_channels), np.sin(2 * np.pi * line_frequency * times))
+    if 'drift' in artefacts: # slow drift of up to 50 µV
+        phases = rng.uniform(0, 2 * np.pi, (n_channels, 1))
+        data += rng.uniform(10e-6, 50e-6, (n_channels, 1)) * np.sin(2 * np.pi * 0.02 * times + phases)
+    return data
+
+def synthetic_raw(montage='biosemi64', n_channels=None, sfreq=256.0, duration=60.0, artefacts=artefact_types,
+                  line_frequency=50.0, seed=0):
+    '''
+    Function that returns a synthetic recording (RawArray, 'eeg' channels in V) of duration seconds.
+    With a montage the channel names and positions of the montage are used (the first n_channels),
+    without montage n_channels (default 32) generic channels (CH1, CH2, ...). Artefacts are any of artefact_types;
+    the bad and flat channel are marked in raw.info['bads'].
+    '''
+    unknown = [a for a in artefacts if a not in artefact_types]
+    if unknown:
+        raise ValueError(f"Unknown artefact type(s) {unknown}, choose from {list(artefact_types)}")
+    rng = np.random.default_rng(seed)
+    ch_names, pos = channel_positions(montage, n_channels)
+    n_times = int(round(duration * sfreq))
+    data = synthetic_data(pos, sfreq, n_times, artefacts, line_frequency, rng)
+
+    bads = []
+    channels = rng.permutation(len(ch_names))
+    if 'bad_channel' in artefacts: # very noisy channel
+        data[channels[0]] += 50e-6 * rng.standard_normal(n_times)
+        bads.append(ch_names[channels[0]])
+    if 'flat_channel' in artefacts:
+        data[channels[1]] = 0
+        bads.append(ch_names[channels[1]])
+
+    info = mne.create_info(ch_names, sfreq, 'eeg')
+    raw = mne.io.RawArray(data, info, verbose=False)
+    if montage is not None:
+        raw.set_montage(montage)
+    raw.info['bads'] = bads
+    return raw
+
+def edf_field(value, width):
+    '''     Function that formats a value as a fixed width ASCII field of an EDF/BDF header.     '''
+    return str(value).ljust(width)[:width].encode('ascii')
+
+def write_edf_bdf(raw, fn, bdf=False):
+    '''
+    Function that writes the 'eeg' channels of raw as EDF (16 bit) or BDF (24 bit) file with data
+    records of 1 s; the recording is truncated to whole seconds.
+    '''
+    sfreq = int(raw.info['sfreq'])
+    if sfreq != raw.info['sfreq']:
+        raise ValueError('EDF/BDF files need an integer sample frequency')
+    data = raw.get_data(picks='eeg') * 1e6 # µV
+    n_channels = len(data)
+    n_records = data.shape[1] // sfreq
+    digital_max = 2**23 - 1 if bdf else 2**15 - 1
+    physical_max = float(np.ceil(max(np.abs(data).max(), 1.0)))
+    ch_names = [raw.ch_names[i] for i in mne.pick_types(raw.info, eeg=True, exclude=[])]
+
+    version = b'\xffBIOSEMI' if bdf else edf_field('0', 8)
+    header = (version + edf_field('X', 80) + edf_field('X', 80) + edf_field('01.01.20', 8)
+              + edf_field('00.00.00', 8) + edf_field(256 * (n_channels + 1), 8)
+              + edf_field('24BIT' if bdf else '', 44) + edf_field(n_records, 8) + edf_field(1, 8)
+              + edf_field(n_channels, 4))
+    for values, width in [(ch_names, 16), (['AgAgCl electrode'] * n_channels, 80), (['uV'] * n_channels, 8),
+                          ([-physical_max] * n_channels, 8), ([physical_max] * n_channels, 8),
+                          ([-digital_max - 1] * n_channels, 8), ([digital_max] * n_channels, 8),
+                          ([''] * n_channels, 80), ([sfreq] * n_channels, 8), ([''] * n_channels, 32)]:
+        header += b''.join(edf_field(v, width) for v in values)
+
+    digital = np.round(data[:, :n_records * sfreq] / physical_max * digital_max).astype('<i4')
+    records = digital.reshape(n_channels, n_records, sfreq).transpose(1, 0, 2)
+    if bdf: # 3 little endian bytes per sample
+        samples = records.astype('<i4').view(np.uint8).reshape(records.shape + (4,))[..., :3]
+    else:
+        samples = records.astype('<i2')
+    with open(fn, 'wb') as f:
+        f.write(header)
+        f.write(np.ascontiguousarray(samples).tobytes())
+    return fn
+
+def write_brainvision(raw, fn):
+    '''     Function that writes the 'eeg' channels of raw as BrainVision .vhdr/.vmrk/.eeg files (float32 in µV).     '''
+    base = os.path.splitext(fn)[0]
+    name = os.path.basename(base)
+    picks = mne.pick_types(raw.info, eeg=True, exclude=[])
+    channels = ''.join(f'Ch{i+1}={raw.ch_names[ch]},,1,µV\n' for i, ch in enumerate(picks))
+    with open(fn, 'w', encoding='UTF-8') as f:
+        f.write('Brain Vision Data Exchange Header File Version 1.0\n\n[Common Infos]\nCodepage=UTF-8\n'
+                f'DataFile={name}.eeg\nMarkerFile={name}.vmrk\nDataFormat=BINARY\n'
+                'DataOrientation=MULTIPLEXED\n'
+                f'NumberOfChannels={len(picks)}\nSamplingInterval={1e6 / raw.info["sfreq"]}\n\n'
+                f'[Binary Infos]\nBinaryFormat=IEEE_FLOAT_32\n\n[Channel Infos]\n{channels}')
+    with open(base + '.vmrk', 'w', encoding='UTF-8') as f:
+        f.write('Brain Vision Data Exchange Marker File, Version 1.0\n\n[Common Infos]\nCodepage=UTF-8\n'
+                f'DataFile={name}.eeg\n\n[Marker Infos]\nMk1=New Segment,,1,1,0\n')
+    (raw.get_data(picks=picks) * 1e6).T.astype('<f4').tofile(base + '.eeg')
+    return fn
+
+def write_txt(raw, fn, header=False, decimals=4):
+    '''     Function that writes the 'eeg' channels of raw as tab separated text in µV (one row per sample).     '''
+    picks = mne.pick_types(raw.info, eeg=True, exclude=[])
+    with open(fn, 'w', encoding='UTF-8') as f:
+        if header:
+            f.write('\t'.join(raw.ch_names[i] for i in picks) + '\n')
+        for start in range(0, raw.n_times, 10000):
+            chunk = raw.get_data(picks=picks, start=start, stop=start + 10000) * 1e6
+            np.savetxt(f, chunk.T, fmt=f'%.{decimals}f', delimiter='\t')
+    return fn
+
+def write_recording(raw, fn, header=False):
+    '''     Function that writes raw as input file, in the format of the extension of fn.     '''
+    extension = os.path.splitext(fn)[1].lower()
+    if extension == '.txt':
+        return write_txt(raw, fn, header=header)
+    if extension in ('.edf', '.bdf'):
+        return write_edf_bdf(raw, fn, bdf=extension == '.bdf')
+    if extension == '.vhdr':
+        return write_brainvision(raw, fn)
+    if extension == '.fif': # as recorded, without bad channels marked
+        bads, raw.info['bads'] = raw.info['bads'], []
+        raw.save(fn, overwrite=True, verbose=False)
+        raw.info['bads'] = bads
+        return fn
+    raise ValueError(f"Unknown file type {extension}, choose from .txt, .bdf, .edf, .vhdr, .fif")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic EEG recording.')
+    parser.add_argument('file_name', help='output file (.txt, .bdf, .edf, .vhdr or .fif)')
+    parser.add_argument('--montage', default='biosemi64', help='standard MNE montage, "none" for generic channels')
+    parser.add_argument('--channels', type=int, default=None, help='number of channels (default: all of the montage)')
+    parser.add_argument('--sfreq', type=float, default=256.0, help='sample frequency (Hz)')
+    parser.add_argument('--duration', type=float, default=60.0, help='duration (s)')
+    parser.add_argument('--artefacts', nargs='*', default=list(artefact_types), choices=artefact_types)
+    parser.add_argument('--header', action='store_true', help='channel names in the first row (.txt)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    montage = None if args.montage == 'none' else args.montage
+    raw = synthetic_raw(montage, args.channels, args.sfreq, args.duration, args.artefacts, seed=args.seed)
+    print('Synthetic recording written:', write_recording(raw, args.file_name, header=args.header))
@@ -0,0 +1,111 @@
+"""
+Processing of a batch on a worker thread, so the GUI stays responsive during filtering, ICA and
+export. The worker never touches the window: every callback of the engine (hooks, see
+eeg_processing_engine.headless_hooks) is posted as an event, e.g. with window.write_event_value,
+and handled by the GUI thread with its own hooks (handle_hook_event). Interactive callbacks
+(plots, dialogs, warnings) wait for the GUI thread to return their result; log messages and
+progress do not wait.
+
+@authors:Herman van Dellen en Yorben Lodema.
+"""
+
+import queue
+import threading
+import traceback
+
+from eeg_processing_engine import run_batch
+
+hook_event = '-HOOK-' # value: (name, args, kwargs, reply queue or None)
+batch_done_event = '-BATCH_DONE-' # value: (config, None) or (None, traceback)
+log_event = '-LOG-' # value: (msg, panel), printed output
+
+posted_hooks = ('log', 'progress') # not waited for
+interactive_hooks = ('warn', 'select_channels_to_be_dropped', 'interact')
+
+def post_hook(post, name, wait):
+    '''
+    Function that returns a callback posting its calls of hook name as events for the GUI thread.
+    With wait the caller is blocked until the GUI thread has handled the event, and gets its result
+    (or its exception).
+    '''
+    def hook(*args, **kwargs):
+        if not wait:
+            post(hook_event, (name, args, kwargs, None))
+            return None
+        reply = queue.Queue(maxsize=1)
+        post(hook_event, (name, args, kwargs, reply))
+        result, error = reply.get()
+        if error is not None:
+            raise error
+        return result
+    return hook
+
+def thread_hooks(hooks, post):
+    '''
+    Function that returns the hooks for a worker thread: the calls of the hooks (of the GUI) are
+    posted as events with post(event, value), the hooks that are None (e.g. no channel selection)
+    stay None.
+    '''
+    worker_hooks = {}
+    for name, hook in hooks.items():
+        if hook is None:
+            worker_hooks[name] = None
+        else:
+            worker_hooks[name] = post_hook(post, name, name not in posted_hooks)
+    return worker_hooks
+
+def handle_hook_event(hooks, value):
+    '''     Function that runs a posted hook call on the GUI thread and returns its result to the waiting worker.     '''
+    name, args, kwargs, reply = value
+    try:
+        result = hooks[name](*args, **kwargs)
+    except Exception as e:
+        if reply is None:
+            raise
+        reply.put((None, e))
+    else:
+        if reply is not None:
+            reply.put((result, None))
+
+def start_batch_thread(config, hooks, post, interactive=True, stop=None):
+    '''
+    Function that starts run_batch on a worker thread with the hooks of the GUI posted as events.
+    When the batch ends, batch_done_event is posted with the config, or with the traceback if
+    processing failed (the config and log file are written by run_batch in both cases). Setting
+    stop (a threading.Event) ends the batch after the current file.
+    '''
+    def worker():
+        try:
+            result = run_batch(config, thread_hooks(hooks, post), interactive, stop)
+        except Exception:
+            post(batch_done_event, (None, traceback.format_exc()))
+        else:
+            post(batch_done_event, (result, None))
+    thread = threading.Thread(target=worker, name='eeg-batch', daemon=True)
+    thread.start()
+    return thread
+
+class PostedStream:
+    '''
+    Text stream (for sys.stdout) that posts every complete line as log_event, so output printed
+    on any thread reaches the GUI without touching the window from that thread.
+    '''
+    def __init__(self, post, panel='run'):
+        self.post = post
+        self.panel = panel
+        self.buffer = ''
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            lines = (self.buffer + text).split('\n')
+            self.buffer = lines.pop()
+        for line in lines:
+            self.post(log_event, (line, self.panel))
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            line, self.buffer = self.buffer, ''
+        if line:
+            self.post(log_event, (line, self.panel))
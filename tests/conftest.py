@@ -0,0 +1,6 @@
+"""Make the scripts in src/eeg_preprocessing_umcu importable the way they import each other."""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'src', 'eeg_preprocessing_umcu'))
@@ -0,0 +1,17 @@
+"""Tests for the eeg_processing_atlas module."""
+import os
+
+import numpy as np
+from eeg_processing_atlas import atlas_file, convert_atlas, load_atlas, script_dir
+
+
+def test_shipped_atlas_matches_excel(tmp_path):
+    """DesikanVox.npz is up to date with DesikanVox.xlsx and DesikanVoxLabels.csv."""
+    fn = convert_atlas(os.path.join(script_dir, 'DesikanVox.xlsx'),
+                       os.path.join(script_dir, 'DesikanVoxLabels.csv'), str(tmp_path / 'atlas.npz'))
+    converted = load_atlas(fn)
+    shipped = load_atlas(atlas_file)
+    np.testing.assert_array_equal(shipped['pos'], converted['pos'])
+    np.testing.assert_allclose(np.linalg.norm(shipped['nn'], axis=1), 1.0)
+    assert shipped['labels'] == converted['labels']
+    assert len(shipped['labels']) == len(shipped['pos'])
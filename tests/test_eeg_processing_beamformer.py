@@ -0,0 +1,77 @@
+"""Tests for the eeg_processing_beamformer module."""
+import os
+
+import eeg_processing_beamformer
+import mne
+import numpy as np
+import pytest
+from eeg_processing_atlas import load_atlas
+from eeg_processing_beamformer import (
+    apply_spatial_filter,
+    evict_forward_cache_files,
+    forward_cache_key,
+)
+from mne.beamformer import apply_lcmv_raw, make_lcmv
+
+
+def make_info():
+    """Info of a biosemi64 recording with montage."""
+    montage = mne.channels.make_standard_montage('biosemi64')
+    info = mne.create_info(montage.ch_names, 256.0, 'eeg')
+    info.set_montage(montage)
+    return info
+
+
+def test_forward_cache_key():
+    """Key is equal for identical channel sets and changes after dropping a bad channel."""
+    config = {'input_file_pattern': '.bdf_64', ('montage', '.bdf_64'): 'biosemi64'}
+    pos = np.ones((68, 3))
+    bem = 'fsaverage-5120-5120-5120-bem-sol.fif'
+    key = forward_cache_key(make_info(), config, bem, pos)
+    assert key == forward_cache_key(make_info(), config, bem, pos)
+    assert key != forward_cache_key(mne.pick_info(make_info(), list(range(63))), config, bem, pos)
+    assert key != forward_cache_key(make_info(), config, bem, pos * 2)
+
+
+def test_evict_forward_cache_files(tmp_path):
+    """Least recently used files are removed until the cache fits."""
+    for idx, name in enumerate(['a-fwd.fif', 'b-fwd.fif', 'c-fwd.fif']):
+        fn = tmp_path / name
+        fn.write_bytes(b'0' * 100)
+        os.utime(fn, (idx, idx))
+    evict_forward_cache_files(str(tmp_path), 250)
+    assert sorted(os.listdir(tmp_path)) == ['b-fwd.fif', 'c-fwd.fif']
+
+
+@pytest.mark.filterwarnings('ignore:An average reference projection was already added')
+def test_apply_spatial_filter(monkeypatch):
+    """Chunked projection of the downsampled signal equals beamforming at full rate and downsampling after."""
+    info = make_info()
+    data = np.random.default_rng(0).standard_normal((64, 256 * 20)) * 1e-5
+    raw = mne.io.RawArray(data, info, verbose=False)
+    raw.set_eeg_reference('average', projection=True, verbose=False)
+    raw.apply_proj()
+    config = {'file_name': 'rec.bdf', ('rec.bdf', 'bad'): ['Fp1', 'Oz']}
+    # sphere head model at the atlas voxels instead of fsaverage
+    atlas = load_atlas()
+    sphere = mne.make_sphere_model((0., 0., 0.), 0.2, verbose=False)
+    src = mne.setup_volume_source_space(pos={'rr': atlas['pos'], 'nn': atlas['nn']}, sphere=sphere,
+                                        mindist=0, exclude=0, verbose=False)
+    raw_b = raw.copy().drop_channels(config['rec.bdf', 'bad'])
+    fwd = mne.make_forward_solution(raw_b.info, trans=None, src=src, bem=sphere, eeg=True, mindist=0, verbose=False)
+    data_cov = mne.compute_raw_covariance(raw_b, verbose=False)
+    spatial_filter = make_lcmv(raw_b.info, fwd, data_cov, reg=0.05, pick_ori='max-power', verbose=False)
+
+    expected = apply_lcmv_raw(raw_b, spatial_filter, verbose=False).data
+    expected = mne.filter.resample(expected, down=2, npad='auto')
+
+    monkeypatch.setattr(eeg_processing_beamformer, 'source_chunk_samples', 1000)
+    raw.resample(128, npad='auto', verbose=False)
+    raw_source = apply_spatial_filter(raw, config, spatial_filter, {'log': lambda msg, panel='run': None})
+    assert raw_source.ch_names == list(atlas['labels'])
+    assert raw_source.info['sfreq'] == 128
+    np.testing.assert_allclose(raw_source.get_data(), expected, rtol=1e-7, atol=1e-9 * np.abs(expected).max())
+
+    config['beamformer_dtype'] = 'float32'
+    raw_source = apply_spatial_filter(raw, config, spatial_filter, {'log': lambda msg, panel='run': None})
+    np.testing.assert_allclose(raw_source.get_data(), expected, rtol=1e-3, atol=1e-5 * np.abs(expected).max())
@@ -0,0 +1,216 @@
+"""Tests for the eeg_processing_engine module."""
+import copy
+import os
+import subprocess
+import sys
+import threading
+
+import mne
+import numpy as np
+import pytest
+from eeg_processing_engine import (
+    headless_hooks,
+    ica_fingerprint,
+    load_config,
+    make_montage,
+    perform_average_reference,
+    perform_ica,
+    prepare_rerun,
+    resume_batch,
+    run_batch,
+    set_batch_names,
+    unreviewed_files,
+)
+from eeg_processing_filters import broadband_filter, filter_raw
+from eeg_processing_io import create_raw
+from eeg_processing_manifest import file_complete, load_manifest, manifest_path
+from eeg_processing_resampling import resample_raw, resampling_plan
+from eeg_processing_settings import settings
+from eeg_processing_synthetic import synthetic_raw, write_recording
+
+
+@pytest.fixture
+def raw():
+    """Short random recording with 8 EEG channels."""
+    info = mne.create_info([f'CH{i+1}' for i in range(8)], 128.0, 'eeg')
+    return mne.io.RawArray(np.random.default_rng(0).standard_normal((8, 128 * 30)) * 1e-5, info, verbose=False)
+
+
+@pytest.mark.filterwarnings('ignore:FastICA did not converge')
+def test_perform_ica_reuse(tmp_path, raw):
+    """A rerun uses the stored ICA if the fingerprint matches, and fits again when the bad channels changed."""
+    config = {'file_name': 'rec.txt', ('rec.txt', 'bad'): [], 'nr_ica_components': 4, 'max_channels': 8,
+              'rerun': 0, 'batch_output_subdirectory': str(tmp_path), 'previous_run_config_file': ' '}
+    hooks = dict(headless_hooks(), log=lambda msg, panel='run': messages.append(msg))
+    messages = []
+    _, ica, config = perform_ica(raw, raw.copy(), config, hooks, interactive=False)
+    assert os.path.exists(config['rec.txt', 'ica']['file'])
+    assert config['rec.txt', 'ica']['fingerprint'] == ica_fingerprint(raw, config)
+
+    rerun_dir = tmp_path / 'rerun'
+    rerun_dir.mkdir()
+    config.update({'rerun': 1, 'batch_output_subdirectory': str(rerun_dir),
+                   'previous_run_config_file': str(tmp_path / 'batch.pkl')})
+    messages = []
+    _, ica_rerun, config = perform_ica(raw, raw.copy(), config, hooks, interactive=False)
+    assert any(msg.startswith('ICA of previous run used') for msg in messages)
+    np.testing.assert_allclose(ica_rerun.unmixing_matrix_, ica.unmixing_matrix_)
+
+    config['rec.txt', 'bad'] = ['CH1']
+    messages = []
+    perform_ica(raw, raw.copy(), config, hooks, interactive=False)
+    assert not any(msg.startswith('ICA of previous run used') for msg in messages)
+
+
+def make_batch(tmp_path, n_files=2, background_stages=0):
+    """Config of a new batch (as set by the GUI) with synthetic .bdf recordings."""
+    paths = [write_recording(synthetic_raw('biosemi32', sfreq=256.0, duration=16.0, seed=k), str(tmp_path / f'rec{k}.bdf'))
+             for k in range(n_files)]
+    config = copy.deepcopy(settings)
+    config.update({'input_file_paths': paths, 'input_file_pattern': '.bdf_32', 'output_directory': str(tmp_path / 'new'),
+                   'batch_prefix': 'batch', 'apply_ica': 1, 'nr_ica_components': 5, 'downsample_factor': 2,
+                   'output_formats': ['txt', 'npy'], 'output_binary_dtype': 'float64', 'prefetch_files': 0,
+                   'background_stages': background_stages})
+    return set_batch_names(config)
+
+
+def stub_hooks(messages, dropped=None, review=False):
+    """
+    Hooks of a run without GUI: messages are kept and the channels to be dropped are given. With
+    review the operator marks Fp2 as bad and excludes the first ICA component, otherwise no plots.
+    """
+    def interact(func, *args, **kwargs):
+        assert review, 'no interaction expected'
+        if getattr(func, '__name__', '') == 'plot' and isinstance(func.__self__, mne.io.BaseRaw):
+            func.__self__.info['bads'] = ['Fp2'] # bad channel review
+        elif getattr(func, '__name__', '') == 'plot_sources':
+            func.__self__.exclude = [0] # ICA review
+    return dict(headless_hooks(), log=lambda msg, panel='run': messages.append(msg),
+                select_channels_to_be_dropped=lambda ch_names: dropped, interact=interact)
+
+
+def expected_output(config, file_path):
+    """Output signal (µV) of a file computed step by step: filter, resample, ICA, interpolate, reference."""
+    from mne.preprocessing import read_ica
+    file_name = os.path.basename(file_path)
+    config = dict(config, file_path=file_path, file_name=file_name)
+    raw, config = create_raw(config, make_montage(config), [], headless_hooks())
+    raw.drop_channels(config['channels_to_be_dropped'])
+    raw = filter_raw(raw, **broadband_filter)
+    raw = resample_raw(raw, resampling_plan(config)['output'])
+    raw.info['bads'] = config[file_name, 'bad']
+    read_ica(config[file_name, 'ica']['file'], verbose=False).apply(raw)
+    raw.interpolate_bads(reset_bads=True)
+    raw = perform_average_reference(raw)
+    return raw.get_data(picks='eeg') * 1e6
+
+
+@pytest.mark.filterwarnings('ignore:FastICA did not converge')
+@pytest.mark.parametrize('background_stages', [0, 1])
+def test_new_batch_and_rerun(tmp_path, background_stages):
+    """A new batch (reviewed) and its rerun run through run_batch without GUI, with the output and .pkl expected."""
+    messages = []
+    config = run_batch(make_batch(tmp_path, background_stages=background_stages),
+                       stub_hooks(messages, ['Oz'], review=True), interactive=True)
+    batch_dir = config['batch_output_subdirectory']
+    assert sorted(os.listdir(os.path.join(batch_dir, 'rec0bdf'))) == [
+        'rec0_Sensor_level_0.5-47_Hz.json', 'rec0_Sensor_level_0.5-47_Hz.npy', 'rec0_Sensor_level_0.5-47_Hz.txt']
+    new = load_config(config['config_file'])
+    assert new['input_file_names'] == ['rec0.bdf', 'rec1.bdf']
+    assert new['channels_to_be_dropped'] == ['Oz'] and new['channels_to_be_dropped_selected'] == 1
+    for file_name in new['input_file_names']:
+        assert new[file_name, 'bad'] == ['Fp2'] and new[file_name, 'ica']['exclude'] == [0]
+        assert os.path.exists(new[file_name, 'ica']['file']) and new[file_name, 'timing']['seconds'] > 0
+    manifest = load_manifest(config)
+    assert all(file_complete(config, manifest, file_path) for file_path in config['input_file_paths'])
+    manifest.close()
+
+    # rerun: same selections without interaction, the ICA of the new batch is used
+    messages = []
+    rerun = run_batch(prepare_rerun(config['config_file'], str(tmp_path / 'rerun')), stub_hooks(messages))
+    assert sum(msg.startswith('ICA of previous run used') for msg in messages) == 2
+    assert rerun['downsampled_sample_frequency'] == 128
+    for k, file_path in enumerate(rerun['input_file_paths']):
+        fn = os.path.join(f'rec{k}bdf', f'rec{k}_Sensor_level_0.5-47_Hz')
+        data = np.load(os.path.join(rerun['batch_output_subdirectory'], fn + '.npy'))
+        assert data.shape == (31, 16 * 128)
+        np.testing.assert_allclose(data, expected_output(rerun, file_path), atol=1e-6)
+        with open(os.path.join(batch_dir, fn + '.txt')) as f, \
+                open(os.path.join(rerun['batch_output_subdirectory'], fn + '.txt')) as g:
+            assert f.read() == g.read()
+
+
+@pytest.mark.filterwarnings('ignore:No bad channels to interpolate')
+@pytest.mark.parametrize('resume_from', ['pkl', 'manifest'])
+def test_resume_after_crash(tmp_path, resume_from):
+    """A batch killed during its second file is resumed from its manifest (or .pkl path), the first file is skipped."""
+    def crash(msg, panel='run'):
+        if 'Processing file' in msg and 'rec1.bdf' in msg:
+            raise KeyboardInterrupt # not handled by run_batch, like a killed process
+    config = dict(make_batch(tmp_path), apply_ica=0)
+    with pytest.raises(KeyboardInterrupt):
+        run_batch(config, dict(stub_hooks([], ['Oz']), log=crash))
+    assert not os.path.exists(config['config_file']) # written when the batch ends, the manifest is the checkpoint
+    assert os.path.exists(manifest_path(config))
+
+    messages = []
+    resumed = run_batch(resume_batch(config['config_file'] if resume_from == 'pkl' else manifest_path(config)),
+                        stub_hooks(messages))
+    assert 'File ' + resumed['input_file_paths'][0] + ' already completed in this batch, skipped' in messages
+    assert resumed['channels_to_be_dropped'] == ['Oz']
+    assert os.path.exists(os.path.join(resumed['batch_output_subdirectory'], 'rec1bdf', 'rec1_Sensor_level.npy'))
+    assert load_config(resumed['config_file'])['input_file_names'] == ['rec0.bdf', 'rec1.bdf']
+
+
+@pytest.mark.filterwarnings('ignore:FastICA did not converge')
+def test_resume_reviewed_batch(tmp_path):
+    """
+    A reviewed batch with ICA killed during its second file is refused by the headless --resume, the
+    file was not reviewed yet; resumed with interaction (GUI) the file is reviewed and the first skipped.
+    """
+    def crash(msg, panel='run'):
+        if 'Processing file' in msg and 'rec1.bdf' in msg:
+            raise KeyboardInterrupt
+    config = make_batch(tmp_path)
+    with pytest.raises(KeyboardInterrupt):
+        run_batch(config, dict(stub_hooks([], ['Oz'], review=True), log=crash), interactive=True)
+    assert unreviewed_files(resume_batch(config['config_file'])) == [config['input_file_paths'][1]]
+
+    engine = sys.modules['eeg_processing_engine'].__file__
+    result = subprocess.run([sys.executable, engine, config['config_file'], '--resume'], cwd=os.path.dirname(engine),
+                            capture_output=True, text=True)
+    assert result.returncode == 2 and '1 file(s) of this batch were not reviewed yet (rec1.bdf)' in result.stderr
+
+    messages = []
+    resumed = run_batch(resume_batch(manifest_path(config)), stub_hooks(messages, review=True), interactive=True)
+    assert 'File ' + resumed['input_file_paths'][0] + ' already completed in this batch, skipped' in messages
+    assert resumed['rec1.bdf', 'bad'] == ['Fp2'] and resumed['rec1.bdf', 'ica']['exclude'] == [0]
+    assert unreviewed_files(load_config(resumed['config_file'])) == []
+
+
+@pytest.mark.filterwarnings('ignore:No bad channels to interpolate')
+def test_stop_between_files(tmp_path):
+    """A stop requested during the first file ends the batch after it, the second file is left for resume."""
+    stop = threading.Event()
+    messages = []
+    def log(msg, panel='run'):
+        messages.append(msg)
+        if 'Processing file' in msg:
+            stop.set() # e.g. Exit in the GUI during the review of the first file
+    config = run_batch(dict(make_batch(tmp_path), apply_ica=0), dict(stub_hooks([], ['Oz']), log=log), stop=stop)
+    assert ('Processing stopped, 1 files not processed (process them with Resume interrupted batch in the GUI, '
+            'or --resume if they were reviewed or the batch is a rerun)') in messages
+    manifest = load_manifest(config)
+    assert [file_complete(config, manifest, file_path) for file_path in config['input_file_paths']] == [True, False]
+    manifest.close()
+    assert load_config(config['config_file'])['input_file_names'] == ['rec0.bdf']
+
+
+def test_import_without_side_effects():
+    """Importing the engine and the settings loads no GUI, plotting backend or slow optional modules."""
+    code = ('import sys, eeg_processing_settings, eeg_processing_engine; '
+            'print(sorted(m for m in ("PySimpleGUI", "tkinter", "matplotlib.pyplot", "mne.preprocessing", '
+            '"mne.beamformer", "mne.datasets", "pandas", "openpyxl") if m in sys.modules))')
+    src_dir = os.path.dirname(sys.modules['eeg_processing_engine'].__file__)
+    result = subprocess.run([sys.executable, '-c', code], cwd=src_dir, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
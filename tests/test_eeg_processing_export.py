@@ -0,0 +1,72 @@
+"""Tests for the eeg_processing_export module."""
+import json
+
+import eeg_processing_export
+import mne
+import numpy as np
+import pandas as pd
+import pytest
+from eeg_processing_export import format_txt_rows, save_epoch_data, save_whole_EEG
+
+
+@pytest.fixture
+def raw():
+    """Short random recording with 4 EEG channels (in V)."""
+    rng = np.random.default_rng(0)
+    info = mne.create_info([f'CH{i+1}' for i in range(4)], 128.0, 'eeg')
+    return mne.io.RawArray(rng.standard_normal((4, 128 * 20)) * 1e-5, info, verbose=False)
+
+
+@pytest.fixture
+def config():
+    return {'apply_beamformer': 0, 'apply_ica': 0, 'output_txt_decimals': 4, 'file_name': 'rec.txt',
+            'epoch_length': 4.0, 'output_formats': ['txt', 'npy', 'fif']}
+
+
+@pytest.fixture
+def hooks():
+    return {'log': lambda msg, panel='run': None, 'progress': lambda bar, value, maximum=None: None}
+
+
+def test_save_epoch_data(tmp_path, raw, config, hooks):
+    """Text, .npy and .fif output of an epoch selection contain the same data."""
+    events = mne.make_fixed_length_events(raw, duration=4.0)
+    epochs = mne.Epochs(raw, events, tmin=0, tmax=4.0 - 1 / 128, baseline=None, verbose=False)[[0, 2, 3]]
+    epochs.drop_bad()
+    base = str(tmp_path / 'rec_Sensor_level')
+    save_epoch_data(epochs, config, base, hooks, filtering=True, l_freq=4, h_freq=8)
+
+    data = np.load(base + '_4.0-8.0 Hz_Epochs.npy', mmap_mode='r')
+    with open(base + '_4.0-8.0 Hz_Epochs.json', encoding='UTF-8') as f:
+        metadata = json.load(f)
+    assert data.shape == (3, 4, 512)
+    assert metadata['epoch_index'] == [0, 2, 3]
+    assert metadata['ch_names'] == raw.ch_names
+    assert (metadata['l_freq'], metadata['h_freq'], metadata['sfreq']) == (4.0, 8.0, 128.0)
+    text = pd.read_csv(base + '_4.0-8.0 Hz_Epoch_2.txt', sep='\t').to_numpy()
+    np.testing.assert_allclose(data[1].T, text, atol=1e-4)
+    fif = mne.read_epochs(base + '_4.0-8.0 Hz-epo.fif', verbose=False)
+    np.testing.assert_allclose(fif.get_data() * 1e6, data, rtol=1e-6)
+
+
+def test_save_whole_EEG(tmp_path, raw, config, hooks, monkeypatch):
+    """Chunked continuous output equals to_data_frame, unknown formats are refused."""
+    monkeypatch.setattr(eeg_processing_export, 'export_chunk_samples', 1000)
+    base = str(tmp_path / 'rec_Sensor_level')
+    save_whole_EEG(raw, config, base)
+    expected = np.round(raw.to_data_frame(picks='eeg').iloc[:, 1:], decimals=4)
+    with open(base + '.txt', encoding='UTF-8') as f:
+        assert f.read() == expected.to_csv(sep='\t', index=False, lineterminator='\n')
+    text = expected.to_numpy()
+    np.testing.assert_allclose(np.load(base + '.npy').T, text, atol=1e-4)
+    assert mne.io.read_raw_fif(base + '_raw.fif', verbose=False).n_times == raw.n_times
+    with pytest.raises(ValueError, match='Unknown output format'):
+        save_whole_EEG(raw, dict(config, output_formats=['hdf5']), base)
+
+
+def test_format_txt_rows():
+    """Text lines equal pandas to_csv, including negative zero and missing values."""
+    data = np.round(np.random.default_rng(1).standard_normal((50, 6)) * 20, 4)
+    data[0, :2] = [-0.0, np.nan]
+    expected = pd.DataFrame(data).to_csv(sep='\t', index=False, header=False, lineterminator='\n')
+    assert ''.join(format_txt_rows(data)) == expected
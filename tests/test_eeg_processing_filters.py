@@ -0,0 +1,64 @@
+"""Tests for the eeg_processing_filters module."""
+import mne
+import numpy as np
+import pytest
+from eeg_processing_filters import (
+    applied_band,
+    broadband_filter,
+    calc_filt_transition,
+    filter_bank,
+    filter_output_raw,
+    filter_raw,
+)
+
+
+@pytest.fixture
+def raw():
+    """Short random recording with 10 EEG channels and one stim channel."""
+    rng = np.random.default_rng(0)
+    info = mne.create_info([f'CH{i+1}' for i in range(10)] + ['STI'], 128.0, ['eeg'] * 10 + ['stim'])
+    return mne.io.RawArray(rng.standard_normal((11, 128 * 30)), info, verbose=False)
+
+
+def test_calc_filt_transition():
+    """Transition bandwidth is 10% of the cutoff, limited to 0.4-1.5 Hz and to the cutoff itself."""
+    assert calc_filt_transition(0.2) == 0.2
+    assert calc_filt_transition(4.0) == 0.4
+    assert calc_filt_transition(8.0) == pytest.approx(0.8)
+    assert calc_filt_transition(47.0) == 1.5
+
+
+@pytest.mark.parametrize('broadband', [False, True])
+def test_filter_bank_equals_filter_output_raw(raw, broadband):
+    """All bands of the filter bank equal filtering each band separately."""
+    config = {'apply_ica': 0, 'apply_beamformer': 0}
+    if broadband:
+        filter_raw(raw, **broadband_filter)
+    bands = [(0.5, 4), (4, 8), (8, 13), (13, 20), (20, 30), (0.5, 47)]
+    for l_freq, h_freq, raw_band in filter_bank(raw, config, bands, block_size=3):
+        expected = filter_output_raw(raw, config, l_freq, h_freq).get_data()
+        np.testing.assert_allclose(raw_band.get_data(), expected, rtol=0, atol=1e-12)
+        assert applied_band(raw_band) == ((l_freq if l_freq > 0.5 else 0.5, min(h_freq, 47.0)) if broadband
+                                          else (l_freq, h_freq))
+    assert applied_band(raw) == ((0.5, 47) if broadband else (None, None))
+
+
+def test_filter_raw_reuse(raw):
+    """A filter applied to the same data a second time is taken from the cache, once."""
+    filter_cache = {}
+    messages = []
+    hooks = {'log': lambda msg, panel='run': messages.append((msg, panel))}
+    raw_temp = filter_raw(raw.copy(), **broadband_filter, filter_cache=filter_cache, hooks=hooks)
+    assert len(filter_cache) == 1 and messages == []
+    filter_raw(raw, **broadband_filter, filter_cache=filter_cache, hooks=hooks)
+    assert filter_cache == {} and messages == [('Filtered data (0.5-47 Hz) reused', 'run')]
+    np.testing.assert_array_equal(raw.get_data(), raw_temp.get_data())
+    assert applied_band(raw) == (0.5, 47)
+
+
+def test_output_filter_logged(raw):
+    """Filters the signal already has are not applied again, which is logged with the hooks."""
+    messages = []
+    filter_raw(raw, **broadband_filter)
+    filter_output_raw(raw, {}, 0.5, 4, {'log': lambda msg, panel='run': messages.append(msg)})
+    assert len(messages) == 1 and messages[0].startswith('No additional (<) 0.5 Hz high pass filter applied')
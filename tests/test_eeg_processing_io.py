@@ -0,0 +1,125 @@
+"""Tests for the eeg_processing_io module."""
+import mne
+import numpy as np
+import pandas as pd
+import pytest
+from eeg_processing_io import (
+    create_raw,
+    load_txt_eeg,
+    probe_channel_names,
+    read_txt_eeg,
+    txt_sidecar_path,
+)
+
+
+@pytest.fixture
+def samples():
+    """Random EEG samples in µV, one row per sample."""
+    return np.round(np.random.default_rng(0).standard_normal((1000, 8)) * 50, 4)
+
+
+@pytest.mark.parametrize('n_threads', [1, 3])
+@pytest.mark.parametrize('header', [False, True])
+def test_read_txt_eeg(tmp_path, samples, n_threads, header):
+    """Data equals pandas parsing scaled to V, channel-major, with and without header."""
+    fn = tmp_path / 'rec.txt'
+    pd.DataFrame(samples, columns=[f'E{i}' for i in range(8)]).to_csv(fn, sep='\t', index=False, header=header)
+    data, names, nan_channels = read_txt_eeg(fn, n_threads=n_threads)
+    assert data.flags['C_CONTIGUOUS']
+    assert data.shape == (8, 1000)
+    np.testing.assert_allclose(data, samples.T * 1e-6)
+    assert names == ([f'E{i}' for i in range(8)] if header else None)
+    assert not nan_channels.any()
+
+
+def test_read_txt_eeg_missing_values_and_blank_rows(tmp_path, samples):
+    """Missing values are reported per channel, blank rows are skipped."""
+    rows = ['\t'.join(str(v) for v in row) for row in samples[:10]]
+    rows[3] = rows[3].replace(str(samples[3, 2]), 'NaN', 1)
+    rows.insert(5, '')
+    fn = tmp_path / 'rec.txt'
+    fn.write_text('\n'.join(rows))
+    data, names, nan_channels = read_txt_eeg(fn, n_threads=2)
+    assert data.shape == (8, 10)
+    assert np.flatnonzero(nan_channels).tolist() == [2]
+
+
+def test_read_txt_eeg_non_numeric(tmp_path, samples):
+    """Non-numeric values raise a ValueError."""
+    fn = tmp_path / 'rec.txt'
+    fn.write_text('1\t2\n3\tx\n')
+    with pytest.raises(ValueError, match='Non-numeric'):
+        read_txt_eeg(fn)
+
+
+def test_load_txt_eeg_sidecar(tmp_path, samples):
+    """Second load comes from the binary sidecar, a changed file is parsed again."""
+    fn = tmp_path / 'rec.txt'
+    np.savetxt(fn, samples, delimiter='\t', fmt='%.4f')
+    config = {'txt_cache_directory': str(tmp_path / 'cache')}
+    (tmp_path / 'cache').mkdir()
+    messages = []
+    hooks = {'log': lambda msg, panel='run': messages.append(msg)}
+    data, _, _ = load_txt_eeg(fn, config, hooks)
+    assert (tmp_path / 'cache' / 'rec.txt.eegcache.npz').exists()
+    assert messages == []
+    cached, _, _ = load_txt_eeg(fn, config, hooks)
+    np.testing.assert_array_equal(cached, data)
+    assert messages == ['Binary copy of ' + str(fn) + ' used: ' + str(tmp_path / 'cache' / 'rec.txt.eegcache.npz')]
+    np.savetxt(fn, samples[:500], delimiter='\t', fmt='%.4f')
+    data, _, _ = load_txt_eeg(fn, config, hooks)
+    assert data.shape == (8, 500)
+
+
+def test_txt_sidecar_path(tmp_path):
+    """The sidecar is in eegcache of the output directory, next to the file only without output directory."""
+    fn = str(tmp_path / 'input' / 'rec.txt')
+    assert txt_sidecar_path(fn, {'output_directory': str(tmp_path / 'out')}) == \
+        str(tmp_path / 'out' / 'eegcache' / 'rec.txt.eegcache.npz')
+    assert txt_sidecar_path(fn, {'output_directory': ' '}) == str(tmp_path / 'input' / 'rec.txt.eegcache.npz')
+
+
+edf_ch_names = ['Fp1', 'Fp2', 'Cz', 'EXG1', 'EXG2']
+edf_sfreq = 128
+
+
+def write_edf(fn, data):
+    """Write data (n_channels, n_seconds * edf_sfreq, in µV between -3276.8 and 3276.7) as minimal EDF file."""
+    n_channels, n_times = data.shape
+    n_records = n_times // edf_sfreq
+    def field(value, width):
+        return str(value).ljust(width)[:width].encode('ascii')
+    header = (field('0', 8) + field('X', 80) + field('X', 80) + field('01.01.20', 8) + field('00.00.00', 8)
+              + field(256 * (n_channels + 1), 8) + field('', 44) + field(n_records, 8) + field(1, 8)
+              + field(n_channels, 4))
+    for values, width in [(edf_ch_names, 16), ([''] * n_channels, 80), (['uV'] * n_channels, 8),
+                          (['-3276.8'] * n_channels, 8), (['3276.7'] * n_channels, 8),
+                          (['-32768'] * n_channels, 8), (['32767'] * n_channels, 8), ([''] * n_channels, 80),
+                          ([edf_sfreq] * n_channels, 8), ([''] * n_channels, 32)]:
+        header += b''.join(field(v, width) for v in values)
+    digital = np.round(data * 10).astype('<i2')
+    records = digital.reshape(n_channels, n_records, edf_sfreq).transpose(1, 0, 2)
+    with open(fn, 'wb') as f:
+        f.write(header + records.tobytes())
+
+
+@pytest.fixture
+def edf_config(tmp_path):
+    data = np.random.default_rng(0).uniform(-1000, 1000, (len(edf_ch_names), 10 * edf_sfreq))
+    fn = str(tmp_path / 'rec.edf')
+    write_edf(fn, data)
+    return {'file_path': fn, 'file_pattern': '*.edf'}
+
+
+def test_probe_channel_names(edf_config):
+    """Channel names come from the header."""
+    assert probe_channel_names(edf_config) == edf_ch_names
+
+
+def test_create_raw_exclude(edf_config):
+    """Excluded channels are not loaded, the other channels are identical to a full load."""
+    raw, _ = create_raw(edf_config, None, ['*.edf'], {}, exclude=['EXG1', 'EXG2'])
+    assert raw.preload
+    assert raw.ch_names == edf_ch_names[:3]
+    full = mne.io.read_raw_edf(edf_config['file_path'], preload=True)
+    np.testing.assert_array_equal(raw.get_data(), full.get_data(picks=edf_ch_names[:3]))
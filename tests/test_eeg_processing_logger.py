@@ -0,0 +1,82 @@
+"""Tests for the eeg_processing_logger module."""
+import json
+
+import pytest
+from eeg_processing_logger import (
+    close_batch_log,
+    end_file_section,
+    json_lines_path,
+    log_file_section,
+    log_message,
+    open_batch_log,
+    start_file_section,
+)
+
+
+def make_config(tmp_path, **settings):
+    """Batch config with a log file in tmp_path."""
+    return {'batch_name': 'batch', 'logfile': str(tmp_path / 'batch.log'), **settings}
+
+
+def read_lines(fn):
+    with open(fn) as f:
+        return f.read().splitlines()
+
+
+def test_messages_are_streamed(tmp_path):
+    """Messages are on disk before the log is closed, a message of both panels once."""
+    config = make_config(tmp_path, log_flush_interval=0)
+    logger = open_batch_log(config)
+    assert not logger['resumed']
+    log_message(logger, 'batch started')
+    start_file_section(logger, 'rec0.txt')
+    log_message(logger, '*** Processing file rec0.txt ***', 'run')
+    log_message(logger, '*** Processing file rec0.txt ***', 'file')
+    assert read_lines(config['logfile']) == ['batch started', '*** Processing file rec0.txt ***']
+    end_file_section(logger, 'failed', seconds=1.25)
+    assert read_lines(config['logfile'])[-1] == '*** File rec0.txt failed (1.2 s) ***'
+    close_batch_log(logger)
+    close_batch_log(logger) # closed already
+
+    logger = open_batch_log(config) # resumed batch: the log is continued
+    assert logger['resumed']
+    log_message(logger, 'resumed')
+    close_batch_log(logger)
+    assert read_lines(config['logfile'])[0] == 'batch started' and read_lines(config['logfile'])[-1] == 'resumed'
+
+
+def test_buffered_until_flush(tmp_path):
+    """Without a due flush the messages are buffered, the end of a file flushes."""
+    config = make_config(tmp_path, log_flush_interval=3600)
+    logger = open_batch_log(config)
+    start_file_section(logger, 'rec0.txt')
+    log_message(logger, 'filtering')
+    assert read_lines(config['logfile']) == []
+    end_file_section(logger, 'done')
+    assert read_lines(config['logfile'])[0] == 'filtering'
+    close_batch_log(logger)
+
+
+def test_json_lines(tmp_path):
+    """With log_json_lines every message is a JSON record with the file it belongs to."""
+    config = make_config(tmp_path, log_json_lines=1)
+    logger = open_batch_log(config)
+    log_message(logger, 'batch started')
+    log_file_section(logger, 'rec1.txt', [('2024-05-01T09:56:45.123', 'file', 'exported')], 'done', seconds=2.0)
+    close_batch_log(logger)
+    records = [json.loads(line) for line in read_lines(json_lines_path(config))]
+    assert [r['event'] for r in records] == ['message', 'file_start', 'message', 'file_end']
+    assert records[0]['file'] is None and records[2]['file'] == 'rec1.txt'
+    assert records[2]['time'] == '2024-05-01T09:56:45.123' and records[2]['panel'] == 'file'
+    assert records[3]['status'] == 'done' and records[3]['seconds'] == 2.0
+
+
+def test_closed_when_flush_fails(tmp_path):
+    """The log files are closed also when writing the buffered lines fails."""
+    config = make_config(tmp_path, log_json_lines=1, log_flush_interval=3600)
+    logger = open_batch_log(config)
+    log_message(logger, 'filtering')
+    logger['lines'].append(None) # not a str: writing fails
+    with pytest.raises(TypeError):
+        close_batch_log(logger)
+    assert logger['file'].closed and logger['events'].closed
@@ -0,0 +1,107 @@
+"""Tests for the eeg_processing_manifest module."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from eeg_processing_manifest import (
+    export_config,
+    file_complete,
+    file_entry,
+    import_config,
+    load_manifest,
+    record_file,
+    write_settings,
+)
+
+
+def make_batch(tmp_path):
+    """Batch config with one processed input file and its output files."""
+    input_file = tmp_path / 'rec.txt'
+    input_file.write_text('1\t2\n')
+    batch_dir = tmp_path / 'batch'
+    file_dir = batch_dir / 'rectxt'
+    file_dir.mkdir(parents=True)
+    (file_dir / 'rec_Epoch_1.txt').write_text('CH1\n1.0\n')
+    config = {'batch_name': 'batch', 'batch_output_subdirectory': str(batch_dir),
+              'file_output_subdirectory': str(file_dir), 'input_file_pattern': '*.txt', 'apply_ica': 0,
+              ('rec.txt', 'bad'): ['CH2'], ('rec.txt', 'timing'): {'start': '2024-01-01T00:00:00', 'seconds': 1.0}}
+    manifest = load_manifest(config)
+    record_file(config, manifest, str(input_file))
+    return config, str(input_file), file_dir
+
+
+def test_file_complete(tmp_path):
+    """A recorded file is complete, also according to the manifest read back from disk."""
+    config, input_file, _ = make_batch(tmp_path)
+    manifest = load_manifest(config)
+    assert file_entry(manifest, 'rec.txt')['outputs'] == {os.path.join('rectxt', 'rec_Epoch_1.txt'): 8}
+    assert file_complete(config, manifest, input_file)
+    assert not file_complete(config, manifest, str(tmp_path / 'other.txt'))
+
+
+def test_file_not_complete(tmp_path):
+    """A changed input file, changed settings or a missing output file make a file incomplete."""
+    config, input_file, file_dir = make_batch(tmp_path)
+    manifest = load_manifest(config)
+    assert not file_complete(dict(config, apply_ica=1), manifest, input_file)
+    assert not file_complete({**config, ('rec.txt', 'bad'): []}, manifest, input_file)
+    with open(input_file, 'a') as f:
+        f.write('3\t4\n')
+    assert not file_complete(config, manifest, input_file)
+
+    record_file(config, manifest, input_file)
+    assert file_complete(config, load_manifest(config), input_file)
+    os.remove(file_dir / 'rec_Epoch_1.txt')
+    assert not file_complete(config, load_manifest(config), input_file)
+
+
+def test_import_export_config(tmp_path):
+    """A config (as in a .pkl) comes back from the manifest with its settings and file entries."""
+    config = {'batch_name': 'batch', 'batch_output_subdirectory': str(tmp_path), 'input_file_names': ['a.txt', 'b.txt'],
+              ('montage', '.bdf_64'): 'biosemi64', ('a.txt', 'bad'): ['CH2', 'CH1'],
+              ('a.txt', 'epochs'): np.array([0, 2, 3]), ('a.txt', 'metrics'): [{'stage': 'load'}],
+              ('a.txt', 'ica'): {'file': 'a.txt-ica.fif', 'fingerprint': 'f', 'exclude': [1, 4]},
+              ('b.txt', 'bad'): []}
+    manifest = load_manifest(config)
+    import_config(config, manifest)
+    exported = export_config(load_manifest(config))
+    assert exported.keys() == config.keys()
+    for key, value in config.items():
+        assert np.array_equal(exported[key], value) if key[1:] == ('epochs',) else exported[key] == value
+    assert not file_entry(manifest, 'a.txt')['completed']
+
+
+def test_record_file_keeps_settings(tmp_path):
+    """Recording a file writes only its own rows, the batch settings are those written at the start."""
+    config, input_file, _ = make_batch(tmp_path)
+    config['input_file_names'] = ['rec.txt']
+    manifest = load_manifest(config)
+    write_settings(config, manifest)
+    assert manifest.execute('SELECT COUNT(*) FROM settings').fetchone()[0] == len(config) - 2 # without the file entries
+    record_file({**config, 'apply_ica': 1, ('rec.txt', 'bad'): ['CH3']}, manifest, input_file)
+    exported = export_config(manifest)
+    assert exported['apply_ica'] == 0 and exported['rec.txt', 'bad'] == ['CH3']
+
+
+def test_concurrent_writers(tmp_path):
+    """Files written at the same time through separate connections all end up in the manifest."""
+    config, _, file_dir = make_batch(tmp_path)
+    config['input_file_names'] = ['rec.txt']
+    write_settings(config, load_manifest(config))
+    inputs = []
+    for k in range(16):
+        fn = tmp_path / f'rec{k}.txt'
+        fn.write_text(str(k))
+        inputs.append(str(fn))
+
+    def record(file_path):
+        file_config = {**config, (os.path.basename(file_path), 'bad'): ['CH1']}
+        manifest = load_manifest(file_config) # one connection per writer, as in the worker processes
+        record_file(file_config, manifest, file_path)
+        manifest.close()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(record, inputs))
+    manifest = load_manifest(config)
+    assert all(file_entry(manifest, os.path.basename(fn))['completed'] for fn in inputs)
+    assert export_config(manifest)['rec7.txt', 'bad'] == ['CH1']
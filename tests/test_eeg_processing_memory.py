@@ -0,0 +1,54 @@
+"""Tests for the eeg_processing_memory module."""
+import os
+
+import mne
+import numpy as np
+import pytest
+from eeg_processing_memory import (
+    create_memory_tracker,
+    fits,
+    raw_nbytes,
+    release,
+    remove_spill_files,
+    require,
+    spill_raw,
+    track,
+)
+
+
+@pytest.fixture
+def raw():
+    """Short random recording with 4 EEG channels."""
+    info = mne.create_info([f'CH{i+1}' for i in range(4)], 100.0, 'eeg')
+    return mne.io.RawArray(np.random.default_rng(0).standard_normal((4, 1000)), info, verbose=False)
+
+
+def make_tracker(budget, spill_directory=''):
+    config = {'memory_budget': budget, 'memory_spill_directory': spill_directory, 'file_name': 'rec.txt'}
+    return create_memory_tracker(config, {'log': lambda msg, panel='run': None})
+
+
+def test_budget(raw):
+    """Signals that do not fit in the budget are refused, without budget everything fits."""
+    memory = make_tracker(1.5 * raw_nbytes(raw))
+    track(memory, 'raw', raw_nbytes(raw))
+    assert not fits(memory, raw_nbytes(raw))
+    with pytest.raises(MemoryError, match='raw_temp'):
+        require(memory, 'raw_temp', raw_nbytes(raw))
+    release(memory, 'raw')
+    require(memory, 'raw_temp', raw_nbytes(raw))
+    assert memory['peak'] == raw_nbytes(raw)
+    assert fits(make_tracker(0), 10**15)
+
+
+def test_spill_raw(tmp_path, raw):
+    """A spilled signal has the same data, no longer counts and its file is removed afterwards."""
+    memory = make_tracker(raw_nbytes(raw), str(tmp_path))
+    track(memory, 'raw', raw_nbytes(raw))
+    raw_spilled = spill_raw(memory, 'raw', raw)
+    np.testing.assert_array_equal(raw_spilled.get_data(), raw.get_data())
+    assert fits(memory, raw_nbytes(raw))
+    assert len(os.listdir(tmp_path)) == 1
+    del raw_spilled
+    remove_spill_files(memory)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,67 @@
+"""Tests for the eeg_processing_metrics module."""
+import csv
+import json
+import time
+
+from eeg_processing_metrics import (
+    create_metrics,
+    finish_metrics,
+    operator_wait,
+    stage,
+    staged_bands,
+    write_batch_metrics,
+)
+
+
+def make_config(tmp_path):
+    """Batch config with one file being processed."""
+    config = {'batch_name': 'batch', 'batch_output_subdirectory': str(tmp_path), 'file_name': 'rec.txt',
+              'input_file_names': ['rec.txt']}
+    return create_metrics(config)
+
+
+def test_stage_records_operator_time(tmp_path):
+    """Operator time within a stage is recorded separately from the compute time."""
+    config = make_config(tmp_path)
+    with stage(config, 'bad channel review'), operator_wait(config):
+        time.sleep(0.05)
+    record = config['metrics']['stages'][0]
+    assert record['stage'] == 'bad channel review'
+    assert record['operator_seconds'] >= 0.05
+    assert record['compute_seconds'] == round(record['wall_seconds'] - record['operator_seconds'], 4)
+    assert record['peak_rss_mb'] is None or record['peak_rss_mb'] > 0
+
+
+def test_stage_without_metrics():
+    """Without metrics (e.g. functions called outside process_file) stages are not recorded."""
+    config = {}
+    with stage(config, 'load') as record, operator_wait(config):
+        pass
+    assert record is None and config == {}
+
+
+def test_staged_bands(tmp_path):
+    """Each band is recorded as a stage named after the band, the end of the bands is not."""
+    config = make_config(tmp_path)
+    bands = [(l_freq, h_freq) for l_freq, h_freq in staged_bands(config, 'filter sensor', [(0.5, 4.0), (4.0, 8.0)])]
+    assert bands == [(0.5, 4.0), (4.0, 8.0)]
+    assert [r['stage'] for r in config['metrics']['stages']] == ['filter sensor 0.5-4.0 Hz', 'filter sensor 4.0-8.0 Hz']
+
+
+def test_finish_and_batch_metrics(tmp_path):
+    """The metrics of a file are written per file and summed per stage for the batch."""
+    config = make_config(tmp_path)
+    for name in ['load', 'export epochs sensor', 'load']:
+        with stage(config, name):
+            pass
+    fn = finish_metrics(config)
+    assert 'metrics' not in config
+    with open(fn) as f:
+        assert [r['stage'] for r in json.load(f)['stages']] == ['load', 'export epochs sensor', 'load']
+
+    fn, summary = write_batch_metrics(config)
+    with open(fn, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 3 and rows[0]['file_name'] == 'rec.txt'
+    assert summary.splitlines()[1].startswith('  load: ')
+    assert len(summary.splitlines()) == 3
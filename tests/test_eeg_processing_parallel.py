@@ -0,0 +1,54 @@
+"""Tests for the eeg_processing_parallel module."""
+import copy
+import os
+
+import pytest
+from eeg_processing_engine import (
+    headless_hooks,
+    load_config,
+    prepare_rerun,
+    run_batch,
+    set_batch_names,
+)
+from eeg_processing_parallel import run_batch_parallel
+from eeg_processing_settings import settings
+from eeg_processing_synthetic import synthetic_raw, write_recording
+
+
+def make_batch(tmp_path, n_files=3):
+    """Config of a new batch with synthetic .bdf recordings, processed without interaction."""
+    paths = [write_recording(synthetic_raw('biosemi32', sfreq=256.0, duration=16.0, seed=k), str(tmp_path / f'rec{k}.bdf'))
+             for k in range(n_files)]
+    config = copy.deepcopy(settings)
+    config.update({'input_file_paths': paths, 'input_file_pattern': '.bdf_32', 'output_directory': str(tmp_path / 'new'),
+                   'batch_prefix': 'batch', 'apply_epoch_selection': 1, 'epoch_length': 4.0, 'apply_output_filtering': 1,
+                   'downsample_factor': 2, 'prefetch_files': 0, 'background_stages': 0})
+    return set_batch_names(config)
+
+
+def output_files(config):
+    """Contents of the output files of a batch, by path relative to the batch directory."""
+    batch_dir = config['batch_output_subdirectory']
+    files = {}
+    for root, _, fns in os.walk(batch_dir):
+        for fn in fns:
+            if root != batch_dir: # files of the recordings, not the log, manifest or .pkl of the batch
+                with open(os.path.join(root, fn), 'rb') as f:
+                    files[os.path.relpath(os.path.join(root, fn), batch_dir)] = f.read()
+    return files
+
+
+@pytest.mark.filterwarnings('ignore:No bad channels to interpolate')
+def test_parallel_rerun_matches_sequential(tmp_path):
+    """A rerun with 2 spawn worker processes writes the same output files as a sequential rerun."""
+    hooks = dict(headless_hooks(), log=lambda msg, panel='run': None)
+    config = run_batch(make_batch(tmp_path), hooks)
+
+    sequential = run_batch(prepare_rerun(config['config_file'], str(tmp_path / 'sequential')), hooks)
+    parallel = run_batch_parallel(prepare_rerun(config['config_file'], str(tmp_path / 'parallel')), 2, hooks=hooks)
+    expected = output_files(sequential)
+    assert len(expected) > 3 * 4 and output_files(parallel) == expected
+    merged = load_config(parallel['config_file'])
+    assert merged['input_file_names'] == ['rec0.bdf', 'rec1.bdf', 'rec2.bdf']
+    for file_name in merged['input_file_names']:
+        assert list(merged[file_name, 'epochs']) == list(sequential[file_name, 'epochs'])
@@ -0,0 +1,59 @@
+"""Tests for the eeg_processing_prefetch module."""
+import numpy as np
+from eeg_processing_engine import headless_hooks
+from eeg_processing_filters import broadband_filter, filter_raw
+from eeg_processing_io import create_raw
+from eeg_processing_prefetch import (
+    close_prefetcher,
+    create_prefetcher,
+    schedule_prefetch,
+    take_prefetched,
+    use_prefetched,
+)
+from eeg_processing_synthetic import synthetic_raw, write_recording
+
+
+def make_batch(tmp_path, n_files=3):
+    """Batch config with .bdf recordings, channels to be dropped selected."""
+    paths = [write_recording(synthetic_raw('biosemi32', sfreq=128.0, duration=10.0, seed=k), str(tmp_path / f'rec{k}.bdf'))
+             for k in range(n_files)]
+    config = {'file_pattern': '*.bdf', 'sample_frequency': 128.0, 'channel_names': [], 'rerun': 0,
+              'channels_to_be_dropped_selected': 1, 'channels_to_be_dropped': ['Fp1'], 'apply_ica': 1,
+              'apply_beamformer': 0, 'prefetch_files': 1}
+    return config, paths
+
+
+def test_prefetch(tmp_path):
+    """Prefetched recordings are loaded and filtered as process_file would, at most depth ahead."""
+    config, paths = make_batch(tmp_path)
+    assert create_prefetcher(dict(config, prefetch_files=0), paths, None, []) is None
+    assert create_prefetcher(dict(config, memory_budget=10**9), paths, None, []) is None
+    prefetcher = create_prefetcher(config, paths, None, [])
+    try:
+        assert take_prefetched(prefetcher, paths[0], headless_hooks()) is None # current file, not prefetched
+        schedule_prefetch(prefetcher, config)
+        assert list(prefetcher['pending']) == [paths[1]]
+
+        hooks = headless_hooks()
+        raw, raw_temp, filter_cache = use_prefetched(take_prefetched(prefetcher, paths[1], hooks), config, hooks)
+        expected, _ = create_raw(dict(config, file_path=paths[1]), None, [], hooks, exclude=['Fp1'])
+        assert raw.ch_names == expected.ch_names and 'Fp1' not in raw.ch_names
+        np.testing.assert_array_equal(raw.get_data(), expected.get_data())
+        np.testing.assert_array_equal(raw_temp.get_data(), filter_raw(expected, **broadband_filter).get_data())
+        assert len(filter_cache) == 1
+
+        schedule_prefetch(prefetcher, config)
+        assert list(prefetcher['pending']) == [paths[2]] and not prefetcher['file_paths']
+    finally:
+        close_prefetcher(prefetcher)
+    assert not prefetcher['pending']
+
+
+def test_no_prefetch_before_channel_selection(tmp_path):
+    """In a new batch nothing is prefetched before the channels to be dropped are selected."""
+    config, paths = make_batch(tmp_path, n_files=2)
+    config['channels_to_be_dropped_selected'] = 0
+    prefetcher = create_prefetcher(config, paths, None, [])
+    schedule_prefetch(prefetcher, config)
+    assert not prefetcher['pending']
+    close_prefetcher(prefetcher)
@@ -0,0 +1,31 @@
+"""Tests for the eeg_processing_resampling module."""
+import mne
+import numpy as np
+import pytest
+from eeg_processing_resampling import resample_raw, resampling_plan
+
+
+def test_resampling_plan():
+    """Integer ratios are resampled polyphase with 'auto', old batches (no setting) with the FFT."""
+    plan = resampling_plan({'sample_frequency': 2048, 'downsample_factor': 8, 'resample_method': 'auto'})
+    assert plan['temp'] == {'sfreq': 2048, 'new_sfreq': 512, 'method': 'polyphase'}
+    assert plan['output'] == {'sfreq': 2048, 'new_sfreq': 256, 'method': 'polyphase'}
+    plan = resampling_plan({'sample_frequency': 2000, 'downsample_factor': 3, 'resample_method': 'auto'})
+    assert plan['temp']['new_sfreq'] == 500 and plan['temp']['method'] == 'polyphase'
+    assert plan['output'] == {'sfreq': 2000, 'new_sfreq': 666, 'method': 'fft'}
+    plan = resampling_plan({'sample_frequency': 256, 'downsample_factor': 1})
+    assert plan == {'temp': None, 'output': None}
+    assert resampling_plan({'sample_frequency': 2048, 'downsample_factor': 2})['output']['method'] == 'fft'
+    with pytest.raises(ValueError, match='resample_method'):
+        resampling_plan({'sample_frequency': 2048, 'downsample_factor': 2, 'resample_method': 'linear'})
+
+
+def test_resample_raw_once():
+    """A signal is resampled once; a copy carries the record, so it is not resampled again either."""
+    info = mne.create_info(['CH1', 'CH2'], 1024.0, 'eeg')
+    raw = mne.io.RawArray(np.random.default_rng(0).standard_normal((2, 4096)), info, verbose=False)
+    step = {'sfreq': 1024.0, 'new_sfreq': 256.0, 'method': 'polyphase'}
+    raw = resample_raw(raw, step)
+    assert raw.info['sfreq'] == 256.0 and raw.n_times == 1024
+    with pytest.raises(RuntimeError, match='already resampled'):
+        resample_raw(raw.copy(), dict(step, sfreq=256.0, new_sfreq=128.0))
@@ -0,0 +1,91 @@
+"""Tests for the eeg_processing_scheduler module."""
+import threading
+
+import pytest
+from eeg_processing_engine import headless_hooks
+from eeg_processing_scheduler import (
+    buffered_hooks,
+    close_scheduler,
+    completed_outputs,
+    create_scheduler,
+    output_pending,
+    schedule_output,
+)
+
+
+def export(name, release, config, hooks):
+    """Output of a file: waits for release, sets an entry of the file and a batch entry."""
+    release.wait(10)
+    hooks['log']('exported ' + name, 'file')
+    if name == 'bad':
+        raise ValueError('export failed')
+    config[name, 'timing'] = {'seconds': 1.0}
+    config['downsampled_sample_frequency'] = 128
+    return config
+
+
+def test_no_scheduler():
+    """No background stages when they are off or with a memory budget."""
+    assert create_scheduler({'background_stages': 0}) is None
+    assert create_scheduler({'background_stages': 1, 'memory_budget': 10**9}) is None
+    assert not output_pending(None, 'rec0.txt')
+    assert list(completed_outputs(None, wait_all=True)) == []
+    close_scheduler(None)
+
+
+def test_buffered_hooks():
+    """Messages of a background stage are kept with their time, other hooks are passed on."""
+    messages = []
+    hooks = buffered_hooks(headless_hooks(), messages)
+    hooks['log']('filtering')
+    hooks['log']('exported', 'file')
+    hooks['progress']('epochs', 1, 1)
+    assert [(panel, msg) for _, panel, msg in messages] == [('run', 'filtering'), ('file', 'exported')]
+
+
+def test_outputs_in_file_order():
+    """Outputs are yielded in file order when done, with their entries and messages, and recorded when done."""
+    recorded = []
+    scheduler = create_scheduler({'background_stages': 1}, on_output=lambda path, cfg: recorded.append((path, cfg)))
+    config = {'sample_frequency': 256, 'input_file_names': ['rec0', 'rec1'], 'file_name': 'rec0',
+              ('rec0', 'bad'): ['CH1'], ('rec1', 'bad'): []}
+    try:
+        release = threading.Event()
+        schedule_output(scheduler, 'rec0.txt', export, config, headless_hooks(), 'rec0', release)
+        assert output_pending(scheduler, 'rec0.txt')
+        config['rec0', 'bad'].append('CH2') # changed by the main thread: not in the copy of the output
+        config['sample_frequency'] = 512
+        assert list(completed_outputs(scheduler)) == [] and not recorded # not done yet
+        release.set()
+        config['file_name'] = 'rec1'
+        schedule_output(scheduler, 'rec1.txt', export, config, headless_hooks(), 'rec1', release)
+
+        (path0, updates0, messages0, error0), (path1, _, _, error1) = completed_outputs(scheduler, wait_all=True)
+        assert (path0, path1) == ('rec0.txt', 'rec1.txt') and error0 is None and error1 is None
+        assert updates0 == {('rec0', 'timing'): {'seconds': 1.0}, 'downsampled_sample_frequency': 128}
+        assert [msg for _, _, msg in messages0] == ['exported rec0']
+        assert [path for path, _ in recorded] == ['rec0.txt', 'rec1.txt']
+        assert recorded[0][1]['rec0', 'bad'] == ['CH1'] and recorded[0][1]['sample_frequency'] == 256
+        assert ('rec1', 'bad') not in recorded[0][1] # entries of the other files are not copied
+        assert config['sample_frequency'] == 512 and not output_pending(scheduler, 'rec0.txt')
+    finally:
+        close_scheduler(scheduler)
+
+
+def test_failed_output():
+    """A failed output is not recorded, is yielded with its traceback and stops the next output."""
+    recorded = []
+    scheduler = create_scheduler({'background_stages': 1}, on_output=lambda path, cfg: recorded.append(path))
+    config = {'input_file_names': ['bad', 'rec1'], 'file_name': 'bad'}
+    release = threading.Event()
+    release.set()
+    try:
+        schedule_output(scheduler, 'bad.txt', export, config, headless_hooks(), 'bad', release)
+        with pytest.raises(RuntimeError, match='Output of bad.txt in the background failed'):
+            schedule_output(scheduler, 'rec1.txt', export, dict(config, file_name='rec1'), headless_hooks(),
+                            'rec1', release)
+        [(path, updates, messages, error)] = completed_outputs(scheduler, wait_all=True)
+        assert path == 'bad.txt' and updates == {} and messages and 'ValueError: export failed' in error
+        assert not recorded
+    finally:
+        close_scheduler(scheduler)
@@ -0,0 +1,73 @@
+"""Tests for the eeg_processing_shards module."""
+import os
+
+import pytest
+from eeg_processing_engine import load_config, write_config_file, write_log_file
+from eeg_processing_manifest import (
+    file_entry,
+    load_manifest,
+    record_file,
+    write_settings,
+)
+from eeg_processing_shards import merge_shards, plan_shards, shard_config, split_batch
+
+
+def make_batch(tmp_path, sizes=(40, 20, 30, 10, 25)):
+    """Batch config with .txt input files of the given sizes (bytes)."""
+    paths = []
+    for k, size in enumerate(sizes):
+        fn = tmp_path / f'rec{k}.txt'
+        fn.write_bytes(b'1' * size)
+        paths.append(str(fn))
+    batch_dir = tmp_path / 'batch'
+    batch_dir.mkdir()
+    return {'batch_name': 'batch', 'batch_output_subdirectory': str(batch_dir), 'file_pattern': '*.txt',
+            'input_file_paths': paths, 'input_file_names': [], 'config_file': str(batch_dir / 'batch.pkl'),
+            'logfile': str(batch_dir / 'batch.log')}
+
+
+def test_plan_shards(tmp_path):
+    """Files are assigned round robin by index, or longest first to the smallest shard by size."""
+    config = make_batch(tmp_path)
+    paths = config['input_file_paths']
+    shards, totals = plan_shards(config, 2)
+    assert shards == [[paths[0], paths[2], paths[4]], [paths[1], paths[3]]]
+    shards, totals = plan_shards(config, 2, by='size')
+    assert shards == [[paths[0], paths[1]], [paths[2], paths[3], paths[4]]]
+    assert totals == [60, 65]
+    assert plan_shards(config, 2, by='size') == (shards, totals) # deterministic
+    with pytest.raises(ValueError):
+        plan_shards(config, 2, by='name')
+
+
+def test_merge_shards(tmp_path):
+    """Results of the shards that ran are merged, the files of a shard that did not run are reported."""
+    config, _ = split_batch(make_batch(tmp_path), 2)
+    shard = shard_config(config, 0)
+    assert shard['batch_name'] == 'batch_shard0' and shard['input_file_paths'] == config['shards']['file_paths'][0]
+    with pytest.raises(ValueError):
+        shard_config(config, 2)
+
+    manifest = load_manifest(shard)
+    write_settings(shard, manifest)
+    for file_path in shard['input_file_paths']: # processing of the shard
+        file_name = os.path.basename(file_path)
+        file_dir = tmp_path / 'batch' / file_name.replace('.', '')
+        file_dir.mkdir()
+        (file_dir / 'out.txt').write_text('1.0\n')
+        shard.update({'file_output_subdirectory': str(file_dir), (file_name, 'bad'): ['CH1']})
+        shard['input_file_names'].append(file_name)
+        record_file(shard, manifest, file_path)
+    write_config_file(shard)
+    write_log_file(shard, ['shard 0 log'], [])
+
+    with pytest.raises(RuntimeError, match='2 file'):
+        merge_shards(config['config_file'], hooks={'log': lambda msg, panel='run': None})
+    merged = load_config(config['config_file'])
+    assert merged['batch_name'] == 'batch'
+    assert merged['input_file_names'] == ['rec0.txt', 'rec2.txt', 'rec4.txt']
+    assert merged['rec2.txt', 'bad'] == ['CH1']
+    assert file_entry(load_manifest(merged), 'rec4.txt')['completed']
+    assert file_entry(load_manifest(merged), 'rec1.txt') is None
+    with open(merged['logfile']) as f:
+        assert 'shard 0 log' in f.read()
@@ -0,0 +1,36 @@
+"""Tests for the eeg_processing_synthetic module."""
+import os
+
+import mne
+import numpy as np
+import pytest
+from eeg_processing_engine import headless_hooks
+from eeg_processing_io import create_raw
+from eeg_processing_synthetic import synthetic_raw, write_recording
+
+
+def test_synthetic_raw():
+    """Same arguments give the same recording, with the montage's channels and the bad channels marked."""
+    raw = synthetic_raw('biosemi32', sfreq=128.0, duration=20.0, seed=3)
+    assert raw.ch_names == mne.channels.make_standard_montage('biosemi32').ch_names
+    assert raw.n_times == 20 * 128
+    assert len(raw.info['bads']) == 2
+    assert np.array_equal(raw.get_data(), synthetic_raw('biosemi32', sfreq=128.0, duration=20.0, seed=3).get_data())
+    assert not np.array_equal(raw.get_data(), synthetic_raw('biosemi32', sfreq=128.0, duration=20.0, seed=4).get_data())
+    raw = synthetic_raw(None, n_channels=8, duration=5.0, artefacts=())
+    assert raw.ch_names == [f'CH{i+1}' for i in range(8)] and raw.info['bads'] == []
+    with pytest.raises(ValueError, match='artefact'):
+        synthetic_raw(artefacts=('sweat',))
+
+
+@pytest.mark.parametrize('extension, tolerance', [('.txt', 1e-10), ('.edf', 1e-8), ('.bdf', 1e-10),
+                                                  ('.vhdr', 1e-10), ('_raw.fif', 1e-10)])
+def test_write_recording(tmp_path, extension, tolerance):
+    """Written recordings are read back by create_raw (within the resolution of the format)."""
+    raw = synthetic_raw('biosemi32', sfreq=128.0, duration=10.0)
+    fn = write_recording(raw, str(tmp_path / ('rec' + extension)), header=True)
+    config = {'file_path': fn, 'file_pattern': '*' + os.path.splitext(fn)[1],
+              'sample_frequency': 128.0, 'channel_names': [], 'txt_binary_cache': 0}
+    raw_read, _ = create_raw(config, None, [config['file_pattern']], headless_hooks())
+    assert raw_read.ch_names == raw.ch_names
+    np.testing.assert_allclose(raw_read.get_data(), raw.get_data(), rtol=0, atol=tolerance)
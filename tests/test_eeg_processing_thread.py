@@ -0,0 +1,67 @@
+"""Tests for the eeg_processing_thread module."""
+import queue
+import threading
+
+import pytest
+from eeg_processing_engine import headless_hooks
+from eeg_processing_thread import (
+    PostedStream,
+    batch_done_event,
+    handle_hook_event,
+    hook_event,
+    log_event,
+    start_batch_thread,
+    thread_hooks,
+)
+
+
+def test_thread_hooks_run_on_gui_thread():
+    """Hook calls of the worker are handled on the GUI thread, interactive hooks return their result."""
+    events = queue.Queue()
+    handled = []
+    def select(names):
+        handled.append(('select', threading.current_thread()))
+        return names[:1]
+    hooks = dict(headless_hooks(), log=lambda msg, panel='run': handled.append((msg, threading.current_thread())),
+                 select_channels_to_be_dropped=select)
+    worker_hooks = thread_hooks(hooks, lambda event, value: events.put((event, value)))
+    assert worker_hooks['interact'] is not None and thread_hooks({'x': None}, None) == {'x': None}
+
+    results = []
+    def worker():
+        worker_hooks['log']('started', 'run')
+        results.append(worker_hooks['select_channels_to_be_dropped'](['Fp1', 'Fp2']))
+        with pytest.raises(ZeroDivisionError): # raised in the worker, not on the GUI thread
+            worker_hooks['interact'](lambda: 1 / 0)
+        events.put(('done', None))
+    thread = threading.Thread(target=worker)
+    thread.start()
+    while True: # event loop of the GUI
+        event, value = events.get(timeout=5)
+        if event == 'done':
+            break
+        assert event == hook_event
+        handle_hook_event(hooks, value)
+    thread.join()
+    assert results == [['Fp1']]
+    assert [msg for msg, _ in handled] == ['started', 'select']
+    assert all(t is threading.main_thread() for _, t in handled)
+
+
+def test_batch_thread_posts_traceback():
+    """A batch that fails posts its traceback when it ends."""
+    events = queue.Queue()
+    start_batch_thread({}, headless_hooks(), lambda event, value: events.put((event, value))).join()
+    event, (config, error) = events.get_nowait()
+    assert event == batch_done_event and config is None and 'KeyError' in error
+
+
+def test_posted_stream():
+    """Printed output is posted per complete line."""
+    events = []
+    stream = PostedStream(lambda event, value: events.append((event, value)))
+    stream.write('temp. sample fr:')
+    stream.write(' 500\nnext')
+    assert events == [(log_event, ('temp. sample fr: 500', 'run'))]
+    stream.flush()
+    assert events[-1] == (log_event, ('next', 'run'))
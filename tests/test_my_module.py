@@ -1,6 +1,8 @@
 """Tests for the eeg_preprocessing_umcu.my_module module."""
 import pytest
-from eeg_preprocessing_umcu.my_module import hello
+
+# my_module is the example module of the project template, it is not in the package (yet)
+hello = pytest.importorskip('eeg_preprocessing_umcu.my_module').hello
 
 
 def test_hello():